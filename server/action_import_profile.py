@@ -0,0 +1,130 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Reports how long a cold start of the cloud function takes to import what each action needs.
+#
+# For each action in cf_action.ACTION_FN_PATHS, a new python process imports main, which is what the
+# cloud function does when it starts, and then looks up the action's function, which imports its
+# module. Python's -X importtime output is used to find the packages that took the longest.
+#
+# Usage, from the server directory:
+#   python action_import_profile.py
+#   python action_import_profile.py --actions delete_video,create_tflite --runs 3 --output profile.json
+
+# Python Standard Library
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+
+# My Modules
+import cf_action
+
+
+TOP_PACKAGE_COUNT = 5
+
+# The code that is run in the new process.
+CHILD_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+main_seconds = time.perf_counter() - start
+import cf_action
+start = time.perf_counter()
+cf_action.get_action_fn(sys.argv[1])
+action_seconds = time.perf_counter() - start
+print(json.dumps({'main_seconds': main_seconds, 'action_seconds': action_seconds}))
+'''
+
+IMPORT_TIME_PATTERN = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def __parse_import_times(stderr):
+    # Only the packages that were imported directly, not the modules that they imported.
+    dict_package_to_seconds = {}
+    for line in stderr.splitlines():
+        m = IMPORT_TIME_PATTERN.match(line)
+        if m is None or len(m.group(3)) != 1:
+            continue
+        package = m.group(4).split('.')[0]
+        dict_package_to_seconds[package] = dict_package_to_seconds.get(package, 0) + int(m.group(2)) / 1000000
+    return dict_package_to_seconds
+
+
+def profile_action(action_name):
+    server_dir = os.path.dirname(os.path.realpath(__file__))
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD_CODE, action_name],
+        cwd=server_dir, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError('Profiling %s failed: %s' % (action_name, completed.stderr.splitlines()[-1:]))
+    result = json.loads(completed.stdout.splitlines()[-1])
+    result['package_seconds'] = __parse_import_times(completed.stderr)
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Report the import time of each action in a cold start.')
+    parser.add_argument('--actions', default=','.join(cf_action.ACTION_FN_PATHS.keys()),
+        help='Comma separated action names. Default: all actions.')
+    parser.add_argument('--runs', type=int, default=1,
+        help='Number of cold starts to measure for each action. The median is reported.')
+    parser.add_argument('--output',
+        help='File to write the JSON results to. Default: standard output.')
+    args = parser.parse_args(argv)
+
+    action_names = args.actions.split(',')
+    for action_name in action_names:
+        if action_name not in cf_action.ACTION_FN_PATHS:
+            parser.error('Unknown action %s. Choose from %s.' % (action_name, ', '.join(cf_action.ACTION_FN_PATHS)))
+
+    actions = []
+    for action_name in action_names:
+        results = [profile_action(action_name) for i in range(args.runs)]
+        # The packages that took the longest to import in the first run.
+        package_seconds = results[0]['package_seconds']
+        top_packages = sorted(package_seconds.items(), key=lambda item: -item[1])[:TOP_PACKAGE_COUNT]
+        main_seconds = statistics.median(r['main_seconds'] for r in results)
+        action_seconds = statistics.median(r['action_seconds'] for r in results)
+        actions.append({
+            'action_name': action_name,
+            'action_fn_path': cf_action.ACTION_FN_PATHS[action_name],
+            'main_import_seconds': round(main_seconds, 4),
+            'action_import_seconds': round(action_seconds, 4),
+            'cold_start_import_seconds': round(main_seconds + action_seconds, 4),
+            'slowest_packages': [{'package': p, 'seconds': round(s, 4)} for p, s in top_packages],
+        })
+        sys.stderr.write('%s: %.3f seconds\n' % (action_name, main_seconds + action_seconds))
+
+    report = {
+        'python_version': platform.python_version(),
+        'machine': platform.machine(),
+        'runs': args.runs,
+        'actions': sorted(actions, key=lambda a: -a['cold_start_import_seconds']),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
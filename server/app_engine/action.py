@@ -16,14 +16,18 @@ __author__ = "lizlooney@google.com (Liz Looney)"
 
 # Python Standard Library
 from datetime import datetime, timedelta, timezone
+import hashlib
 import json
 import logging
+import time
+import traceback
 import uuid
 
 # Other Modules
 import psutil
 
 # My Modules
+import action_scheduler
 import constants
 import storage
 import util
@@ -41,6 +45,9 @@ ACTION_UUID = 'action_uuid'
 ACTION_IS_ADMIN_ACTION = 'action_is_admin_action'
 ACTION_TIME_LIMIT = 'action_time_limit'
 ACTION_RETRIGGERED = 'action_retriggered'
+ACTION_FAN_OUT_UUID = 'action_fan_out_uuid'
+ACTION_FAN_OUT_WORKER_INDEX = 'action_fan_out_worker_index'
+ACTION_CHECKPOINT = 'action_checkpoint'
 
 # ACTION_NAME values
 ACTION_NAME_TEST = 'test' # For debugging purposes only
@@ -54,6 +61,7 @@ ACTION_NAME_DATASET_ZIP = 'dataset_zip'
 ACTION_NAME_DATASET_ZIP_PARTITION = 'dataset_zip_partition'
 ACTION_NAME_MONITOR_TRAINING = 'monitor_training'
 ACTION_NAME_CREATE_TFLITE = 'create_tflite'
+ACTION_NAME_PRELABEL_VIDEO = 'prelabel_video'
 ACTION_NAME_DELETE_MODEL = 'delete_model'
 ACTION_NAME_DELETE_DATASET = 'delete_dataset'
 ACTION_NAME_DELETE_VIDEO = 'delete_video'
@@ -61,12 +69,40 @@ ACTION_NAME_RESET_REMAINING_TRAINING_MINUTES = 'reset_remaining_training_minutes
 ACTION_NAME_INCREMENT_REMAINING_TRAINING_MINUTES = 'increment_remaining_training_minutes'
 ACTION_NAME_SAVE_END_OF_SEASON_ENTITIES = 'save_end_of_season_entities'
 ACTION_NAME_RESET_TEAM_ENTITIES = 'reset_team_entities'
+ACTION_NAME_DELETE_STALE_ACTIONS = 'delete_stale_actions'
+
+# The priority class of each action. Actions that are not listed here are PRIORITY_ADMIN.
+# monitor_training spends most of its time waiting for the training job, and delete_stale_actions
+# starts the queued actions whose places were held by killed actions, so they are never queued.
+ACTION_PRIORITIES = {
+    ACTION_NAME_WAIT_FOR_VIDEO_UPLOAD: action_scheduler.PRIORITY_INTERACTIVE,
+    ACTION_NAME_TRACKING: action_scheduler.PRIORITY_INTERACTIVE,
+    ACTION_NAME_MONITOR_TRAINING: action_scheduler.PRIORITY_INTERACTIVE,
+    ACTION_NAME_DELETE_STALE_ACTIONS: action_scheduler.PRIORITY_INTERACTIVE,
+    ACTION_NAME_FRAME_EXTRACTION: action_scheduler.PRIORITY_EXTRACTION,
+    ACTION_NAME_PRELABEL_VIDEO: action_scheduler.PRIORITY_EXTRACTION,
+    ACTION_NAME_DATASET_PRODUCE: action_scheduler.PRIORITY_DATASET,
+    ACTION_NAME_DATASET_PRODUCE_RECORD: action_scheduler.PRIORITY_DATASET,
+    ACTION_NAME_DELETE_DATASET_RECORD_WRITERS: action_scheduler.PRIORITY_DATASET,
+    ACTION_NAME_CREATE_TFLITE: action_scheduler.PRIORITY_DATASET,
+    ACTION_NAME_DATASET_ZIP: action_scheduler.PRIORITY_ZIP,
+    ACTION_NAME_DATASET_ZIP_PARTITION: action_scheduler.PRIORITY_ZIP,
+}
+
+# A work item is leased for longer than a cloud function can run, so a worker never loses the lease
+# on an item it is still working on. If a worker is killed, the item is claimed again after the lease
+# expires, up to FAN_OUT_MAX_ATTEMPTS times.
+FAN_OUT_LEASE_SECONDS = 600
+FAN_OUT_MAX_ATTEMPTS = 3
+# How often the watching worker checks whether the items leased by other workers are done.
+FAN_OUT_WATCH_SECONDS = 30
 
 def create_action_parameters(team_uuid, action_name):
     if (action_name == ACTION_NAME_RESET_REMAINING_TRAINING_MINUTES or
             action_name == ACTION_NAME_INCREMENT_REMAINING_TRAINING_MINUTES or
             action_name == ACTION_NAME_SAVE_END_OF_SEASON_ENTITIES or
             action_name == ACTION_NAME_RESET_TEAM_ENTITIES or
+            action_name == ACTION_NAME_DELETE_STALE_ACTIONS or
             action_name == ACTION_NAME_TEST):
         is_admin_action = True
     else:
@@ -79,69 +115,186 @@ def create_action_parameters(team_uuid, action_name):
 
 
 def trigger_action_via_blob(action_parameters_arg):
-    # Copy the given action_parameters and remove the ACTION_TIME_LIMIT and ACTION_RETRIGGERED
-    # fields from the copy.
+    # Copy the given action_parameters and remove the ACTION_TIME_LIMIT, ACTION_RETRIGGERED, and
+    # ACTION_CHECKPOINT fields from the copy. The checkpoint is stored by retrigger_now, not in the
+    # action parameters blob.
     action_parameters = action_parameters_arg.copy()
     action_parameters.pop(ACTION_TIME_LIMIT, None)
     action_parameters.pop(ACTION_RETRIGGERED, None)
+    action_parameters.pop(ACTION_CHECKPOINT, None)
 
     # Create the action_entity.
     if ACTION_UUID not in action_parameters:
         team_uuid = action_parameters[ACTION_TEAM_UUID]
         action_name = action_parameters[ACTION_NAME]
         is_admin_action = action_parameters[ACTION_IS_ADMIN_ACTION]
-        # Check whether there is already an action with these parameters.
-        action_entities = storage.retrieve_action_list(team_uuid, action_name)
-        found_existing_action = False
-        for action_entity in action_entities:
-            action_entity_parameters = action_entity['action_parameters']
-            # Only check the parameters that are in action_parameters. action_entity_parameters
-            # has additional parameters that are added after the action starts.
-            parameters_equal = True
-            for key in action_parameters:
-                if key not in action_entity_parameters:
-                    parameters_equal = False
-                    break
-                if action_parameters[key] != action_entity_parameters[key]:
-                    parameters_equal = False
-                    break
-            if parameters_equal:
-                time = action_entity['create_time']
-                len_start_times = len(action_entity['start_times'])
-                if len_start_times > 0:
-                    len_stop_times = len(action_entity['stop_times'])
-                    if len_start_times > len_stop_times:
-                        time = action_entity['start_times'][len_start_times-1]
-                    else:
-                        time = action_entity['stop_times'][len_stop_times-1]
-                time_delta = datetime.now(timezone.utc) - time
-                if time_delta > timedelta(minutes=15):
-                    logging.warning('action.trigger_action_via_blob - %s - found duplicate action that is %s old' %
-                            (action_name, str(time_delta)))
-                    storage.action_on_remove_old_action(action_entity)
-                else:
-                    found_existing_action = True
-                    break
-        if found_existing_action:
+        # storage.action_on_create returns None if there is already an action with these
+        # parameters.
+        action_uuid = storage.action_on_create(
+            team_uuid, action_name, is_admin_action, action_parameters, __fingerprint(action_parameters))
+        if action_uuid is None:
             logging.warning('action.trigger_action_via_blob - %s - ignoring duplicate action' %
                     action_name)
             return
-        action_parameters[ACTION_UUID] = storage.action_on_create(
-            team_uuid, action_name, is_admin_action, action_parameters)
+        action_parameters[ACTION_UUID] = action_uuid
+
+        # Give the new action to the scheduler, which starts it now or queues it.
+        priority = get_priority(action_name)
+        if priority != action_scheduler.PRIORITY_INTERACTIVE:
+            started_actions = storage.action_scheduler_submit(
+                action_uuid, team_uuid, action_name, priority, json.dumps(action_parameters))
+            if len(started_actions) == 0:
+                logging.info('action.trigger_action_via_blob - %s - queued' % action_name)
+            __start_actions(started_actions)
+            return action_uuid
+
+    # A retriggered action keeps its place in the scheduler.
+    __start_actions([(action_parameters[ACTION_NAME], json.dumps(action_parameters))])
+    return action_parameters[ACTION_UUID]
+
+
+def get_priority(action_name):
+    return ACTION_PRIORITIES.get(action_name, action_scheduler.PRIORITY_ADMIN)
+
 
-    # Write the copied action_parameters to trigger the cloud function.
-    action_parameters_blob_name= '%s/%s' % (action_parameters[ACTION_NAME], str(uuid.uuid4().hex))
-    action_parameters_json = json.dumps(action_parameters)
+# __start_actions writes the action parameters to trigger the cloud function. started_actions is a
+# list of tuples of the action name and the action parameters json.
+def __start_actions(started_actions):
+    for action_name, action_parameters_json in started_actions:
+        action_parameters_blob_name = '%s/%s' % (action_name, str(uuid.uuid4().hex))
+        logging.info('action.trigger_action_via_blob - %s' % action_name)
+        __transport_fn(action_parameters_blob_name, action_parameters_json)
+
+
+# on_finish tells the scheduler that the action has finished, and starts the queued actions that
+# can start now. If the scheduler can't be updated, the action's place is given up when its lease
+# expires.
+def on_finish(action_parameters):
+    priority = get_priority(action_parameters[ACTION_NAME])
+    if priority == action_scheduler.PRIORITY_INTERACTIVE:
+        return
+    try:
+        started_actions = storage.action_scheduler_finish(action_parameters[ACTION_UUID], priority)
+    except:
+        logging.critical('action.on_finish - %s exception!!! traceback: %s' %
+            (action_parameters[ACTION_NAME], traceback.format_exc().replace('\n', ' ... ')))
+        return
+    __start_actions(started_actions)
+
+
+# dispatch_queued_actions starts the queued actions of each priority class that can start because
+# the leases of killed actions have expired.
+def dispatch_queued_actions():
+    for priority in action_scheduler.MAX_RUNNING_ACTIONS.keys():
+        __start_actions(storage.action_scheduler_dispatch(priority))
+
+
+# The transport delivers the action parameters to the cloud function. The default transport writes
+# them to a blob in BUCKET_ACTION_PARAMETERS, which triggers main.perform_action. set_transport
+# replaces it, for example with local_backend.LocalExecutor, which runs the actions in this process.
+def upload_action_parameters(action_parameters_blob_name, action_parameters_json):
     blob = util.storage_client().bucket(BUCKET_ACTION_PARAMETERS).blob(action_parameters_blob_name)
-    logging.info('action.trigger_action_via_blob - %s' % action_parameters[ACTION_NAME])
     blob.upload_from_string(action_parameters_json, content_type="text/json")
-    return action_parameters[ACTION_UUID]
+
+
+__transport_fn = upload_action_parameters
+
+
+def set_transport(transport_fn):
+    global __transport_fn
+    __transport_fn = transport_fn
+
+
+# The fingerprint is the same for parameters that are equal, regardless of the order of the keys.
+def __fingerprint(action_parameters):
+    canonical_json = json.dumps(action_parameters, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical_json.encode('utf-8')).hexdigest()
+
+
+# trigger_fan_out writes one manifest holding all the work items and triggers worker_count worker
+# actions, instead of one action per work item. Each worker is given a copy of action_parameters
+# and calls perform_fan_out_work.
+def trigger_fan_out(action_parameters, work_items, worker_count):
+    if len(work_items) == 0:
+        return None
+    fan_out_uuid = storage.fan_out_on_create(
+        action_parameters[ACTION_TEAM_UUID], action_parameters[ACTION_NAME], work_items)
+    # More workers than the scheduler lets a team run at once would only wait in the queue.
+    worker_count = min(worker_count, action_scheduler.MAX_RUNNING_ACTIONS_PER_TEAM)
+    for worker_index in range(max(min(worker_count, len(work_items)), 1)):
+        worker_action_parameters = action_parameters.copy()
+        worker_action_parameters[ACTION_FAN_OUT_UUID] = fan_out_uuid
+        worker_action_parameters[ACTION_FAN_OUT_WORKER_INDEX] = worker_index
+        trigger_action_via_blob(worker_action_parameters)
+    return fan_out_uuid
+
+
+# perform_fan_out_work claims work items from the manifest, one at a time, and calls work_fn with
+# the action_parameters updated with the work item, until there are no more items. An item is only
+# claimed if there are at least min_seconds_per_item left; otherwise the worker is retriggered.
+def perform_fan_out_work(action_parameters, work_fn, min_seconds_per_item):
+    fan_out_uuid = action_parameters[ACTION_FAN_OUT_UUID]
+    worker_index = action_parameters[ACTION_FAN_OUT_WORKER_INDEX]
+    while True:
+        retrigger_if_necessary(action_parameters)
+        if remaining_timedelta(action_parameters) < timedelta(seconds=min_seconds_per_item):
+            retrigger_now(action_parameters)
+        item_index, work_item, should_watch = storage.fan_out_claim_work_item(
+            fan_out_uuid, worker_index, FAN_OUT_LEASE_SECONDS, FAN_OUT_MAX_ATTEMPTS)
+        if item_index is None:
+            if not should_watch:
+                # All the work items are done.
+                return
+            # The remaining items are leased by other workers. This worker waits, so that an item
+            # is claimed again if the worker that leased it was killed.
+            time.sleep(FAN_OUT_WATCH_SECONDS)
+            continue
+        item_action_parameters = action_parameters.copy()
+        item_action_parameters.update(work_item)
+        failed = False
+        try:
+            work_fn(item_action_parameters)
+        except Stop:
+            raise
+        except Exception:
+            logging.critical('action.perform_fan_out_work - %s exception!!! work_item: %s traceback: %s' %
+                (action_parameters[ACTION_NAME], str(work_item), traceback.format_exc().replace('\n', ' ... ')))
+            failed = True
+        # If the item can't be marked finished, it is claimed again when its lease expires. That
+        # shouldn't stop this worker from claiming other items.
+        try:
+            storage.fan_out_work_item_finished(fan_out_uuid, item_index, failed)
+        except:
+            logging.critical('action.perform_fan_out_work - %s fan_out_work_item_finished exception!!! work_item: %s traceback: %s' %
+                (action_parameters[ACTION_NAME], str(work_item), traceback.format_exc().replace('\n', ' ... ')))
+
+
+# get_checkpoint returns the progress state of the action. The first time it is called, the state
+# that was saved when the action was last retriggered is retrieved, or default_state is used if the
+# action hasn't been retriggered. The action can update the returned state in place as it makes
+# progress, or replace it by calling set_checkpoint. The state must be JSON serializable.
+def get_checkpoint(action_parameters, default_state):
+    if ACTION_CHECKPOINT not in action_parameters:
+        state = storage.retrieve_action_checkpoint(action_parameters[ACTION_UUID])
+        action_parameters[ACTION_CHECKPOINT] = default_state if state is None else state
+    return action_parameters[ACTION_CHECKPOINT]
+
+
+def set_checkpoint(action_parameters, state):
+    action_parameters[ACTION_CHECKPOINT] = state
 
 
 def retrigger_now(action_parameters):
     if ACTION_RETRIGGERED not in action_parameters:
         logging.info('action.retrigger_now - %s - stop' % action_parameters[ACTION_NAME])
+        # Save the checkpoint before the next action is triggered, so that it continues from here.
+        if ACTION_CHECKPOINT in action_parameters:
+            storage.store_action_checkpoint(action_parameters[ACTION_UUID], action_parameters[ACTION_NAME],
+                action_parameters[ACTION_CHECKPOINT])
         storage.action_on_stop(action_parameters[ACTION_UUID], action_parameters[ACTION_IS_ADMIN_ACTION])
+        priority = get_priority(action_parameters[ACTION_NAME])
+        if priority != action_scheduler.PRIORITY_INTERACTIVE:
+            storage.action_scheduler_renew(action_parameters[ACTION_UUID], priority)
         trigger_action_via_blob(action_parameters)
         action_parameters[ACTION_RETRIGGERED] = True
     raise Stop()
@@ -0,0 +1,160 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Decides which triggered actions start now and which wait.
+#
+# Each action has a priority class. Interactive actions are never queued, because a user is waiting
+# on them. Each of the other classes has its own scheduler state, with its own limit on the number of
+# running actions, so that the classes don't contend with each other and a class can't use the
+# capacity that is set aside for a higher class. An action is queued when MAX_RUNNING_ACTIONS of its
+# class are already running, or when MAX_RUNNING_ACTIONS_PER_TEAM of its class are running for the
+# same team. Whenever an action is enqueued or finishes, the queued actions that can start are
+# started in order of weighted fair queuing between the teams. Each queued action is given a finish
+# tag, which is the later of the team's previous finish tag and the class's virtual time, plus the
+# action's cost divided by the team's weight. The action with the smallest finish tag starts first,
+# so a team that queued many actions takes turns with the other teams instead of going first. All
+# teams have the same weight.
+#
+# A running action holds a lease, which is renewed when the action is retriggered. If a cloud
+# function is killed, the action's lease expires and its place is given to a queued action, the
+# next time the class is dispatched.
+#
+# The state is a dict of plain values so that it can be stored as JSON in the datastore. Its size
+# doesn't grow with the number of queued actions. A team's finish tags increase in the order that
+# its actions were enqueued, so its queued actions start in that order, and only the first of them,
+# the team's head, is kept in the state. The caller keeps the queued actions, and gives dispatch a
+# next_queued function that returns the team's queued action that follows the given sequence
+# number, or None if there isn't one.
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EXTRACTION = 1
+PRIORITY_DATASET = 2
+PRIORITY_ZIP = 3
+PRIORITY_ADMIN = 4
+
+# The priority classes that are scheduled, and the number of actions of each that can run at once.
+MAX_RUNNING_ACTIONS = {
+    PRIORITY_EXTRACTION: 16,
+    PRIORITY_DATASET: 16,
+    PRIORITY_ZIP: 8,
+    PRIORITY_ADMIN: 8,
+}
+MAX_RUNNING_ACTIONS_PER_TEAM = 8
+
+# A cloud function runs for at most 540 seconds, so a running action that hasn't been retriggered
+# or finished within this time has been killed.
+LEASE_SECONDS = 900
+
+TEAM_WEIGHT = 1.0
+ACTION_COST = 1.0
+
+
+def create_state(priority):
+    return {
+        'priority': priority,
+        'running': [],
+        'teams': {},
+        'virtual_time': 0,
+        'sequence': 0,
+    }
+
+
+def __count_running(state, team_uuid):
+    return sum(1 for r in state['running'] if r['team_uuid'] == team_uuid)
+
+
+def __start(state, queued, now):
+    state['running'].append({
+        'action_uuid': queued['action_uuid'],
+        'team_uuid': queued['team_uuid'],
+        'lease_expiration': now + LEASE_SECONDS,
+    })
+    # The virtual time moves to the start tag of the action that was started.
+    state['virtual_time'] = max(state['virtual_time'], queued['finish_tag'] - ACTION_COST / TEAM_WEIGHT)
+
+
+def __advance(state, queued, next_queued):
+    # A team's finish tag is only kept while the team has queued actions, so that the state doesn't
+    # grow with the number of teams.
+    team_uuid = queued['team_uuid']
+    team = state['teams'][team_uuid]
+    team['queued_count'] -= 1
+    if team['queued_count'] > 0:
+        team['head'] = next_queued(team_uuid, queued['sequence'])
+        if team['head'] is not None:
+            return
+    del state['teams'][team_uuid]
+
+
+# enqueue queues the action and returns the queued action, which is a dict with the action_uuid,
+# team_uuid, finish_tag, and sequence. The caller must call dispatch afterwards.
+def enqueue(state, action_uuid, team_uuid):
+    team = state['teams'].get(team_uuid)
+    start_tag = max(team['last_finish_tag'] if team is not None else 0, state['virtual_time'])
+    finish_tag = start_tag + ACTION_COST / TEAM_WEIGHT
+    state['sequence'] += 1
+    queued = {
+        'action_uuid': action_uuid,
+        'team_uuid': team_uuid,
+        'finish_tag': finish_tag,
+        'sequence': state['sequence'],
+    }
+    if team is None:
+        state['teams'][team_uuid] = {
+            'head': queued,
+            'queued_count': 1,
+            'last_finish_tag': finish_tag,
+        }
+    else:
+        team['queued_count'] += 1
+        team['last_finish_tag'] = finish_tag
+    return queued
+
+
+# dispatch removes the running actions whose leases have expired and starts queued actions until
+# none of them can start. It returns the action_uuids of the actions that were started. now is a
+# time in seconds.
+def dispatch(state, now, next_queued):
+    state['running'] = [r for r in state['running'] if r['lease_expiration'] > now]
+    started = []
+    while len(state['running']) < MAX_RUNNING_ACTIONS[state['priority']]:
+        startable = [team['head'] for team_uuid, team in state['teams'].items()
+            if __count_running(state, team_uuid) < MAX_RUNNING_ACTIONS_PER_TEAM]
+        if len(startable) == 0:
+            break
+        queued = min(startable, key=lambda q: (q['finish_tag'], q['sequence']))
+        __start(state, queued, now)
+        started.append(queued['action_uuid'])
+        __advance(state, queued, next_queued)
+    return started
+
+
+# renew extends the lease of a running action. It returns False if the action isn't running, which
+# happens if its lease expired.
+def renew(state, action_uuid, now):
+    for r in state['running']:
+        if r['action_uuid'] == action_uuid:
+            r['lease_expiration'] = now + LEASE_SECONDS
+            return True
+    return False
+
+
+# finish returns the action_uuids of the queued actions that can start now that the given action
+# has finished.
+def finish(state, action_uuid, now, next_queued):
+    state['running'] = [r for r in state['running'] if r['action_uuid'] != action_uuid]
+    return dispatch(state, now, next_queued)
@@ -45,13 +45,16 @@ from config import KEY_SITE_CLOSED_FOR_OFFSEASON
 import constants
 import dataset_producer
 import dataset_zipper
+import early_stopping
 import exceptions
 from exceptions import NoRoles
 from exceptions import DownForMaintenance
 from exceptions import ClosedForOffseason
 import frame_extractor
+import frame_hash
 import model_trainer
 import oidc
+import prelabeler
 import roles
 from roles import Role
 import storage
@@ -360,6 +363,9 @@ def __strip_video_entity(video_entity):
         'height',
         'included_frame_count',
         'labeled_frame_count',
+        'prelabeled_frame_count',
+        'prelabeling_error_message',
+        'prelabeling_in_progress',
         'tracking_in_progress',
         'video_filename',
         'video_uuid',
@@ -368,7 +374,9 @@ def __strip_video_entity(video_entity):
 
 def __strip_video_frame_entity(video_frame_entity):
     return __strip_entity(video_frame_entity, [
+        'bboxes_proposed_by_model_uuid',
         'bboxes_text',
+        'dhash',
         'frame_number',
         'image_url',
         'include_frame_in_dataset',
@@ -382,6 +390,9 @@ def __strip_dataset_entity(dataset_entity):
         'description',
         'eval_frame_count',
         'eval_negative_frame_count',
+        'max_frame_count',
+        'sampling_candidate_frame_count',
+        'sampling_dropped_frame_count',
         'sorted_label_list',
         'total_record_count',
         'train_frame_count',
@@ -408,6 +419,7 @@ def __strip_model_entity(model_entity):
         'sorted_label_list',
         'starting_model',
         'tensorflow_version',
+        'tflite_model_sizes',
         'total_training_steps',
         'train_dict_label_to_count',
         'train_error_message',
@@ -907,6 +919,32 @@ def retrieve_video_frame_image():
     image_data, content_type = storage.retrieve_video_frame_image(team_uuid, video_uuid, frame_number)
     return Response(image_data, mimetype=content_type)
 
+@app.route('/retrieveNearDuplicateFrames', methods=['POST'])
+@handle_exceptions
+@login_required
+def retrieve_near_duplicate_frames():
+    team_uuid = team_info.retrieve_team_uuid(flask.session, flask.request)
+    data = validate_keys(flask.request.form.to_dict(flat=True),
+        ['video_uuid'], optional_keys=['max_distance'])
+    video_uuid = storage.validate_uuid(data.get('video_uuid'))
+    if 'max_distance' in data:
+        max_distance = frame_hash.validate_max_distance(data.get('max_distance'))
+    else:
+        max_distance = frame_hash.DEFAULT_MAX_DISTANCE
+    # storage.retrieve_video_frame_dhashes will raise HttpErrorNotFound
+    # if the team_uuid/video_uuid is not found.
+    dict_frame_number_to_dhash = storage.retrieve_video_frame_dhashes(team_uuid, video_uuid)
+    dict_frame_number_to_representative = frame_hash.find_near_duplicates(
+        dict_frame_number_to_dhash, max_distance)
+    response = {
+        'max_distance': max_distance,
+        # Keys are frame numbers, values are the lowest frame number of each group of
+        # near-duplicates.
+        'representative_frame_numbers': dict_frame_number_to_representative,
+        'unique_frame_count': len(set(dict_frame_number_to_representative.values())),
+    }
+    return flask.jsonify(__sanitize(response))
+
 @app.route('/retrieveVideoFrameEntitiesWithImageUrls', methods=['POST'])
 @handle_exceptions
 @login_required
@@ -1042,7 +1080,6 @@ def continue_tracking():
     # if the video_uuid/tracker_uuid is not found.
     storage.continue_tracking(team_uuid, video_uuid, tracker_uuid, frame_number, bboxes_text)
     if 'retrieve_frame_number' in data:
-        time.sleep(0.2)
         retrieve_frame_number = validate_frame_number(data.get('retrieve_frame_number'))
         # storage.retrieve_tracked_bboxes returns True for tracker_failed
         # if the video_uuid/tracker_uuid is not found.
@@ -1056,6 +1093,38 @@ def continue_tracking():
         return flask.jsonify(__sanitize(response))
     return 'OK'
 
+@app.route('/waitForTrackedBboxes', methods=['POST'])
+@handle_exceptions
+@login_required
+def wait_for_tracked_bboxes():
+    # This request is a long-poll. It returns as soon as the tracker has produced the bboxes for
+    # retrieve_frame_number, or when the time limit is reached. The gevent worker (see
+    # gunicorn.conf.py) allows other requests to be handled while this one waits.
+    time_limit = datetime.now(timezone.utc) + timedelta(seconds=tracking.LONG_POLL_SECONDS)
+    team_uuid = team_info.retrieve_team_uuid(flask.session, flask.request)
+    data = validate_keys(flask.request.form.to_dict(flat=True),
+        ['video_uuid', 'tracker_uuid', 'retrieve_frame_number'], optional_keys=['frame_number', 'bboxes_text'])
+    video_uuid = storage.validate_uuid(data.get('video_uuid'))
+    tracker_uuid = storage.validate_uuid(data.get('tracker_uuid'))
+    retrieve_frame_number = validate_frame_number(data.get('retrieve_frame_number'))
+    if 'frame_number' in data:
+        frame_number = validate_frame_number(data.get('frame_number'))
+        bboxes_text = bbox_writer.validate_bboxes_text(data.get('bboxes_text'))
+    else:
+        frame_number = None
+        bboxes_text = None
+    # tracking.wait_for_tracked_bboxes returns True for tracker_failed
+    # if the video_uuid/tracker_uuid is not found.
+    tracker_failed, frame_number, bboxes_text = tracking.wait_for_tracked_bboxes(
+        team_uuid, video_uuid, tracker_uuid, retrieve_frame_number, time_limit,
+        frame_number, bboxes_text)
+    response = {
+        'tracker_failed': tracker_failed,
+        'frame_number': frame_number,
+        'bboxes_text': bboxes_text,
+    }
+    return flask.jsonify(__sanitize(response))
+
 @app.route('/trackingClientStillAlive', methods=['POST'])
 @handle_exceptions
 @login_required
@@ -1088,7 +1157,7 @@ def stop_tracking():
 def prepare_to_start_dataset_production():
     team_uuid = team_info.retrieve_team_uuid(flask.session, flask.request)
     data = validate_keys(flask.request.form.to_dict(flat=True),
-        ['description', 'video_uuids', 'eval_percent', 'create_time_ms'])
+        ['description', 'video_uuids', 'eval_percent', 'create_time_ms'], optional_keys=['max_frame_count'])
     # First validate the parameters.
     try:    
         description = validate_description(data.get('description'), 
@@ -1112,6 +1181,10 @@ def prepare_to_start_dataset_production():
         }
         return flask.jsonify(__sanitize(response))
     create_time_ms = validate_create_time_ms(data.get('create_time_ms'))
+    if 'max_frame_count' in data and data.get('max_frame_count') != '':
+        max_frame_count = validate_int(data.get('max_frame_count'), min=1)
+    else:
+        max_frame_count = 0
     # Don't allow a team to have more than the maximum allowed number of datasets.
     dataset_entities = storage.retrieve_dataset_list(team_uuid)
     if len(dataset_entities) >= constants.MAX_DATASETS_PER_TEAM:
@@ -1125,9 +1198,9 @@ def prepare_to_start_dataset_production():
     # dataset_producer.prepare_to_start_dataset_production will raise HttpErrorNotFound
     # if any of the team_uuid/video_uuids is not found or if none of the videos have labeled frames.
     dataset_uuid = dataset_producer.prepare_to_start_dataset_production(
-        team_uuid, description, video_uuids, eval_percent, create_time_ms)
+        team_uuid, description, video_uuids, eval_percent, create_time_ms, max_frame_count)
     action_parameters = dataset_producer.make_action_parameters(
-        team_uuid, dataset_uuid, video_uuids, eval_percent, create_time_ms)
+        team_uuid, dataset_uuid, video_uuids, eval_percent, create_time_ms, max_frame_count)
     action.trigger_action_via_blob(action_parameters)
     response = {
         'dataset_uuid': dataset_uuid,
@@ -1212,11 +1285,12 @@ def prepare_to_zip_dataset():
     dataset_uuid = storage.validate_uuid(data.get('dataset_uuid'))
     # dataset_zipper.prepare_to_zip_dataset will raise HttpErrorNotFound
     # if the team_uuid/dataset_uuid is not found.
-    dataset_zip_uuid, partition_count = dataset_zipper.prepare_to_zip_dataset(
+    dataset_zip_uuid, partition_count, created = dataset_zipper.prepare_to_zip_dataset(
         team_uuid, dataset_uuid)
-    action_parameters = dataset_zipper.make_action_parameters(
-        team_uuid, dataset_uuid, dataset_zip_uuid, partition_count)
-    action.trigger_action_via_blob(action_parameters)
+    if created:
+        action_parameters = dataset_zipper.make_action_parameters(
+            team_uuid, dataset_uuid, dataset_zip_uuid, partition_count)
+        action.trigger_action_via_blob(action_parameters)
     response = {
         'dataset_zip_uuid': dataset_zip_uuid,
         'partition_count': partition_count,
@@ -1256,12 +1330,11 @@ def delete_dataset_zip():
         ['dataset_zip_uuid', 'partition_index'])
     dataset_zip_uuid = storage.validate_uuid(data.get('dataset_zip_uuid'))
     partition_index = validate_int(data.get('partition_index'), min=0)
-    # blob_storage.delete_dataset_zip does nothing
+    # The zip is kept in the cache for the next download. It is deleted when it expires or when
+    # the dataset is deleted.
+    # storage.release_dataset_zipper does nothing
     # if the team_uuid/dataset_zip_uuid/partition_index is not found
-    blob_storage.delete_dataset_zip(team_uuid, dataset_zip_uuid, partition_index)
-    # storage.delete_dataset_zipper does nothing
-    # if the team_uuid/dataset_zip_uuid/partition_index is not found
-    storage.delete_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index)
+    storage.release_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index)
     return 'OK'
 
 @app.route('/startTrainingModel', methods=['POST'])
@@ -1272,7 +1345,9 @@ def start_training_model():
         raise Forbidden
     team_uuid = team_info.retrieve_team_uuid(flask.session, flask.request)
     data = validate_keys(flask.request.form.to_dict(flat=True),
-        ['description', 'dataset_uuids', 'starting_model', 'max_running_minutes', 'num_training_steps', 'create_time_ms'])
+        ['description', 'dataset_uuids', 'starting_model', 'max_running_minutes', 'num_training_steps', 'create_time_ms'],
+        optional_keys=['early_stopping_patience', 'early_stopping_min_delta', 'early_stopping_metric',
+            'export_best_checkpoints', 'export_checkpoints_every_n'])
     # TODO: Add a try catch and send the error message to the client, modify the client to show the error message, then change this to:
     # description = validate_description(data.get('description'),
     #        other_descriptions=[m['description'] for m in storage.retrieve_model_list(team_uuid)])
@@ -1284,6 +1359,33 @@ def start_training_model():
         min=model_trainer.get_min_training_steps(config.config[KEY_USE_TPU]),
         max=model_trainer.get_max_training_steps(config.config[KEY_USE_TPU]))
     create_time_ms = validate_create_time_ms(data.get('create_time_ms'))
+    # Early stopping is off unless early_stopping_patience is given.
+    if 'early_stopping_patience' in data:
+        early_stopping_patience = validate_int(data.get('early_stopping_patience'),
+            min=0, max=early_stopping.MAX_PATIENCE)
+    else:
+        early_stopping_patience = 0
+    if 'early_stopping_min_delta' in data:
+        early_stopping_min_delta = validate_float(data.get('early_stopping_min_delta'), min=0)
+    else:
+        early_stopping_min_delta = early_stopping.DEFAULT_MIN_DELTA
+    if 'early_stopping_metric' in data:
+        early_stopping_metric = early_stopping.validate_metric(data.get('early_stopping_metric'))
+    else:
+        early_stopping_metric = early_stopping.DEFAULT_METRIC
+    early_stopping_policy = early_stopping.create_policy(
+        early_stopping_metric, early_stopping_patience, early_stopping_min_delta)
+    if 'export_best_checkpoints' in data:
+        export_best_checkpoints = validate_boolean(data.get('export_best_checkpoints'))
+    else:
+        export_best_checkpoints = False
+    # Checkpoints are exported as they are written, each time training passes another multiple of
+    # export_checkpoints_every_n steps. It is off unless export_checkpoints_every_n is given.
+    if 'export_checkpoints_every_n' in data:
+        export_checkpoints_every_n = validate_int(data.get('export_checkpoints_every_n'),
+            min=0, max=model_trainer.get_max_training_steps(config.config[KEY_USE_TPU]))
+    else:
+        export_checkpoints_every_n = 0
     # model_trainer.start_training_model will raise HttpErrorNotFound
     # if starting_model is not a valid starting model and it's not a valid model_uuid, or
     # if any of the team_uuid/dataset_uuid is not found.
@@ -1292,7 +1394,9 @@ def start_training_model():
     # model_trainer.start_training_model will raise HttpErrorUnprocessableEntity
     # if the max_running_minutes exceeds the team's remaining_training_minutes.
     model_entity = model_trainer.start_training_model(team_uuid, description, dataset_uuids,
-        starting_model, max_running_minutes, num_training_steps, create_time_ms, config.config[KEY_USE_TPU])
+        starting_model, max_running_minutes, num_training_steps, create_time_ms, config.config[KEY_USE_TPU],
+        early_stopping=early_stopping_policy, export_best_checkpoints=export_best_checkpoints,
+        export_checkpoints_every_n=export_checkpoints_every_n)
     # Retrieve the team entity so the client gets the updated remaining_training_minutes.
     team_entity = storage.retrieve_team_entity(team_uuid)
     __strip_model_entity(model_entity)
@@ -1365,6 +1469,25 @@ def retrieve_tags_and_steps():
     }
     return flask.jsonify(__sanitize(response))
 
+@app.route('/retrieveScalarSeries', methods=['POST'])
+@handle_exceptions
+@login_required
+def retrieve_scalar_series():
+    team_uuid = team_info.retrieve_team_uuid(flask.session, flask.request)
+    data = validate_keys(flask.request.form.to_dict(flat=True),
+        ['model_uuid', 'job_type', 'max_points'])
+    model_uuid = storage.validate_uuid(data.get('model_uuid'))
+    job_type = validate_job_type(data.get('job_type'))
+    max_points = validate_int(data.get('max_points'), min=3, max=model_trainer.MAX_SCALAR_SERIES_POINTS)
+    # model_trainer.retrieve_scalar_series will raise HttpErrorNotFound
+    # if the team_uuid/model_uuid is not found.
+    dict_tag_to_series = model_trainer.retrieve_scalar_series(
+        team_uuid, model_uuid, job_type, max_points)
+    response = {
+        'series': dict_tag_to_series,
+    }
+    return flask.jsonify(__sanitize(response))
+
 @app.route('/retrieveSummaryItems', methods=['POST'])
 @handle_exceptions
 @login_required
@@ -1488,17 +1611,31 @@ def delete_model():
 def create_tflite():
     team_uuid = team_info.retrieve_team_uuid(flask.session, flask.request)
     data = validate_keys(flask.request.form.to_dict(flat=True),
-        ['model_uuid'])
+        ['model_uuid'], optional_keys=['quantization', 'step'])
     model_uuid = storage.validate_uuid(data.get('model_uuid'))
+    if 'quantization' in data:
+        quantization = tflite_creator.validate_quantization(data.get('quantization'))
+    else:
+        quantization = tflite_creator.QUANTIZATION_DYNAMIC
     # storage.retrieve_model_entity will raise HttpErrorNotFound
     # if the team_uuid/model_uuid is not found.
     model_entity = storage.retrieve_model_entity(team_uuid, model_uuid)
     tflite_files_folder = model_entity['tflite_files_folder']
-    exists, download_url = blob_storage.get_tflite_model_with_metadata_url(tflite_files_folder)
+    # If step is given, the model is created from the checkpoint written at that step.
+    if 'step' in data:
+        step = validate_int(data.get('step'), min=0)
+        tflite_files_folder = blob_storage.get_checkpoint_export_folder(tflite_files_folder, step)
+    else:
+        step = None
+    exists, download_url = blob_storage.get_tflite_model_with_metadata_url(tflite_files_folder, quantization)
     if exists:
         blob_storage.set_cors_policy_for_get()
     else:
-        tflite_creator.trigger_create_tflite(team_uuid, model_uuid)
+        if step is not None and tflite_creator.get_checkpoint_path_for_step(model_entity, step) == '':
+            message = 'Error: Checkpoint for step %d not found for model_uuid=%s.' % (step, model_uuid)
+            logging.critical(message)
+            raise exceptions.HttpErrorNotFound(message)
+        tflite_creator.trigger_create_tflite(team_uuid, model_uuid, quantization, step)
     response = {
         'exists': exists,
         'download_url': download_url,
@@ -1511,13 +1648,23 @@ def create_tflite():
 def get_tflite_download_url():
     team_uuid = team_info.retrieve_team_uuid(flask.session, flask.request)
     data = validate_keys(flask.request.form.to_dict(flat=True),
-        ['model_uuid'])
+        ['model_uuid'], optional_keys=['quantization', 'step'])
     model_uuid = storage.validate_uuid(data.get('model_uuid'))
+    if 'quantization' in data:
+        quantization = tflite_creator.validate_quantization(data.get('quantization'))
+    else:
+        quantization = tflite_creator.QUANTIZATION_DYNAMIC
     # storage.retrieve_model_entity will raise HttpErrorNotFound
     # if the team_uuid/model_uuid is not found.
     model_entity = storage.retrieve_model_entity(team_uuid, model_uuid)
     tflite_files_folder = model_entity['tflite_files_folder']
-    exists, download_url = blob_storage.get_tflite_model_with_metadata_url(tflite_files_folder)
+    # If step is given, the model is created from the checkpoint written at that step.
+    if 'step' in data:
+        step = validate_int(data.get('step'), min=0)
+        tflite_files_folder = blob_storage.get_checkpoint_export_folder(tflite_files_folder, step)
+    else:
+        step = None
+    exists, download_url = blob_storage.get_tflite_model_with_metadata_url(tflite_files_folder, quantization)
     if exists:
         blob_storage.set_cors_policy_for_get()
     response = {
@@ -1526,6 +1673,26 @@ def get_tflite_download_url():
     }
     return flask.jsonify(__sanitize(response))
 
+@app.route('/startPrelabeling', methods=['POST'])
+@handle_exceptions
+@login_required
+def start_prelabeling():
+    team_uuid = team_info.retrieve_team_uuid(flask.session, flask.request)
+    data = validate_keys(flask.request.form.to_dict(flat=True),
+        ['video_uuid', 'model_uuid'], optional_keys=['confidence_threshold'])
+    video_uuid = storage.validate_uuid(data.get('video_uuid'))
+    model_uuid = storage.validate_uuid(data.get('model_uuid'))
+    if 'confidence_threshold' in data:
+        confidence_threshold = validate_float(data.get('confidence_threshold'), min=0, max=1)
+    else:
+        confidence_threshold = prelabeler.DEFAULT_CONFIDENCE_THRESHOLD
+    # prelabeler.start_prelabeling will raise HttpErrorNotFound
+    # if the team_uuid/video_uuid/model_uuid is not found,
+    # HttpErrorUnprocessableEntity if the TFLite model has not been created,
+    # and HttpErrorConflict if tracking or prelabeling is in progress on the video.
+    prelabeler.start_prelabeling(team_uuid, video_uuid, model_uuid, confidence_threshold)
+    return 'OK'
+
 @app.route('/resources', methods=['GET'])
 def resources():
     return flask.render_template('resources.html')
@@ -1544,9 +1711,6 @@ def reset_remaining_training_minutes():
         '', action.ACTION_NAME_RESET_REMAINING_TRAINING_MINUTES)
     action_parameters['reset_minutes'] = reset_minutes
     action_parameters['date_time_string'] = data.get('date_time_string')
-    action_parameters['num_teams_updated'] = 0
-    action_parameters['teams_updated'] = []
-    action_parameters['failure_counts'] = {}
     action_uuid = action.trigger_action_via_blob(action_parameters)
     response = {
         'action_uuid': action_uuid,
@@ -1566,9 +1730,6 @@ def increment_remaining_training_minutes():
         '', action.ACTION_NAME_INCREMENT_REMAINING_TRAINING_MINUTES)
     action_parameters['increment_minutes'] = increment_minutes
     action_parameters['date_time_string'] = data.get('date_time_string')
-    action_parameters['num_teams_updated'] = 0
-    action_parameters['teams_updated'] = []
-    action_parameters['failure_counts'] = {}
     action_uuid = action.trigger_action_via_blob(action_parameters)
     response = {
         'action_uuid': action_uuid,
@@ -1588,10 +1749,6 @@ def save_end_of_season_entities():
         '', action.ACTION_NAME_SAVE_END_OF_SEASON_ENTITIES)
     action_parameters['season'] = season
     action_parameters['date_time_string'] = data.get('date_time_string')
-    action_parameters['num_models'] = 0
-    action_parameters['num_teams_processed'] = 0
-    action_parameters['teams_processed'] = []
-    action_parameters['failure_counts'] = {}
     action_uuid = action.trigger_action_via_blob(action_parameters)
     response = {
         'action_uuid': action_uuid,
@@ -1612,9 +1769,23 @@ def resetTeamEntities():
     action_parameters = action.create_action_parameters(
         '', action.ACTION_NAME_RESET_TEAM_ENTITIES)
     action_parameters['date_time_string'] = data.get('date_time_string')
-    action_parameters['num_teams_updated'] = 0
-    action_parameters['teams_updated'] = []
-    action_parameters['failure_counts'] = {}
+    action_uuid = action.trigger_action_via_blob(action_parameters)
+    response = {
+        'action_uuid': action_uuid,
+    }
+    return flask.jsonify(__sanitize(response))
+
+
+@app.route('/deleteStaleActions', methods=['POST'])
+@handle_exceptions
+@login_required
+@roles_accepted(roles.Role.GLOBAL_ADMIN, roles.Role.ML_DEVELOPER)
+def delete_stale_actions():
+    data = validate_keys(flask.request.form.to_dict(flat=True),
+        ['date_time_string'])
+    action_parameters = action.create_action_parameters(
+        '', action.ACTION_NAME_DELETE_STALE_ACTIONS)
+    action_parameters['date_time_string'] = data.get('date_time_string')
     action_uuid = action.trigger_action_via_blob(action_parameters)
     response = {
         'action_uuid': action_uuid,
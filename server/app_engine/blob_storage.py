@@ -16,11 +16,15 @@ __author__ = "lizlooney@google.com (Liz Looney)"
 
 # Python Standard Library
 from datetime import datetime, timedelta
+import io
 import logging
 import re
 import time
 import traceback
 
+# Other Modules
+import requests
+
 # My Modules
 import action
 import constants
@@ -57,8 +61,10 @@ def __write_file_to_blob(blob_name, filename, content_type):
             else:
                 raise
 
-def __write_string_to_blob(blob_name, s, content_type):
+def __write_string_to_blob(blob_name, s, content_type, metadata=None):
     blob = util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name)
+    if metadata is not None:
+        blob.metadata = metadata
     # Retry up to 5 times.
     retry = 0
     while True:
@@ -71,6 +77,104 @@ def __write_string_to_blob(blob_name, s, content_type):
             else:
                 raise
 
+# Chunk sizes for streaming blobs. Resumable upload chunks must be a multiple of 256 KiB.
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 32 * 256 * 1024
+# A chunk upload that takes longer than this is abandoned and retried.
+UPLOAD_CHUNK_TIMEOUT_SECONDS = 60
+
+def __iterate_blob_chunks(blob_name, chunk_size):
+    blob = util.storage_client().get_bucket(BUCKET_BLOBS).get_blob(blob_name)
+    if blob is None:
+        return
+    size = blob.size
+    # Pin the generation so that all the chunks come from the same version of the blob.
+    blob = util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name, generation=blob.generation)
+    start = 0
+    while start < size:
+        end = min(start + chunk_size, size) - 1
+        # Retry up to 5 times.
+        retry = 0
+        while True:
+            try:
+                chunk = blob.download_as_bytes(start=start, end=end)
+                break
+            except:
+                if retry < 5:
+                    retry += 1
+                else:
+                    raise
+        yield chunk
+        start = end + 1
+
+# ResumableUploadStream is a write-only stream that uploads to a blob in chunks, using a resumable
+# upload session, so that the whole blob never has to be held in memory. The blob is only created
+# when finish is called. If the stream is closed without calling finish, nothing is written.
+class ResumableUploadStream(io.RawIOBase):
+    def __init__(self, blob_name, content_type, chunk_size=UPLOAD_CHUNK_SIZE):
+        io.RawIOBase.__init__(self)
+        blob = util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name)
+        self.session_url = blob.create_resumable_upload_session(content_type=content_type)
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.bytes_uploaded = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buffer.extend(b)
+        while len(self.buffer) >= self.chunk_size:
+            self.__upload_chunk(bytes(self.buffer[:self.chunk_size]), False)
+            del self.buffer[:self.chunk_size]
+        return len(b)
+
+    def finish(self):
+        self.__upload_chunk(bytes(self.buffer), True)
+        self.buffer = bytearray()
+        self.close()
+
+    def __upload_chunk(self, data, is_final):
+        # Retry up to 5 times.
+        retry = 0
+        while True:
+            start = self.bytes_uploaded
+            total = str(start + len(data)) if is_final else '*'
+            if len(data) == 0:
+                content_range = 'bytes */%s' % total
+            else:
+                content_range = 'bytes %d-%d/%s' % (start, start + len(data) - 1, total)
+            try:
+                response = requests.put(self.session_url, data=data, headers={'Content-Range': content_range},
+                    timeout=UPLOAD_CHUNK_TIMEOUT_SECONDS)
+            except:
+                response = None
+            if response is not None:
+                if response.status_code in (200, 201):
+                    self.bytes_uploaded += len(data)
+                    return
+                if response.status_code == 308:
+                    # The Range header says how much has been persisted. It might be less than
+                    # what we sent.
+                    persisted = 0
+                    m = re.match(r'bytes=0-(\d+)', response.headers.get('Range', ''))
+                    if m:
+                        persisted = int(m.group(1)) + 1
+                    if persisted > start:
+                        data = data[persisted - start:]
+                        self.bytes_uploaded = persisted
+                        if len(data) == 0 and not is_final:
+                            return
+                        continue
+            if retry < 5:
+                retry += 1
+                time.sleep(1)
+            else:
+                message = 'Error: Unable to upload chunk. %s' % (
+                    'No response' if response is None else 'status_code=%d' % response.status_code)
+                logging.critical(message)
+                raise RuntimeError(message)
+
 def __get_path(blob_name_or_folder):
     return 'gs://%s/%s' % (BUCKET_BLOBS, blob_name_or_folder)
 
@@ -178,11 +282,29 @@ def store_dataset_label_map(team_uuid, dataset_uuid, sorted_label_list):
     __write_string_to_blob(label_map_blob_name, label_map, 'text/plain')
     return label_map_blob_name, label_map_path
 
+def store_dataset_sampling_report(team_uuid, dataset_uuid, sampling_report_json):
+    sampling_report_blob_name = '%s/sampling_report.json' % get_dataset_folder(team_uuid, dataset_uuid)
+    __write_string_to_blob(sampling_report_blob_name, sampling_report_json, 'application/json')
+    return sampling_report_blob_name
+
+def get_dataset_sampling_report_url(sampling_report_blob_name):
+    return __get_download_url(sampling_report_blob_name)
+
 def store_dataset_record(team_uuid, dataset_uuid, record_id, temp_record_filename):
     tf_record_blob_name = '%s/%s' % (get_dataset_folder(team_uuid, dataset_uuid), record_id)
     __write_file_to_blob(tf_record_blob_name, temp_record_filename, 'application/octet-stream')
     return tf_record_blob_name
 
+def get_dataset_blob_sizes_and_generations(team_uuid, dataset_uuid):
+    client = util.storage_client()
+    prefix = '%s/' % get_dataset_folder(team_uuid, dataset_uuid)
+    dict_blob_name_to_size = {}
+    dict_blob_name_to_generation = {}
+    for blob in client.list_blobs(BUCKET_BLOBS, prefix=prefix):
+        dict_blob_name_to_size[blob.name] = blob.size
+        dict_blob_name_to_generation[blob.name] = blob.generation
+    return dict_blob_name_to_size, dict_blob_name_to_generation
+
 def retrieve_dataset_blob(blob_name):
     return __retrieve_blob(blob_name)
 
@@ -202,6 +324,13 @@ def store_dataset_zip(team_uuid, dataset_zip_uuid, partition_index, zip_data):
     __write_string_to_blob(blob_name, zip_data, 'application/zip')
     return blob_name
 
+def open_dataset_zip_stream(team_uuid, dataset_zip_uuid, partition_index):
+    blob_name = __get_dataset_zip_blob_name(team_uuid, dataset_zip_uuid, partition_index)
+    return ResumableUploadStream(blob_name, 'application/zip')
+
+def iterate_dataset_blob_chunks(blob_name):
+    return __iterate_blob_chunks(blob_name, DOWNLOAD_CHUNK_SIZE)
+
 def get_dataset_zip_download_url(team_uuid, dataset_zip_uuid, partition_count):
     exists_array = []
     download_url_array = []
@@ -212,6 +341,11 @@ def get_dataset_zip_download_url(team_uuid, dataset_zip_uuid, partition_count):
         download_url_array.append(download_url)
     return exists_array, download_url_array
 
+def dataset_zip_exists(team_uuid, dataset_zip_uuid, partition_index):
+    blob_name = __get_dataset_zip_blob_name(team_uuid, dataset_zip_uuid, partition_index)
+    blob = util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name)
+    return blob.exists()
+
 def delete_dataset_zip(team_uuid, dataset_zip_uuid, partition_index):
     blob_name = __get_dataset_zip_blob_name(team_uuid, dataset_zip_uuid, partition_index)
     __delete_blob(blob_name)
@@ -238,35 +372,73 @@ def store_pipeline_config(model_folder, pipeline_config):
     __write_string_to_blob(pipeline_config_blob_name, pipeline_config, 'text/plain')
     return get_pipeline_config_path(model_folder)
 
-def get_event_file_paths(model_folder, job_type):
+def __list_event_file_blobs(model_folder, job_type):
     client = util.storage_client()
     if job_type == 'train':
         folder = '%s/train' % model_folder
     else: # 'eval'
         folder = '%s/eval' % model_folder
     prefix = '%s/events.out.tfevents.' % folder
+    return client.list_blobs(BUCKET_BLOBS, prefix=prefix)
+
+def get_event_file_paths(model_folder, job_type):
     dict_path_to_updated = {}
-    for blob in client.list_blobs(BUCKET_BLOBS, prefix=prefix):
+    for blob in __list_event_file_blobs(model_folder, job_type):
         dict_path_to_updated[__get_path(blob.name)] = blob.updated
     return dict_path_to_updated
 
+def get_event_file_sizes(model_folder, job_type):
+    dict_path_to_updated = {}
+    dict_path_to_size = {}
+    for blob in __list_event_file_blobs(model_folder, job_type):
+        dict_path_to_updated[__get_path(blob.name)] = blob.updated
+        dict_path_to_size[__get_path(blob.name)] = blob.size
+    return dict_path_to_updated, dict_path_to_size
+
+# retrieve_event_file_bytes returns the bytes of the event file from start up to, but not
+# including, end.
+def retrieve_event_file_bytes(event_file_path, start, end):
+    blob_name = event_file_path[len(__get_path('')):]
+    blob = util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name)
+    # Retry up to 5 times.
+    retry = 0
+    while True:
+        try:
+            return blob.download_as_bytes(start=start, end=end - 1)
+        except:
+            if retry < 5:
+                retry += 1
+            else:
+                raise
+
 def __get_event_summary_image_blob_name(model_folder, job_type, step, tag):
     return '%s/images_%s/step_%d_%s' % (model_folder, job_type, step, tag.replace('/', '_'))
 
+# list_event_summary_images returns the names of the event summary image blobs that already exist,
+# so that callers don't need to check each image separately.
+def list_event_summary_images(model_folder, job_type):
+    client = util.storage_client()
+    prefix = '%s/images_%s/' % (model_folder, job_type)
+    return set(blob.name for blob in client.list_blobs(BUCKET_BLOBS, prefix=prefix))
+
+def event_summary_image_exists_in(image_blob_names, model_folder, job_type, step, tag):
+    return __get_event_summary_image_blob_name(model_folder, job_type, step, tag) in image_blob_names
+
+# store_event_summary_image returns the name of the blob. The caller is responsible for not storing
+# an image that already exists. If the image can't be stored, the exception is raised, so that the
+# caller doesn't save the event file offset and the image is stored the next time.
 def store_event_summary_image(model_folder, job_type, step, tag, encoded_image_string):
     blob_name = __get_event_summary_image_blob_name(model_folder, job_type, step, tag)
-    bucket = util.storage_client().bucket(BUCKET_BLOBS)
-    blob = bucket.blob(blob_name)
     max_failures = 5
     for i in range(max_failures):
       try:
-        if not blob.exists():
-            __write_string_to_blob(blob_name, encoded_image_string, 'image/png')
-        return
+        __write_string_to_blob(blob_name, encoded_image_string, 'image/png')
+        return blob_name
       except:
         if i == max_failures - 1:
             logging.critical('Unable to store event summary image (failed %d times), traceback: %s' %
                     ((i + 1), traceback.format_exc().replace('\n', ' ... ')))
+            raise
         else:
             logging.warning('Unable to store event summary image (failed %d times) will try again in 3 seconds' %
                     (i + 1))
@@ -280,24 +452,66 @@ def get_event_summary_image_download_url(model_folder, job_type, step, tag, enco
         __write_string_to_blob(blob_name, encoded_image_string, 'image/png')
     return __get_download_url(blob_name)
 
-def get_trained_checkpoint_path(model_folder):
+def __get_scalar_series_blob_name(model_folder, job_type):
+    return '%s/scalar_series_%s.json' % (model_folder, job_type)
+
+def store_scalar_series(model_folder, job_type, scalar_series_json):
+    blob_name = __get_scalar_series_blob_name(model_folder, job_type)
+    __write_string_to_blob(blob_name, scalar_series_json, 'application/json')
+
+def retrieve_scalar_series(model_folder, job_type):
+    blob_name = __get_scalar_series_blob_name(model_folder, job_type)
+    blob = util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name)
+    if not blob.exists():
+        return None
+    return blob.download_as_string()
+
+# The checkpoint file is rewritten each time a checkpoint is saved, so its generation shows whether
+# there might be a new checkpoint without listing them.
+def get_checkpoint_file_generation(model_folder):
+    blob = util.storage_client().bucket(BUCKET_BLOBS).get_blob('%s/checkpoint' % model_folder)
+    if blob is None:
+        return None
+    return blob.generation
+
+# Returns a dict whose keys are the numbers of the checkpoints that the training job has written and
+# not deleted yet, and whose values are the checkpoint paths.
+def get_checkpoint_paths(model_folder):
     client = util.storage_client()
-    # We're looking for a file like this: ckpt-1.index
+    # We're looking for files like this: ckpt-1.index
     prefix = '%s/ckpt-' % model_folder
     pattern = re.compile(r'%s(\d*)\.index' % prefix)
-    max_number = None
-    blob_name = ''
+    dict_number_to_path = {}
     for blob in client.list_blobs(BUCKET_BLOBS, prefix=prefix):
         match = pattern.match(blob.name)
         if match is not None:
-            n = int(float(match.group(1)))
-            if max_number is None or n > max_number:
-                max_number = n
-                blob_name = blob.name
-    if blob_name != '':
+            dict_number_to_path[int(float(match.group(1)))] = __get_path(blob.name)
+    return dict_number_to_path
+
+def get_trained_checkpoint_path(model_folder):
+    dict_number_to_path = get_checkpoint_paths(model_folder)
+    if len(dict_number_to_path) > 0:
+        return dict_number_to_path[max(dict_number_to_path.keys())]
+    return ''
+
+# Returns the path of the checkpoint with the given number, or '' if it doesn't exist (because it
+# was never written or it was already deleted by the training job).
+def get_checkpoint_path_for_number(model_folder, checkpoint_number):
+    blob_name = '%s/ckpt-%d.index' % (model_folder, checkpoint_number)
+    if util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name).exists():
         return __get_path(blob_name)
     return ''
 
+# checkpoint_path is a path returned by one of the functions above.
+def checkpoint_exists(checkpoint_path):
+    blob_name = checkpoint_path[len(__get_path('')):]
+    return util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name).exists()
+
+# TensorFlow Lite models created from intermediate checkpoints are kept in a subfolder of the
+# model folder and the tflite files folder, named by step.
+def get_checkpoint_export_folder(folder, step):
+    return '%s/checkpoints/%d' % (folder, step)
+
 def get_old_tflite_folder(model_folder):
     return '%s/tflite' % model_folder
 
@@ -307,39 +521,36 @@ def get_tflite_files_folder(team_uuid, model_uuid):
 def get_tflite_files_folder_path(tflite_files_folder):
     return __get_path(tflite_files_folder)
 
-def get_tflite_saved_model_parent_path(model_folder):
-    return __get_path('%s/tflite' % model_folder)
+# Intermediate artifacts of creating a TensorFlow Lite model are cached in the model folder, keyed
+# by a hash of everything that went into them, so each one is written once and reused.
+def __get_tflite_cache_folder(model_folder, key):
+    return '%s/tflite_cache/%s' % (model_folder, key)
 
-def __get_tflite_saved_model_folder(model_folder):
-    return '%s/tflite/saved_model' % model_folder
+def get_tflite_cached_saved_model_path(model_folder, key):
+    return __get_path('%s/saved_model' % __get_tflite_cache_folder(model_folder, key))
 
-def get_tflite_saved_model_path(model_folder):
-    return __get_path(__get_tflite_saved_model_folder(model_folder))
-
-def tflite_saved_model_exists(model_folder):
-    client = util.storage_client()
-    # saved_model is a directory. Check whether any files exist in the directory.
-    prefix = '%s/' % __get_tflite_saved_model_folder(model_folder)
-    for blob in client.list_blobs(BUCKET_BLOBS, prefix=prefix):
-        return True
-    return False
-
-def __get_tflite_quantized_model_blob_name(model_folder):
-    return '%s/tflite/quantized_model' % model_folder
-
-def tflite_quantized_model_exists(model_folder):
+def tflite_cached_saved_model_exists(model_folder, key):
     client = util.storage_client()
-    blob_name = __get_tflite_quantized_model_blob_name(model_folder)
-    blob = util.storage_client().get_bucket(BUCKET_BLOBS).blob(blob_name)
+    # saved_model is a directory. Check whether the saved_model.pb file exists, since it is
+    # written after the variables.
+    blob_name = '%s/saved_model/saved_model.pb' % __get_tflite_cache_folder(model_folder, key)
+    blob = client.bucket(BUCKET_BLOBS).blob(blob_name)
     return blob.exists()
 
-def store_tflite_quantized_model(model_folder, tflite_quantized_model):
-    blob_name = __get_tflite_quantized_model_blob_name(model_folder)
-    __write_string_to_blob(blob_name, tflite_quantized_model, 'application/octet-stream')
+def __get_tflite_cached_model_blob_name(model_folder, key):
+    return '%s/model.tflite' % __get_tflite_cache_folder(model_folder, key)
 
-def write_tflite_quantized_model_to_file(model_folder, filename):
-    blob_name = __get_tflite_quantized_model_blob_name(model_folder)
-    return __write_blob_to_file(blob_name, filename)
+def store_tflite_cached_model(model_folder, key, tflite_model):
+    blob_name = __get_tflite_cached_model_blob_name(model_folder, key)
+    __write_string_to_blob(blob_name, tflite_model, 'application/octet-stream')
+
+# Returns the cached model, or None if it doesn't exist.
+def retrieve_tflite_cached_model(model_folder, key):
+    blob_name = __get_tflite_cached_model_blob_name(model_folder, key)
+    blob = util.storage_client().bucket(BUCKET_BLOBS).blob(blob_name)
+    if not blob.exists():
+        return None
+    return blob.download_as_string()
 
 def __get_tflite_label_map_txt_blob_name(tflite_files_folder):
     return '%s/label_map.txt' % tflite_files_folder
@@ -354,24 +565,44 @@ def store_tflite_label_map_txt(tflite_files_folder, tflite_label_map_txt):
     blob_name = __get_tflite_label_map_txt_blob_name(tflite_files_folder)
     __write_string_to_blob(blob_name, tflite_label_map_txt, 'text/plain')
 
-def write_tflite_label_map_txt_to_file(tflite_files_folder, filename):
-    blob_name = __get_tflite_label_map_txt_blob_name(tflite_files_folder)
-    return __write_blob_to_file(blob_name, filename)
+def get_tflite_model_with_metadata_blob_name(tflite_files_folder, quantization='dynamic'):
+    if quantization == 'dynamic':
+        return '%s/model_with_metadata.tflite' % tflite_files_folder
+    return '%s/model_with_metadata_%s.tflite' % (tflite_files_folder, quantization)
 
-def get_tflite_model_with_metadata_blob_name(tflite_files_folder):
-    return '%s/model_with_metadata.tflite' % tflite_files_folder
-
-def tflite_model_with_metadata_exists(tflite_files_folder):
-    blob_name = get_tflite_model_with_metadata_blob_name(tflite_files_folder)
+def tflite_model_with_metadata_exists(tflite_files_folder, quantization='dynamic'):
+    blob_name = get_tflite_model_with_metadata_blob_name(tflite_files_folder, quantization)
     blob = util.storage_client().get_bucket(BUCKET_BLOBS).blob(blob_name)
     return blob.exists()
 
-def store_tflite_model_with_metadata(tflite_files_folder, tflite_model_with_metadata_filename):
-    blob_name = get_tflite_model_with_metadata_blob_name(tflite_files_folder)
-    __write_file_to_blob(blob_name, tflite_model_with_metadata_filename, 'application/octet-stream')
+# The key is stored in the blob's metadata. It identifies the checkpoint, pipeline config,
+# quantization, labels, and metadata that the model was created from.
+def store_tflite_model_with_metadata(tflite_files_folder, tflite_model_with_metadata, key, quantization='dynamic'):
+    blob_name = get_tflite_model_with_metadata_blob_name(tflite_files_folder, quantization)
+    __write_string_to_blob(blob_name, tflite_model_with_metadata, 'application/octet-stream',
+        metadata={'key': key})
+
+# Returns the key that the model with metadata was stored with, '' if it was stored without one,
+# or None if it doesn't exist.
+def get_tflite_model_with_metadata_key(tflite_files_folder, quantization='dynamic'):
+    blob_name = get_tflite_model_with_metadata_blob_name(tflite_files_folder, quantization)
+    blob = util.storage_client().bucket(BUCKET_BLOBS).get_blob(blob_name)
+    if blob is None:
+        return None
+    if blob.metadata is None:
+        return ''
+    return blob.metadata.get('key', '')
+
+def retrieve_tflite_model_with_metadata(tflite_files_folder, quantization='dynamic'):
+    blob_name = get_tflite_model_with_metadata_blob_name(tflite_files_folder, quantization)
+    return __retrieve_blob(blob_name)
+
+def write_tflite_model_with_metadata_to_file(tflite_files_folder, filename, quantization='dynamic'):
+    blob_name = get_tflite_model_with_metadata_blob_name(tflite_files_folder, quantization)
+    return __write_blob_to_file(blob_name, filename)
 
-def get_tflite_model_with_metadata_url(tflite_files_folder):
-    return __get_download_url(get_tflite_model_with_metadata_blob_name(tflite_files_folder))
+def get_tflite_model_with_metadata_url(tflite_files_folder, quantization='dynamic'):
+    return __get_download_url(get_tflite_model_with_metadata_blob_name(tflite_files_folder, quantization))
 
 def delete_model_blobs(folder, action_parameters=None):
     client = util.storage_client()
@@ -19,14 +19,17 @@ import action
 import storage
 
 
-def prepare_to_start_dataset_production(team_uuid, description, video_uuid_list, eval_percent, create_time_ms):
+def prepare_to_start_dataset_production(team_uuid, description, video_uuid_list, eval_percent, create_time_ms,
+        max_frame_count=0):
     # storage.prepare_to_start_dataset_production will raise HttpErrorNotFound
     # if any of the team_uuid/video_uuids is not found or if none of the videos have labeled frames.
     dataset_uuid = storage.prepare_to_start_dataset_production(team_uuid, description,
-        video_uuid_list, eval_percent, create_time_ms)
+        video_uuid_list, eval_percent, create_time_ms, max_frame_count)
     return dataset_uuid
 
-def make_action_parameters(team_uuid, dataset_uuid, video_uuid_list, eval_percent, create_time_ms):
+# If max_frame_count is greater than 0, at most that many frames are selected for the dataset.
+def make_action_parameters(team_uuid, dataset_uuid, video_uuid_list, eval_percent, create_time_ms,
+        max_frame_count=0):
     action_parameters = action.create_action_parameters(
         team_uuid, action.ACTION_NAME_DATASET_PRODUCE)
     action_parameters['team_uuid'] = team_uuid
@@ -34,4 +37,6 @@ def make_action_parameters(team_uuid, dataset_uuid, video_uuid_list, eval_percen
     action_parameters['video_uuid_list'] = video_uuid_list
     action_parameters['eval_percent'] = eval_percent
     action_parameters['create_time_ms'] = create_time_ms
+    if max_frame_count > 0:
+        action_parameters['max_frame_count'] = max_frame_count
     return action_parameters
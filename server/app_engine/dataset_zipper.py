@@ -15,25 +15,76 @@
 __author__ = "lizlooney@google.com (Liz Looney)"
 
 # Python Standard Library
-import math
-import uuid
+import hashlib
+import json
 
 # My Modules
 import action
+import blob_storage
 import storage
 
 
+# Files are packed into partitions of about this many bytes. A file that is larger than this goes
+# into a partition by itself.
+TARGET_PARTITION_BYTES = 256 * 1024 * 1024
+
+
+# prepare_to_zip_dataset returns the dataset_zip_uuid, the partition count, and whether the zip
+# action needs to be triggered. Completed datasets don't change, so a zip that was made earlier is
+# reused if the dataset's blobs are the same generations that were zipped before.
 def prepare_to_zip_dataset(team_uuid, dataset_uuid):
-    dataset_zip_uuid = str(uuid.uuid4().hex)
-    max_files_per_partition = 10
     # storage.retrieve_dataset_entity will raise HttpErrorNotFound
     # if the team_uuid/dataset_uuid is not found.
     dataset_entity = storage.retrieve_dataset_entity(team_uuid, dataset_uuid)
-    total_file_count = dataset_entity['total_record_count'] + 1
-    partition_count = math.ceil(total_file_count / max_files_per_partition)
-    storage.create_dataset_zippers(team_uuid, dataset_zip_uuid, partition_count)
-    storage.increment_datasets_downloaded_today(team_uuid)
-    return dataset_zip_uuid, partition_count
+    blob_names = [dataset_entity['label_map_blob_name']]
+    dataset_record_entities = storage.retrieve_dataset_records(dataset_entity)
+    for dataset_record_entity in dataset_record_entities:
+        blob_names.append(dataset_record_entity['tf_record_blob_name'])
+    dict_blob_name_to_size, dict_blob_name_to_generation = blob_storage.get_dataset_blob_sizes_and_generations(
+        team_uuid, dataset_uuid)
+    dataset_zip_uuid = __make_dataset_zip_uuid(dataset_uuid, blob_names, dict_blob_name_to_generation)
+    partition_lists = __plan_partitions(blob_names, dict_blob_name_to_size)
+    created = storage.reference_or_create_dataset_zippers(team_uuid, dataset_uuid, dataset_zip_uuid, partition_lists)
+    if created:
+        # Only count downloads that actually have to be zipped.
+        storage.increment_datasets_downloaded_today(team_uuid)
+    return dataset_zip_uuid, len(partition_lists), created
+
+def __make_dataset_zip_uuid(dataset_uuid, blob_names, dict_blob_name_to_generation):
+    # The partition size is included because a different size produces different partitions.
+    key = json.dumps({
+        'dataset_uuid': dataset_uuid,
+        'blobs': sorted([blob_name, dict_blob_name_to_generation.get(blob_name)] for blob_name in blob_names),
+        'target_partition_bytes': TARGET_PARTITION_BYTES,
+    }, sort_keys=True)
+    # Use the same form as a uuid so that it passes storage.validate_uuid.
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+def __plan_partitions(blob_names, dict_blob_name_to_size):
+    # First fit decreasing: place each file, largest first, into the first partition that it fits
+    # in, starting a new partition when it doesn't fit in any of them.
+    sorted_blob_names = sorted(blob_names,
+        key=lambda blob_name: (-dict_blob_name_to_size.get(blob_name, 0), blob_name))
+    partition_lists = []
+    partition_sizes = []
+    for blob_name in sorted_blob_names:
+        size = dict_blob_name_to_size.get(blob_name, 0)
+        for i in range(len(partition_lists)):
+            if partition_sizes[i] + size <= TARGET_PARTITION_BYTES:
+                break
+        else:
+            i = len(partition_lists)
+            partition_lists.append([])
+            partition_sizes.append(0)
+        partition_lists[i].append(blob_name)
+        partition_sizes[i] += size
+    if len(partition_lists) == 0:
+        partition_lists.append([])
+    # Keep the files in their original order within each partition.
+    order = {blob_name: i for i, blob_name in enumerate(blob_names)}
+    for partition_list in partition_lists:
+        partition_list.sort(key=lambda blob_name: order[blob_name])
+    return partition_lists
 
 def make_action_parameters(team_uuid, dataset_uuid, dataset_zip_uuid, partition_count):
     action_parameters = action.create_action_parameters(
@@ -0,0 +1,94 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Early stopping of training when the eval metric stops improving.
+#
+# A policy is a dict with a metric, a patience, and a min_delta. It is stored in the model entity
+# when training starts. Each time the eval job writes a new value for the metric, monitor_training
+# calls evaluate. If the metric hasn't improved by at least min_delta over the best value for
+# patience evaluations in a row, training is stopped.
+
+# Python Standard Library
+import logging
+
+# My Modules
+import exceptions
+
+
+# The eval metrics that can be used, and whether bigger values are better.
+METRICS = {
+    'DetectionBoxes_Precision/mAP': True,
+    'DetectionBoxes_Precision/mAP@.50IOU': True,
+    'DetectionBoxes_Precision/mAP@.75IOU': True,
+    'DetectionBoxes_Recall/AR@100': True,
+    'Loss/total_loss': False,
+}
+DEFAULT_METRIC = 'DetectionBoxes_Precision/mAP'
+DEFAULT_MIN_DELTA = 0.001
+MAX_PATIENCE = 100
+
+
+def validate_metric(s):
+    if s not in METRICS:
+        message = "Error: '%s' is not a valid argument." % s
+        logging.critical(message)
+        raise exceptions.HttpErrorBadRequest(message)
+    return s
+
+
+# create_policy returns None if patience is 0, which means early stopping is off.
+def create_policy(metric, patience, min_delta):
+    if patience == 0:
+        return None
+    return {
+        'metric': metric,
+        'patience': patience,
+        'min_delta': min_delta,
+    }
+
+
+# find_best returns a tuple of the step and value of the best evaluation, and how many evaluations
+# there have been since then. A value only counts as better if it improves on the best value by
+# more than min_delta. dict_step_to_value holds the values of the metric, keyed by step.
+def find_best(metric, min_delta, dict_step_to_value):
+    bigger_is_better = METRICS[metric]
+    best_step = None
+    best_value = None
+    evaluations_since_best = 0
+    for step in sorted(dict_step_to_value.keys()):
+        value = dict_step_to_value[step]
+        if best_value is None:
+            improved = True
+        elif bigger_is_better:
+            improved = value > best_value + min_delta
+        else:
+            improved = value < best_value - min_delta
+        if improved:
+            best_step = step
+            best_value = value
+            evaluations_since_best = 0
+        else:
+            evaluations_since_best += 1
+    return best_step, best_value, evaluations_since_best
+
+
+# evaluate returns a tuple of whether training should stop, and the step and value of the best
+# evaluation so far.
+def evaluate(policy, dict_step_to_value):
+    best_step, best_value, evaluations_since_best = find_best(
+        policy['metric'], policy['min_delta'], dict_step_to_value)
+    should_stop = evaluations_since_best >= policy['patience']
+    return should_stop, best_step, best_value
@@ -0,0 +1,130 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Perceptual hashes of video frames.
+#
+# Each frame's dHash is computed in cf_frame_extractor and stored in the VideoFrame entity as a
+# 16 character hex string. Two frames whose hashes differ in only a few bits look nearly the same.
+
+# Python Standard Library
+import logging
+
+# Other Modules
+import numpy as np
+
+# My Modules
+import exceptions
+
+
+DHASH_BITS = 64
+
+# Frames whose hashes differ in at most this many bits are considered near-duplicates.
+DEFAULT_MAX_DISTANCE = 4
+MAX_MAX_DISTANCE = 15
+
+
+# compute_dhash takes a grayscale image that has already been resized to 9 columns by 8 rows.
+def compute_dhash(small_gray_image):
+    pixels = np.asarray(small_gray_image, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return '%016x' % value
+
+
+def hamming_distance(dhash_a, dhash_b):
+    return bin(int(dhash_a, 16) ^ int(dhash_b, 16)).count('1')
+
+
+def validate_max_distance(s):
+    try:
+        max_distance = int(s)
+    except:
+        max_distance = -1
+    if max_distance < 0 or max_distance > MAX_MAX_DISTANCE:
+        message = "Error: '%s' is not a valid argument." % s
+        logging.critical(message)
+        raise exceptions.HttpErrorBadRequest(message)
+    return max_distance
+
+
+def __bands(dhash, band_count):
+    # Split the hash into band_count bands. If two hashes differ in at most band_count - 1 bits,
+    # at least one of their bands is identical.
+    value = int(dhash, 16)
+    band_bits = [DHASH_BITS // band_count + (1 if i < DHASH_BITS % band_count else 0)
+        for i in range(band_count)]
+    bands = []
+    shift = 0
+    for i, bits in enumerate(band_bits):
+        bands.append((i, (value >> shift) & ((1 << bits) - 1)))
+        shift += bits
+    return bands
+
+
+# find_near_duplicates returns a dict whose keys are the frame numbers in
+# dict_frame_number_to_dhash and whose values are the frame number of the representative of the
+# group of near-duplicates that the frame belongs to. The representative is the lowest frame
+# number in the group. Frames with no near-duplicates are their own representative.
+def find_near_duplicates(dict_frame_number_to_dhash, max_distance=DEFAULT_MAX_DISTANCE):
+    # Frames with identical hashes are always in the same group, and in a static or slow scene,
+    # most frames have the same hash as another frame. So the distinct hashes are grouped, and each
+    # distinct hash is only compared once.
+    dict_dhash_to_frame_numbers = {}
+    for frame_number, dhash in dict_frame_number_to_dhash.items():
+        dict_dhash_to_frame_numbers.setdefault(dhash, []).append(frame_number)
+    dict_dhash_to_value = {dhash: int(dhash, 16) for dhash in dict_dhash_to_frame_numbers}
+
+    # Candidate pairs are found with a banded index so that every pair doesn't have to be
+    # compared.
+    band_count = max_distance + 1
+    index = {}
+    for dhash in dict_dhash_to_frame_numbers:
+        for band in __bands(dhash, band_count):
+            index.setdefault(band, []).append(dhash)
+
+    parent = {dhash: dhash for dhash in dict_dhash_to_frame_numbers}
+    def find(dhash):
+        while parent[dhash] != dhash:
+            parent[dhash] = parent[parent[dhash]]
+            dhash = parent[dhash]
+        return dhash
+
+    for dhashes in index.values():
+        # Compare each hash in this band with the earlier hashes in the band, skipping those that
+        # are already in its group. Once it matches a hash in another group, the two groups are
+        # merged and the rest of that group's hashes are skipped. The groups are the same as
+        # comparing every pair of frames.
+        for i, b in enumerate(dhashes):
+            value_b = dict_dhash_to_value[b]
+            for a in dhashes[:i]:
+                root_a = find(a)
+                root_b = find(b)
+                if root_a == root_b:
+                    continue
+                if bin(dict_dhash_to_value[a] ^ value_b).count('1') <= max_distance:
+                    parent[root_a] = root_b
+
+    # The representative of each group is its lowest frame number.
+    dict_root_to_representative = {}
+    for dhash, frame_numbers in dict_dhash_to_frame_numbers.items():
+        root = find(dhash)
+        representative = min(frame_numbers)
+        if root not in dict_root_to_representative or representative < dict_root_to_representative[root]:
+            dict_root_to_representative[root] = representative
+    return {frame_number: dict_root_to_representative[find(dhash)]
+        for frame_number, dhash in dict_frame_number_to_dhash.items()}
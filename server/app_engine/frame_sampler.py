@@ -0,0 +1,118 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Diversity-aware selection of the frames that go into a dataset.
+#
+# When a team asks for at most max_frame_count frames, select_frames chooses which of the included
+# frames to keep. Every combination of labels that appears in the videos is kept at least once
+# (rarest first), and then the remaining budget is filled by farthest-point sampling over a
+# feature vector made of the frame's labels, the geometry of its boxes, and its dHash. The
+# selection depends only on its input, so producing the same dataset again selects the same frames.
+
+# Python Standard Library
+import collections
+
+# Other Modules
+import numpy as np
+
+# My Modules
+import bbox_writer
+import constants
+
+
+# NamedTuple for a frame that may be selected.
+Candidate = collections.namedtuple('Candidate', [
+    'video_uuid', 'frame_number', 'bboxes_text', 'dhash', 'width', 'height'])
+
+# Relative weights of the parts of the feature vector.
+LABEL_WEIGHT = 1.0
+GEOMETRY_WEIGHT = 1.0
+APPEARANCE_WEIGHT = 1.0
+
+
+def __label_set(candidate):
+    return frozenset(bbox_writer.extract_labels(candidate.bboxes_text))
+
+
+def __make_features(candidates, sorted_label_list):
+    label_index = {label: i for i, label in enumerate(sorted_label_list)}
+    label_features = np.zeros((len(candidates), len(sorted_label_list)), dtype=np.float32)
+    geometry_features = np.zeros((len(candidates), 6), dtype=np.float32)
+    appearance_features = np.zeros((len(candidates), 64), dtype=np.float32)
+    for i, candidate in enumerate(candidates):
+        rects, labels = bbox_writer.convert_text_to_rects_and_labels(candidate.bboxes_text)
+        for label in labels:
+            label_features[i, label_index[label]] = 1
+        if len(rects) > 0:
+            rects = np.array(rects, dtype=np.float32)
+            width = max(candidate.width, 1)
+            height = max(candidate.height, 1)
+            center_x = (rects[:, 0] + rects[:, 2]) / 2 / width
+            center_y = (rects[:, 1] + rects[:, 3]) / 2 / height
+            size = np.sqrt(np.abs((rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])) / (width * height))
+            geometry_features[i] = [
+                len(rects) / constants.MAX_BOUNDING_BOX_PER_FRAME,
+                center_x.mean(), center_y.mean(), size.mean(),
+                center_x.std(), center_y.std(),
+            ]
+        if candidate.dhash is not None:
+            value = int(candidate.dhash, 16)
+            appearance_features[i] = [(value >> bit) & 1 for bit in range(64)]
+    # Scale the appearance bits so that two completely different hashes are at distance 1.
+    appearance_features /= 8
+    return np.concatenate([
+        LABEL_WEIGHT * label_features,
+        GEOMETRY_WEIGHT * geometry_features,
+        APPEARANCE_WEIGHT * appearance_features], axis=1)
+
+
+# select_frames returns the indices (into candidates) of the selected frames, in increasing order.
+# The order of candidates is significant; callers should pass them in a stable order.
+def select_frames(candidates, max_frame_count):
+    if len(candidates) <= max_frame_count:
+        return list(range(len(candidates)))
+
+    label_sets = [__label_set(candidate) for candidate in candidates]
+    sorted_label_list = sorted(set().union(*label_sets))
+    features = __make_features(candidates, sorted_label_list)
+
+    # First, keep one frame for each combination of labels, starting with the rarest.
+    dict_label_set_to_indices = collections.OrderedDict()
+    for i, label_set in enumerate(label_sets):
+        dict_label_set_to_indices.setdefault(label_set, []).append(i)
+    selected = []
+    for label_set, indices in sorted(dict_label_set_to_indices.items(),
+            key=lambda item: (len(item[1]), sorted(item[0]))):
+        if len(selected) >= max_frame_count:
+            break
+        # Keep the frame nearest to the middle of the group.
+        group_features = features[indices]
+        distances = np.linalg.norm(group_features - group_features.mean(axis=0), axis=1)
+        selected.append(indices[int(np.argmin(distances))])
+
+    # Then, repeatedly keep the frame that is farthest from all the frames kept so far.
+    min_distances = np.full(len(candidates), np.inf, dtype=np.float32)
+    for i in selected:
+        min_distances = np.minimum(min_distances, np.linalg.norm(features - features[i], axis=1))
+    # Frames that are already kept are never chosen again, even if every remaining frame is a
+    # duplicate of one of them.
+    min_distances[selected] = -np.inf
+    while len(selected) < max_frame_count:
+        i = int(np.argmax(min_distances))
+        selected.append(i)
+        min_distances = np.minimum(min_distances, np.linalg.norm(features - features[i], axis=1))
+        min_distances[i] = -np.inf
+    return sorted(selected)
@@ -0,0 +1,35 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Gunicorn configuration for the app server.
+#
+# The tracking endpoints long-poll Datastore while they wait for the tracker to produce the next
+# frame. With the default sync worker, each waiting browser holds an instance thread. The gevent
+# worker lets those waits yield to other requests instead. If worker_connections is changed,
+# check max_concurrent_requests in terraform/core/main.tf.
+
+worker_class = 'gevent'
+worker_connections = 200
+timeout = 300
+
+
+def post_fork(server, worker):
+    # The google cloud client libraries use grpc, which must be told about gevent after the
+    # standard library has been monkey patched and before any channels are created.
+    from gevent import monkey
+    monkey.patch_all()
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
@@ -0,0 +1,65 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Largest-Triangle-Three-Buckets downsampling of a line chart series.
+#
+# The first and last points are always kept. The points in between are split into buckets, and
+# from each bucket the point that forms the largest triangle with the point kept from the previous
+# bucket and the average of the next bucket is kept. This keeps the peaks and valleys that a
+# viewer would notice, unlike taking every nth point.
+
+# Other Modules
+import numpy as np
+
+
+# downsample returns the indices of the points to keep, in increasing order. xs must be sorted.
+def downsample(xs, ys, max_points):
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    n = len(xs)
+    if max_points >= n or n <= 2:
+        return np.arange(n)
+    if max_points <= 2:
+        return np.array([0, n - 1])[:max(max_points, 0)]
+
+    # Bucket boundaries for the points between the first and the last.
+    bucket_edges = np.floor(np.linspace(1, n - 1, max_points - 1)).astype(np.int64)
+    # Averages of each bucket, and of the last point, which acts as the bucket after the last one.
+    cumulative_xs = np.concatenate([[0.0], np.cumsum(xs)])
+    cumulative_ys = np.concatenate([[0.0], np.cumsum(ys)])
+    starts = np.append(bucket_edges[:-1], n - 1)
+    ends = np.append(bucket_edges[1:], n)
+    counts = ends - starts
+    average_xs = (cumulative_xs[ends] - cumulative_xs[starts]) / counts
+    average_ys = (cumulative_ys[ends] - cumulative_ys[starts]) / counts
+
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0] = 0
+    a = 0
+    for i in range(max_points - 2):
+        start = bucket_edges[i]
+        end = bucket_edges[i + 1]
+        bucket_xs = xs[start:end]
+        bucket_ys = ys[start:end]
+        # Twice the area of the triangle formed by the previous kept point, each point in the
+        # bucket, and the average of the next bucket.
+        areas = np.abs(
+            (xs[a] - average_xs[i + 1]) * (bucket_ys - ys[a]) -
+            (xs[a] - bucket_xs) * (average_ys[i + 1] - ys[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    indices[max_points - 1] = n - 1
+    return indices
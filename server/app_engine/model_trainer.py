@@ -23,6 +23,7 @@ import traceback
 # Other Modules
 import googleapiclient.discovery
 from google.oauth2 import service_account
+import numpy as np
 
 # My Modules
 import action
@@ -30,6 +31,7 @@ import blob_storage
 import cloud_secrets
 import constants
 import exceptions
+import lttb
 import storage
 import util
 
@@ -133,7 +135,8 @@ def __get_num_warmup_steps(original_starting_model, num_training_steps):
 
 
 def start_training_model(team_uuid, description, dataset_uuid_list,
-        starting_model, max_running_minutes, num_training_steps, create_time_ms, use_tpu):
+        starting_model, max_running_minutes, num_training_steps, create_time_ms, use_tpu,
+        early_stopping=None, export_best_checkpoints=False, export_checkpoints_every_n=0):
     found_starting_model = starting_model in STARTING_MODELS
     if found_starting_model:
         starting_model_uuid = None
@@ -332,8 +335,8 @@ def start_training_model(team_uuid, description, dataset_uuid_list,
     tensorflow_version = '2'
     model_entity = storage.model_trainer_started(team_uuid, model_uuid, description, model_folder,
         tensorflow_version, use_tpu, dataset_uuids, create_time_ms, max_running_minutes,
-        num_training_steps, batch_size, num_warmup_steps, CHECKPOINT_EVERY_N,
-        previous_training_steps, starting_model, user_visible_starting_model,
+        num_training_steps, batch_size, num_warmup_steps, CHECKPOINT_EVERY_N, early_stopping,
+        export_best_checkpoints, export_checkpoints_every_n, previous_training_steps, starting_model, user_visible_starting_model,
         original_starting_model, fine_tune_checkpoint,
         sorted_label_list, label_map_path, train_input_path, eval_input_path,
         train_frame_count, eval_frame_count, train_negative_frame_count, eval_negative_frame_count,
@@ -503,3 +506,61 @@ def retrieve_summary_items(team_uuid, model_uuid, job_type, value_type, dict_ste
             summary_items_list.append(summary_item)
     return summary_items_list
 
+
+# The scalar series for a chart is downsampled to at most this many points.
+MAX_SCALAR_SERIES_POINTS = 4000
+
+
+# retrieve_scalar_series returns, for each tag, parallel lists of steps and values, downsampled to
+# at most max_points points.
+def retrieve_scalar_series(team_uuid, model_uuid, job_type, max_points):
+    # storage.retrieve_model_entity will raise HttpErrorNotFound
+    # if the team_uuid/model_uuid is not found.
+    model_entity = storage.retrieve_model_entity(team_uuid, model_uuid)
+    dict_tag_to_series = __retrieve_full_scalar_series(model_entity, job_type)
+    dict_tag_to_downsampled_series = {}
+    for tag, series in dict_tag_to_series.items():
+        steps = np.array(series['steps'], dtype=np.int64)
+        values = np.array(series['values'], dtype=np.float64)
+        indices = lttb.downsample(steps, values, max_points)
+        dict_tag_to_downsampled_series[tag] = {
+            'steps': steps[indices].tolist(),
+            'values': values[indices].tolist(),
+            'point_count': len(steps),
+        }
+    return dict_tag_to_downsampled_series
+
+
+def __retrieve_full_scalar_series(model_entity, job_type):
+    model_folder = model_entity['model_folder']
+    # Read the version before the summary items, so that items stored while the cache is being
+    # rebuilt make it stale.
+    version = storage.get_scalar_series_version(model_entity, job_type)
+    scalar_series_json = blob_storage.retrieve_scalar_series(model_folder, job_type)
+    if scalar_series_json is not None:
+        scalar_series = json.loads(scalar_series_json)
+        if scalar_series['version'] == version:
+            return scalar_series['series']
+
+    dict_tag_to_steps = {}
+    dict_tag_to_values = {}
+    list_of_summary_items = storage.get_model_summary_items_all_steps(model_entity, job_type, 'scalar')
+    for summary_items in list_of_summary_items:
+        for key, item in summary_items.items():
+            dict_tag_to_steps.setdefault(item['tag'], []).append(item['step'])
+            dict_tag_to_values.setdefault(item['tag'], []).append(item['value'])
+    dict_tag_to_series = {}
+    for tag, steps in dict_tag_to_steps.items():
+        steps = np.array(steps, dtype=np.int64)
+        values = np.array(dict_tag_to_values[tag], dtype=np.float64)
+        order = np.argsort(steps, kind='stable')
+        dict_tag_to_series[tag] = {
+            'steps': steps[order].tolist(),
+            'values': values[order].tolist(),
+        }
+    scalar_series = {
+        'version': version,
+        'series': dict_tag_to_series,
+    }
+    blob_storage.store_scalar_series(model_folder, job_type, json.dumps(scalar_series))
+    return dict_tag_to_series
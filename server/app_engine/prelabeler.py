@@ -0,0 +1,55 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Python Standard Library
+import logging
+
+# My Modules
+import action
+import blob_storage
+import exceptions
+import storage
+
+
+DEFAULT_CONFIDENCE_THRESHOLD = 0.5
+
+
+def start_prelabeling(team_uuid, video_uuid, model_uuid, confidence_threshold):
+    # storage.retrieve_model_entity will raise HttpErrorNotFound
+    # if the team_uuid/model_uuid is not found.
+    model_entity = storage.retrieve_model_entity(team_uuid, model_uuid)
+    if not blob_storage.tflite_model_with_metadata_exists(model_entity['tflite_files_folder']):
+        message = 'Error: The TensorFlow Lite model for model_uuid=%s has not been created.' % model_uuid
+        logging.critical(message)
+        raise exceptions.HttpErrorUnprocessableEntity(message)
+    # storage.retrieve_video_entity will raise HttpErrorNotFound
+    # if the team_uuid/video_uuid is not found.
+    video_entity = storage.retrieve_video_entity(team_uuid, video_uuid)
+    if 'frame_extraction_end_time' not in video_entity or video_entity['frame_extraction_failed']:
+        message = 'Error: Frame extraction has not finished for video_uuid=%s.' % video_uuid
+        logging.critical(message)
+        raise exceptions.HttpErrorUnprocessableEntity(message)
+    # storage.prelabeling_starting will raise HttpErrorConflict if tracking or prelabeling is
+    # already in progress on this video.
+    video_entity = storage.prelabeling_starting(team_uuid, video_uuid, model_uuid, confidence_threshold)
+    action_parameters = action.create_action_parameters(
+        team_uuid, action.ACTION_NAME_PRELABEL_VIDEO)
+    action_parameters['team_uuid'] = team_uuid
+    action_parameters['video_uuid'] = video_uuid
+    action_parameters['model_uuid'] = model_uuid
+    action_parameters['confidence_threshold'] = confidence_threshold
+    action_parameters['prelabeling_uuid'] = video_entity['prelabeling_uuid']
+    action.trigger_action_via_blob(action_parameters)
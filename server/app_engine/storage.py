@@ -19,15 +19,18 @@ from datetime import datetime, timedelta, timezone
 import dateutil.parser
 import json
 import logging
+import random
 import time
 import traceback
 import uuid
 
 # Other Modules
+from google.api_core.exceptions import Conflict
 from google.cloud import datastore
 
 # My Modules
 import action
+import action_scheduler
 import bbox_writer
 import blob_storage
 import constants
@@ -47,8 +50,31 @@ DS_KIND_MODEL = 'Model'
 DS_KIND_MODEL_SUMMARY_ITEMS = 'ModelSummaryItems'
 DS_KIND_ACTION = 'Action'
 DS_KIND_ADMIN_ACTION = 'AdminAction'
+DS_KIND_FAN_OUT = 'FanOut'
+DS_KIND_ACTION_CHECKPOINT = 'ActionCheckpoint'
+DS_KIND_ACTION_SCHEDULER = 'ActionScheduler'
+DS_KIND_QUEUED_ACTION = 'QueuedAction'
 DS_KIND_END_OF_SEASON = 'EndOfSeason'
 
+# A transaction that is aborted because another transaction changed the same entity is tried again,
+# up to this many times.
+TRANSACTION_ATTEMPTS = 5
+
+
+# __retry_on_conflict calls fn, which runs a transaction, and calls it again if the transaction was
+# aborted because of contention. The wait between attempts grows, with jitter, so that the
+# transactions that collided don't collide again.
+def __retry_on_conflict(fn, *args):
+    for attempt in range(TRANSACTION_ATTEMPTS):
+        try:
+            return fn(*args)
+        except Conflict:
+            if attempt == TRANSACTION_ATTEMPTS - 1:
+                raise
+            logging.warning('storage.__retry_on_conflict - %s - transaction aborted, attempt %d' %
+                (fn.__name__, attempt + 1))
+            time.sleep(random.uniform(0, 0.1 * (2 ** attempt)))
+
 
 def validate_uuid(s):
     if len(s) != 32:
@@ -603,13 +629,15 @@ def retrieve_video_frame_entities(team_uuid, video_uuid, min_frame_number, max_f
     return __query_video_frame(team_uuid, video_uuid, min_frame_number, max_frame_number)
 
 
-def store_frame_image(team_uuid, video_uuid, frame_number, content_type, image_data):
+def store_frame_image(team_uuid, video_uuid, frame_number, content_type, image_data, dhash=None):
     image_blob_name = blob_storage.store_video_frame_image(team_uuid, video_uuid, frame_number, content_type, image_data)
     datastore_client = datastore.Client()
     with datastore_client.transaction() as transaction:
         video_frame_entity = __retrieve_video_frame_entity(team_uuid, video_uuid, frame_number)
         video_frame_entity['content_type'] = content_type
         video_frame_entity['image_blob_name'] = image_blob_name
+        if dhash is not None:
+            video_frame_entity['dhash'] = dhash
         transaction.put(video_frame_entity)
         # Also update the video_entity in the same transaction.
         video_entity = retrieve_video_entity(team_uuid, video_uuid)
@@ -622,6 +650,20 @@ def store_frame_image(team_uuid, video_uuid, frame_number, content_type, image_d
         return video_entity
 
 
+# Returns a dict whose keys are frame numbers and whose values are the dhash values of the
+# frames. Frames that were extracted before dhash values were computed are omitted.
+def retrieve_video_frame_dhashes(team_uuid, video_uuid):
+    video_entity = retrieve_video_entity(team_uuid, video_uuid)
+    dict_frame_number_to_dhash = {}
+    if video_entity['extracted_frame_count'] == 0:
+        return dict_frame_number_to_dhash
+    video_frame_entities = __query_video_frame(team_uuid, video_uuid, 0, video_entity['extracted_frame_count'] - 1)
+    for video_frame_entity in video_frame_entities:
+        if 'dhash' in video_frame_entity:
+            dict_frame_number_to_dhash[video_frame_entity['frame_number']] = video_frame_entity['dhash']
+    return dict_frame_number_to_dhash
+
+
 def retrieve_video_frame_image(team_uuid, video_uuid, frame_number):
     video_frame_entity = __retrieve_video_frame_entity(team_uuid, video_uuid, frame_number)
     if 'image_blob_name' not in video_frame_entity:
@@ -642,6 +684,8 @@ def __store_video_frame_bboxes_text(transaction, team_uuid, video_uuid, frame_nu
     previously_had_labels = len(video_frame_entity['bboxes_text']) > 0
     now_has_labels = len(bboxes_text) > 0
     video_frame_entity['bboxes_text'] = bboxes_text
+    # Once the user has saved the bboxes, they are no longer machine-proposed.
+    video_frame_entity.pop('bboxes_proposed_by_model_uuid', None)
     transaction.put(video_frame_entity)
     if previously_had_labels != now_has_labels:
         # Also update the video_entity in the same transaction.
@@ -692,6 +736,10 @@ def tracker_starting(team_uuid, video_uuid, tracker_name, scale, init_frame_numb
             message = 'Error: Tracking is already in progress for video_uuid=%s.' % video_uuid
             logging.critical(message)
             raise exceptions.HttpErrorConflict(message)
+        if __is_prelabeling_in_progress(video_entity):
+            message = 'Error: Prelabeling is in progress for video_uuid=%s.' % video_uuid
+            logging.critical(message)
+            raise exceptions.HttpErrorConflict(message)
         incomplete_key = datastore_client.key(DS_KIND_TRACKER)
         tracker_entity = datastore.Entity(key=incomplete_key)
         tracker_entity.update({
@@ -728,6 +776,81 @@ def tracker_starting(team_uuid, video_uuid, tracker_name, scale, init_frame_numb
         __add_video_uuid_to_tracking_list(transaction, team_uuid, video_uuid)
         return tracker_uuid
 
+# prelabeling - public methods
+
+def prelabeling_starting(team_uuid, video_uuid, model_uuid, confidence_threshold):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        video_entity = retrieve_video_entity(team_uuid, video_uuid)
+        if video_entity['tracking_in_progress']:
+            message = 'Error: Tracking is in progress for video_uuid=%s.' % video_uuid
+            logging.critical(message)
+            raise exceptions.HttpErrorConflict(message)
+        if __is_prelabeling_in_progress(video_entity):
+            message = 'Error: Prelabeling is already in progress for video_uuid=%s.' % video_uuid
+            logging.critical(message)
+            raise exceptions.HttpErrorConflict(message)
+        video_entity['prelabeling_in_progress'] = True
+        video_entity['prelabeling_uuid'] = str(uuid.uuid4().hex)
+        video_entity['prelabeling_model_uuid'] = model_uuid
+        video_entity['prelabeling_confidence_threshold'] = confidence_threshold
+        video_entity['prelabeling_next_frame_number'] = 0
+        video_entity['prelabeled_frame_count'] = 0
+        video_entity['prelabeling_start_time'] = datetime.now(timezone.utc)
+        video_entity['prelabeling_active_time'] = video_entity['prelabeling_start_time']
+        transaction.put(video_entity)
+        return video_entity
+
+# Prelabeling is in progress until prelabeling_finished is called, or until nothing has been stored
+# for PRELABELING_TIMEOUT, which means that the prelabeler's cloud function was killed. The timeout
+# is long enough for the prelabeling action to wait in the action scheduler's queue.
+PRELABELING_TIMEOUT = timedelta(minutes=30)
+
+def __is_prelabeling_in_progress(video_entity):
+    if not video_entity.get('prelabeling_in_progress', False):
+        return False
+    active_time = video_entity.get('prelabeling_active_time', video_entity.get('prelabeling_start_time'))
+    if active_time is None:
+        return True
+    return datetime.now(timezone.utc) - active_time <= PRELABELING_TIMEOUT
+
+# store_prelabeled_bboxes stores the proposed bboxes for a contiguous range of frames. Frames
+# that already have labels are left alone.
+def store_prelabeled_bboxes(team_uuid, video_uuid, model_uuid, min_frame_number, list_of_bboxes_text):
+    max_frame_number = min_frame_number + len(list_of_bboxes_text) - 1
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        video_entity = retrieve_video_entity(team_uuid, video_uuid)
+        video_frame_entities = __query_video_frame(team_uuid, video_uuid, min_frame_number, max_frame_number)
+        for video_frame_entity in video_frame_entities:
+            bboxes_text = list_of_bboxes_text[video_frame_entity['frame_number'] - min_frame_number]
+            if len(bboxes_text) == 0 or len(video_frame_entity['bboxes_text']) > 0:
+                continue
+            video_frame_entity['bboxes_text'] = bboxes_text
+            video_frame_entity['bboxes_proposed_by_model_uuid'] = model_uuid
+            transaction.put(video_frame_entity)
+            video_entity['labeled_frame_count'] += 1
+            video_entity['prelabeled_frame_count'] += 1
+        video_entity['prelabeling_next_frame_number'] = max_frame_number + 1
+        video_entity['prelabeling_active_time'] = datetime.now(timezone.utc)
+        transaction.put(video_entity)
+        return video_entity
+
+# If prelabeling_uuid is not the one given by prelabeling_starting, prelabeling was started again
+# after this prelabeler's lock expired, and the video entity is left alone.
+def prelabeling_finished(team_uuid, video_uuid, prelabeling_uuid, error_message=''):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        video_entity = maybe_retrieve_video_entity(team_uuid, video_uuid)
+        if video_entity is None:
+            return
+        if video_entity.get('prelabeling_uuid') != prelabeling_uuid:
+            return
+        video_entity['prelabeling_in_progress'] = False
+        video_entity['prelabeling_error_message'] = error_message
+        video_entity['prelabeling_end_time'] = datetime.now(timezone.utc)
+        transaction.put(video_entity)
+
 # Retrieves the tracker entity associated with the given tracker_uuid and video_uuid. If no such
 # entity exists, returns None.
 def maybe_retrieve_tracker_entity(video_uuid, tracker_uuid):
@@ -859,7 +982,8 @@ def increment_datasets_downloaded_today(team_uuid):
 # prepare_to_start_dataset_production will raise HttpErrorNotFound
 # if any of the team_uuid/video_uuids is not found
 # or if none of the videos have labeled frames.
-def prepare_to_start_dataset_production(team_uuid, description, video_uuids, eval_percent, create_time_ms):
+def prepare_to_start_dataset_production(team_uuid, description, video_uuids, eval_percent, create_time_ms,
+        max_frame_count=0):
     dataset_uuid = str(uuid.uuid4().hex)
     datastore_client = datastore.Client()
     with datastore_client.transaction() as transaction:
@@ -892,6 +1016,7 @@ def prepare_to_start_dataset_production(team_uuid, description, video_uuids, eva
             'description': description,
             'video_uuids': video_uuids,
             'eval_percent': eval_percent,
+            'max_frame_count': max_frame_count,
             'create_time_ms': create_time_ms,
             'create_time': util.datetime_from_ms(create_time_ms),
             'dataset_completed': False,
@@ -904,6 +1029,17 @@ def prepare_to_start_dataset_production(team_uuid, description, video_uuids, eva
         transaction.put(dataset_entity)
         return dataset_uuid
 
+def dataset_producer_sampled_frames(team_uuid, dataset_uuid, sampling_report):
+    sampling_report_blob_name = blob_storage.store_dataset_sampling_report(team_uuid, dataset_uuid,
+        json.dumps(sampling_report))
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        dataset_entity = retrieve_dataset_entity(team_uuid, dataset_uuid)
+        dataset_entity['sampling_candidate_frame_count'] = sampling_report['candidate_frame_count']
+        dataset_entity['sampling_dropped_frame_count'] = sampling_report['dropped_frame_count']
+        dataset_entity['sampling_report_blob_name'] = sampling_report_blob_name
+        transaction.put(dataset_entity)
+
 def dataset_producer_starting(team_uuid, dataset_uuid, sorted_label_list,
         train_frame_count, train_record_count, train_input_path,
         eval_frame_count, eval_record_count, eval_input_path):
@@ -1094,6 +1230,11 @@ def finish_delete_dataset(action_parameters):
         datastore_client.delete(dataset_entity.key)
     # Delete the label.pbtxt blob.
     blob_storage.delete_dataset_blob(dataset_entity['label_map_blob_name'])
+    # Delete the sampling report blob.
+    if 'sampling_report_blob_name' in dataset_entity:
+        blob_storage.delete_dataset_blob(dataset_entity['sampling_report_blob_name'])
+    # Delete the cached dataset zips.
+    __delete_dataset_zips_for_dataset(team_uuid, dataset_uuid)
 
 
 # dataset record
@@ -1200,21 +1341,124 @@ def finish_delete_dataset_record_writers(action_parameters):
 
 # dataset zipper - public methods
 
-def create_dataset_zippers(team_uuid, dataset_zip_uuid, partition_count):
+# Dataset zips are cached. The dataset_zip_uuid is derived from the dataset's contents, so asking
+# to zip the same dataset again finds the zipper entities that are already there.
+# reference_or_create_dataset_zippers returns True if the zippers were created and the zip action
+# needs to be triggered.
+def reference_or_create_dataset_zippers(team_uuid, dataset_uuid, dataset_zip_uuid, partition_lists):
     datastore_client = datastore.Client()
     with datastore_client.transaction() as transaction:
-        for partition_index in range(partition_count):
+        dataset_zipper_entities = __query_dataset_zippers(team_uuid, dataset_zip_uuid)
+        if len(dataset_zipper_entities) == len(partition_lists):
+            if not __is_dataset_zip_stalled(team_uuid, dataset_zipper_entities):
+                for dataset_zipper_entity in dataset_zipper_entities:
+                    dataset_zipper_entity['reference_count'] = dataset_zipper_entity.get('reference_count', 0) + 1
+                    dataset_zipper_entity['last_requested_time'] = datetime.now(timezone.utc)
+                    transaction.put(dataset_zipper_entity)
+                return False
+        # Remove whatever is left of a previous attempt before starting again.
+        for dataset_zipper_entity in dataset_zipper_entities:
+            blob_storage.delete_dataset_zip(team_uuid, dataset_zip_uuid, dataset_zipper_entity['partition_index'])
+            transaction.delete(dataset_zipper_entity.key)
+        for partition_index, partition_list in enumerate(partition_lists):
             incomplete_key = datastore_client.key(DS_KIND_DATASET_ZIPPER)
-            dataset_zipper_entity = datastore.Entity(key=incomplete_key)
+            dataset_zipper_entity = datastore.Entity(key=incomplete_key, exclude_from_indexes=['partition_list'])
             dataset_zipper_entity.update({
                 'team_uuid': team_uuid,
+                'dataset_uuid': dataset_uuid,
                 'dataset_zip_uuid': dataset_zip_uuid,
                 'partition_index': partition_index,
-                'file_count': 0,
+                'partition_list': partition_list,
+                'file_count': len(partition_list),
                 'files_written': 0,
+                'reference_count': 1,
+                'last_requested_time': datetime.now(timezone.utc),
                 'update_time': datetime.now(timezone.utc),
             })
             transaction.put(dataset_zipper_entity)
+        return True
+
+def __query_dataset_zippers(team_uuid, dataset_zip_uuid):
+    datastore_client = datastore.Client()
+    query = datastore_client.query(kind=DS_KIND_DATASET_ZIPPER)
+    query.add_filter('team_uuid', '=', team_uuid)
+    query.add_filter('dataset_zip_uuid', '=', dataset_zip_uuid)
+    return list(query.fetch())
+
+def __is_dataset_zip_stalled(team_uuid, dataset_zipper_entities):
+    # A partition that hasn't been updated in 15 minutes and whose zip doesn't exist is not going
+    # to be finished. The zip partition action would have timed out long before then.
+    for dataset_zipper_entity in dataset_zipper_entities:
+        timedelta_since_last_update = datetime.now(timezone.utc) - dataset_zipper_entity['update_time']
+        if timedelta_since_last_update > timedelta(minutes=15):
+            if not blob_storage.dataset_zip_exists(team_uuid, dataset_zipper_entity['dataset_zip_uuid'],
+                    dataset_zipper_entity['partition_index']):
+                return True
+    return False
+
+def __is_dataset_zip_expired(dataset_zipper_entities):
+    # A zip that nobody is downloading is kept for a day after it was last requested. A zip that
+    # is still referenced is kept for a week, in case the browser went away without releasing it.
+    for dataset_zipper_entity in dataset_zipper_entities:
+        last_requested_time = dataset_zipper_entity.get('last_requested_time', dataset_zipper_entity['update_time'])
+        timedelta_since_last_request = datetime.now(timezone.utc) - last_requested_time
+        if dataset_zipper_entity.get('reference_count', 0) > 0:
+            if timedelta_since_last_request <= timedelta(days=7):
+                return False
+        elif timedelta_since_last_request <= timedelta(days=1):
+            return False
+    return True
+
+def __delete_dataset_zips(dict_dataset_zip_uuid_to_entities, team_uuid):
+    datastore_client = datastore.Client()
+    for dataset_zip_uuid, dataset_zipper_entities in dict_dataset_zip_uuid_to_entities.items():
+        for dataset_zipper_entity in dataset_zipper_entities:
+            blob_storage.delete_dataset_zip(team_uuid, dataset_zip_uuid, dataset_zipper_entity['partition_index'])
+        datastore_client.delete_multi([dataset_zipper_entity.key for dataset_zipper_entity in dataset_zipper_entities])
+
+def __group_dataset_zippers(dataset_zipper_entities):
+    dict_dataset_zip_uuid_to_entities = {}
+    for dataset_zipper_entity in dataset_zipper_entities:
+        dict_dataset_zip_uuid_to_entities.setdefault(
+            dataset_zipper_entity['dataset_zip_uuid'], []).append(dataset_zipper_entity)
+    return dict_dataset_zip_uuid_to_entities
+
+# Deletes the dataset zips that have expired. This is called from delete_stale_actions, so zips are
+# swept even if nobody prepares another zip.
+def delete_expired_dataset_zips(action_parameters):
+    datastore_client = datastore.Client()
+    # A zip can only be expired if it hasn't been requested for a day.
+    query = datastore_client.query(kind=DS_KIND_DATASET_ZIPPER)
+    query.add_filter('last_requested_time', '<', datetime.now(timezone.utc) - timedelta(days=1))
+    candidates = set()
+    for dataset_zipper_entity in query.fetch():
+        action.retrigger_if_necessary(action_parameters)
+        candidates.add((dataset_zipper_entity['team_uuid'], dataset_zipper_entity['dataset_zip_uuid']))
+    for team_uuid, dataset_zip_uuid in candidates:
+        action.retrigger_if_necessary(action_parameters)
+        __retry_on_conflict(__delete_dataset_zip_if_expired, team_uuid, dataset_zip_uuid)
+
+# The expiry and reference counts are checked again inside the transaction, so a zip that is
+# referenced by reference_or_create_dataset_zippers at the same time is not deleted.
+def __delete_dataset_zip_if_expired(team_uuid, dataset_zip_uuid):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        dataset_zipper_entities = __query_dataset_zippers(team_uuid, dataset_zip_uuid)
+        if len(dataset_zipper_entities) == 0 or not __is_dataset_zip_expired(dataset_zipper_entities):
+            return
+        for dataset_zipper_entity in dataset_zipper_entities:
+            transaction.delete(dataset_zipper_entity.key)
+    # The blobs are deleted after the transaction has committed. If the zip is requested again, the
+    # zipper entities are created again and the zip is rewritten.
+    for dataset_zipper_entity in dataset_zipper_entities:
+        blob_storage.delete_dataset_zip(team_uuid, dataset_zip_uuid, dataset_zipper_entity['partition_index'])
+
+def __delete_dataset_zips_for_dataset(team_uuid, dataset_uuid):
+    datastore_client = datastore.Client()
+    query = datastore_client.query(kind=DS_KIND_DATASET_ZIPPER)
+    query.add_filter('team_uuid', '=', team_uuid)
+    query.add_filter('dataset_uuid', '=', dataset_uuid)
+    __delete_dataset_zips(__group_dataset_zippers(query.fetch()), team_uuid)
 
 def __maybe_retrieve_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index):
     datastore_client = datastore.Client()
@@ -1227,6 +1471,24 @@ def __maybe_retrieve_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index
         return None
     return dataset_zipper_entities[0]
 
+def retrieve_dataset_zipper_partition_lists(team_uuid, dataset_zip_uuid, partition_count):
+    datastore_client = datastore.Client()
+    query = datastore_client.query(kind=DS_KIND_DATASET_ZIPPER)
+    query.add_filter('team_uuid', '=', team_uuid)
+    query.add_filter('dataset_zip_uuid', '=', dataset_zip_uuid)
+    query.order = ['partition_index']
+    dataset_zipper_entities = list(query.fetch(partition_count))
+    # Check that all the partitions were found
+    if len(dataset_zipper_entities) != partition_count:
+        message = 'Error: Dataset zipper entities for dataset_zip_uuid=%s partition_count=%d not all found.' % (
+                dataset_zip_uuid, partition_count)
+        logging.critical(message)
+        raise exceptions.HttpErrorNotFound(message)
+    partition_lists = [[] for i in range(partition_count)]
+    for dataset_zipper_entity in dataset_zipper_entities:
+        partition_lists[dataset_zipper_entity['partition_index']] = dataset_zipper_entity['partition_list']
+    return partition_lists
+
 def update_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index, file_count, files_written):
     datastore_client = datastore.Client()
     with datastore_client.transaction() as transaction:
@@ -1258,11 +1520,15 @@ def retrieve_dataset_zipper_files_written(team_uuid, dataset_zip_uuid, partition
         files_written_array[i] = dataset_zipper_entity['files_written']
     return file_count_array, files_written_array
 
-def delete_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index):
+# release_dataset_zipper is called when the browser has finished downloading a partition. The zip
+# isn't deleted; it stays in the cache until it expires or the dataset is deleted.
+def release_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index):
     datastore_client = datastore.Client()
-    dataset_zipper_entity = __maybe_retrieve_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index)
-    if dataset_zipper_entity is not None:
-        datastore_client.delete(dataset_zipper_entity.key)
+    with datastore_client.transaction() as transaction:
+        dataset_zipper_entity = __maybe_retrieve_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index)
+        if dataset_zipper_entity is not None:
+            dataset_zipper_entity['reference_count'] = max(dataset_zipper_entity.get('reference_count', 0) - 1, 0)
+            transaction.put(dataset_zipper_entity)
 
 # model - public methods
 
@@ -1291,8 +1557,8 @@ def model_trainer_failed_to_start(team_uuid, model_folder, max_running_minutes):
 
 def model_trainer_started(team_uuid, model_uuid, description, model_folder,
         tensorflow_version, use_tpu, dataset_uuids, create_time_ms, max_running_minutes,
-        num_training_steps, batch_size, num_warmup_steps, checkpoint_every_n,
-        previous_training_steps, starting_model, user_visible_starting_model,
+        num_training_steps, batch_size, num_warmup_steps, checkpoint_every_n, early_stopping,
+        export_best_checkpoints, export_checkpoints_every_n, previous_training_steps, starting_model, user_visible_starting_model,
         original_starting_model, fine_tune_checkpoint,
         sorted_label_list, label_map_path, train_input_path, eval_input_path,
         train_frame_count, eval_frame_count, train_negative_frame_count, eval_negative_frame_count,
@@ -1331,6 +1597,10 @@ def model_trainer_started(team_uuid, model_uuid, description, model_folder,
             'batch_size': batch_size,
             'num_warmup_steps': num_warmup_steps,
             'checkpoint_every_n': checkpoint_every_n,
+            'early_stopping': early_stopping,
+            'early_stopping_triggered': False,
+            'export_best_checkpoints': export_best_checkpoints,
+            'export_checkpoints_every_n': export_checkpoints_every_n,
             'previous_training_steps': previous_training_steps,
             'total_training_steps': (num_training_steps + previous_training_steps),
             'cancel_requested': False,
@@ -1343,6 +1613,10 @@ def model_trainer_started(team_uuid, model_uuid, description, model_folder,
             'eval_job_elapsed_seconds': 0,
             'evaled_steps': 0,
             'dict_event_file_path_to_updated': {},
+            'dict_event_file_path_to_offset': {},
+            'dict_event_file_path_to_crc': {},
+            'dict_checkpoint_step_to_number': {},
+            'summary_items_keyed': True,
             'monitor_training_triggered_time_ms': 0,
             'monitor_training_active_time_ms': 0,
             'monitor_training_finished': False,
@@ -1383,6 +1657,25 @@ def stop_training_requested(team_uuid, model_uuid):
         transaction.put(model_entity)
         return model_entity
 
+# checkpoint_path is the checkpoint that was evaluated at best_step. It is kept as the
+# trained_checkpoint_path, even if later checkpoints are written before the job is cancelled. If it
+# is '', the checkpoint has already been deleted by the training job, and
+# early_stopping_checkpoint_deleted is set to True.
+def early_stopping_triggered(team_uuid, model_uuid, best_step, best_value, checkpoint_path):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        model_entity = retrieve_model_entity(team_uuid, model_uuid)
+        model_entity['early_stopping_triggered'] = True
+        model_entity['early_stopping_best_step'] = best_step
+        model_entity['early_stopping_best_value'] = best_value
+        model_entity['early_stopping_checkpoint_path'] = checkpoint_path
+        model_entity['early_stopping_checkpoint_deleted'] = (checkpoint_path == '')
+        if checkpoint_path != '':
+            model_entity['trained_checkpoint_path'] = checkpoint_path
+        model_entity['update_time'] = datetime.now(timezone.utc)
+        transaction.put(model_entity)
+        return model_entity
+
 # Returns a list containing the model entity associated with the given team_uuid and
 # model_uuid. If no such entity exists, returns an empty list.
 def __query_model_entity(team_uuid, model_uuid):
@@ -1506,7 +1799,8 @@ def __update_model_entity_job_state(model_entity, job, prefix):
             logging.critical('error in job train_%s: %s' % (model_entity['model_uuid'], error_message))
     model_entity[prefix + 'error_message'] = (error_message[:1498] + '..') if len(error_message) > 1500 else error_message
 
-def update_model_entity_job_state(team_uuid, model_uuid, train_job, eval_job):
+# If trained_checkpoint_path is None, the checkpoints are listed to find it.
+def update_model_entity_job_state(team_uuid, model_uuid, train_job, eval_job, trained_checkpoint_path=None):
     datastore_client = datastore.Client()
     with datastore_client.transaction() as transaction:
         model_entity = retrieve_model_entity(team_uuid, model_uuid)
@@ -1524,8 +1818,13 @@ def update_model_entity_job_state(team_uuid, model_uuid, train_job, eval_job):
                 transaction.put(team_entity)
         if eval_job is not None:
             __update_model_entity_job_state(model_entity, eval_job, 'eval_')
-        # Set trained_checkpoint_path.
-        trained_checkpoint_path = blob_storage.get_trained_checkpoint_path(model_entity['model_folder'])
+        # Set trained_checkpoint_path, unless training was stopped early and a checkpoint was
+        # chosen then. The training job may have deleted that checkpoint before it was cancelled.
+        early_stopping_checkpoint_path = model_entity.get('early_stopping_checkpoint_path', '')
+        if early_stopping_checkpoint_path != '' and blob_storage.checkpoint_exists(early_stopping_checkpoint_path):
+            trained_checkpoint_path = early_stopping_checkpoint_path
+        elif trained_checkpoint_path is None:
+            trained_checkpoint_path = blob_storage.get_trained_checkpoint_path(model_entity['model_folder'])
         model_entity['trained_checkpoint_path'] = trained_checkpoint_path
         model_entity['update_time'] = datetime.now(timezone.utc)
         transaction.put(model_entity)
@@ -1567,6 +1866,12 @@ def get_model_summary_items(model_entity, job_type, value_type, step):
         return summary_items
     # Look for the model summary items entity.
     datastore_client = datastore.Client()
+    if model_entity.get('summary_items_keyed', False):
+        summary_items_entity = datastore_client.get(__make_model_summary_items_key(
+            datastore_client, model_entity['model_uuid'], job_type, value_type, step))
+        if summary_items_entity is None:
+            return {}
+        return summary_items_entity['summary_items']
     query = datastore_client.query(kind=DS_KIND_MODEL_SUMMARY_ITEMS)
     query.add_filter('team_uuid', '=', model_entity['team_uuid'])
     query.add_filter('model_uuid', '=', model_entity['model_uuid'])
@@ -1579,6 +1884,13 @@ def get_model_summary_items(model_entity, job_type, value_type, step):
     return summary_items_entities[0]['summary_items']
 
 
+# Models created after summary items entities were given keys have summary_items_keyed set to
+# True. Their entities can be looked up by key instead of by query.
+def __make_model_summary_items_key(datastore_client, model_uuid, job_type, value_type, step):
+    return datastore_client.key(DS_KIND_MODEL_SUMMARY_ITEMS,
+        '%s_%s_%s_%d' % (model_uuid, job_type, value_type, step))
+
+
 def make_summary_item_key(step, tag):
     return str(step) + '_' + tag
 
@@ -1590,8 +1902,11 @@ def separate_summary_item_key(key):
     return int(step), tag
 
 
+# The offset is the number of bytes of the event file that have been consumed, which is always at
+# the end of a record. The crc is the hex of the last consumed record's data crc; it is used to
+# detect an event file that has been rewritten.
 def update_model_entity_for_event_file(team_uuid, model_uuid, job_type,
-        event_file_path, updated, largest_step):
+        event_file_path, updated, largest_step, offset, crc):
     datastore_client = datastore.Client()
     with datastore_client.transaction() as transaction:
         model_entity = retrieve_model_entity(team_uuid, model_uuid)
@@ -1609,6 +1924,13 @@ def update_model_entity_for_event_file(team_uuid, model_uuid, job_type,
                 model_entity['dict_event_file_path_to_updated'][event_file_path] < updated):
             model_entity['dict_event_file_path_to_updated'][event_file_path] = updated
             modified = True
+        if 'dict_event_file_path_to_offset' not in model_entity:
+            model_entity['dict_event_file_path_to_offset'] = {}
+            model_entity['dict_event_file_path_to_crc'] = {}
+        if model_entity['dict_event_file_path_to_offset'].get(event_file_path) != offset:
+            model_entity['dict_event_file_path_to_offset'][event_file_path] = offset
+            model_entity['dict_event_file_path_to_crc'][event_file_path] = crc
+            modified = True
         if modified:
             model_entity['monitor_training_active_time'] = datetime.now(timezone.utc)
             model_entity['monitor_training_active_time_ms'] = util.ms_from_datetime(model_entity['monitor_training_active_time'])
@@ -1616,7 +1938,75 @@ def update_model_entity_for_event_file(team_uuid, model_uuid, job_type,
         return model_entity, modified
 
 
-def store_model_summary_items(team_uuid, model_uuid, job_type, value_type, summary_items):
+# store_model_summary_items returns the number of summary items entities that were modified.
+def store_model_summary_items(model_entity, job_type, value_type, summary_items):
+    team_uuid = model_entity['team_uuid']
+    model_uuid = model_entity['model_uuid']
+    if not model_entity.get('summary_items_keyed', False):
+        return __store_model_summary_items_by_query(team_uuid, model_uuid, job_type, value_type, summary_items)
+
+    # Group the items by step.
+    dict_step_to_summary_items = {}
+    for key, item in summary_items.items():
+        step, _ = separate_summary_item_key(key)
+        dict_step_to_summary_items.setdefault(step, {})[key] = item
+    steps = sorted(dict_step_to_summary_items.keys())
+
+    datastore_client = datastore.Client()
+    modified_count = 0
+    # A transaction can write at most 500 entities.
+    for i in range(0, len(steps), 500):
+        chunk_steps = steps[i:i+500]
+        with datastore_client.transaction() as transaction:
+            keys = [__make_model_summary_items_key(datastore_client, model_uuid, job_type, value_type, step)
+                for step in chunk_steps]
+            dict_key_to_entity = {}
+            for summary_items_entity in datastore_client.get_multi(keys, transaction=transaction):
+                dict_key_to_entity[summary_items_entity.key] = summary_items_entity
+            for step, key in zip(chunk_steps, keys):
+                if key in dict_key_to_entity:
+                    summary_items_entity = dict_key_to_entity[key]
+                    modified = False
+                else:
+                    summary_items_entity = datastore.Entity(key=key)
+                    summary_items_entity.update({
+                        'team_uuid': team_uuid,
+                        'model_uuid': model_uuid,
+                        'job_type': job_type,
+                        'value_type': value_type,
+                        'step': step,
+                        'summary_items': {},
+                    })
+                    modified = True
+                for item_key, item in dict_step_to_summary_items[step].items():
+                    if item_key not in summary_items_entity['summary_items']:
+                        summary_items_entity['summary_items'][item_key] = item
+                        modified = True
+                if modified:
+                    # The puts are sent together when the transaction commits.
+                    transaction.put(summary_items_entity)
+                    modified_count += 1
+    if value_type == 'scalar' and modified_count > 0:
+        __increment_scalar_series_version(team_uuid, model_uuid, job_type)
+    return modified_count
+
+# The scalar series version is incremented whenever scalar summary items are stored, which makes
+# the cached scalar series for the job type stale.
+def __get_scalar_series_version_field_name(job_type):
+    return '%s_scalar_series_version' % job_type
+
+def get_scalar_series_version(model_entity, job_type):
+    return model_entity.get(__get_scalar_series_version_field_name(job_type), 0)
+
+def __increment_scalar_series_version(team_uuid, model_uuid, job_type):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        model_entity = retrieve_model_entity(team_uuid, model_uuid)
+        field_name = __get_scalar_series_version_field_name(job_type)
+        model_entity[field_name] = model_entity.get(field_name, 0) + 1
+        transaction.put(model_entity)
+
+def __store_model_summary_items_by_query(team_uuid, model_uuid, job_type, value_type, summary_items):
     datastore_client = datastore.Client()
     modified_summary_items = False
     with datastore_client.transaction() as transaction:
@@ -1660,7 +2050,9 @@ def store_model_summary_items(team_uuid, model_uuid, job_type, value_type, summa
             if dict_of_modified[dict_key]:
                 transaction.put(summary_items_entity)
                 modified_count += 1
-        return modified_count
+    if value_type == 'scalar' and modified_count > 0:
+        __increment_scalar_series_version(team_uuid, model_uuid, job_type)
+    return modified_count
 
 
 def prepare_to_start_monitor_training(team_uuid, model_uuid):
@@ -1691,6 +2083,57 @@ def monitor_training_finished(team_uuid, model_uuid):
         transaction.put(model_entity)
         return model_entity
 
+# Records the size of a TensorFlow Lite model with metadata, keyed by quantization. If step is
+# not None, the model was created from the checkpoint written at step.
+def tflite_model_created(team_uuid, model_uuid, quantization, size, step=None):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        model_entity = retrieve_model_entity(team_uuid, model_uuid)
+        if step is None:
+            if 'tflite_model_sizes' not in model_entity:
+                model_entity['tflite_model_sizes'] = {}
+            model_entity['tflite_model_sizes'][quantization] = size
+        else:
+            if 'tflite_checkpoint_exports' not in model_entity:
+                model_entity['tflite_checkpoint_exports'] = {}
+            # Datastore requires the keys of an embedded entity to be strings.
+            model_entity['tflite_checkpoint_exports'].setdefault(str(step), {})[quantization] = size
+        transaction.put(model_entity)
+        return model_entity
+
+# dict_step_to_number maps the step (as a string) that each new checkpoint was written at to the
+# checkpoint's number.
+def checkpoint_steps_found(team_uuid, model_uuid, dict_step_to_number):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        model_entity = retrieve_model_entity(team_uuid, model_uuid)
+        if 'dict_checkpoint_step_to_number' not in model_entity:
+            model_entity['dict_checkpoint_step_to_number'] = {}
+        model_entity['dict_checkpoint_step_to_number'].update(dict_step_to_number)
+        transaction.put(model_entity)
+        return model_entity
+
+def best_eval_checkpoint_found(team_uuid, model_uuid, best_step, best_value):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        model_entity = retrieve_model_entity(team_uuid, model_uuid)
+        model_entity['best_eval_step'] = best_step
+        model_entity['best_eval_value'] = best_value
+        transaction.put(model_entity)
+        return model_entity
+
+# Records the results of tflite_benchmark.benchmark for a TensorFlow Lite model, keyed by
+# quantization.
+def tflite_model_benchmarked(team_uuid, model_uuid, quantization, benchmark):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        model_entity = retrieve_model_entity(team_uuid, model_uuid)
+        if 'tflite_benchmarks' not in model_entity:
+            model_entity['tflite_benchmarks'] = {}
+        model_entity['tflite_benchmarks'][quantization] = benchmark
+        transaction.put(model_entity)
+        return model_entity
+
 def retrieve_model_list(team_uuid):
     datastore_client = datastore.Client()
     query = datastore_client.query(kind=DS_KIND_MODEL)
@@ -1851,27 +2294,49 @@ def finish_delete_model(action_parameters):
 
 # action
 
-def retrieve_action_list(team_uuid, action_name):
-    datastore_client = datastore.Client()
-    query = datastore_client.query(kind=DS_KIND_ACTION)
-    query.add_filter('team_uuid', '=', team_uuid)
-    query.add_filter('action_name', '=', action_name)
-    query.order = ['create_time']
-    action_entities = list(query.fetch())
-    return action_entities
-
-def action_on_create(team_uuid, action_name, is_admin_action, action_parameters):
+# Returns the time that the action was created, started, or stopped, whichever is latest.
+def get_action_last_active_time(action_entity):
+    time = action_entity['create_time']
+    len_start_times = len(action_entity['start_times'])
+    if len_start_times > 0:
+        len_stop_times = len(action_entity['stop_times'])
+        if len_start_times > len_stop_times:
+            time = action_entity['start_times'][len_start_times-1]
+        else:
+            time = action_entity['stop_times'][len_stop_times-1]
+    return time
+
+# Action entities, other than admin action entities, are keyed by the fingerprint of their
+# parameters, so a duplicate action is found with a single lookup. If there is already an action
+# with the same fingerprint that was active in the last 15 minutes, returns None. Otherwise, creates
+# the action entity, replacing the old one if there was one, and returns the new action_uuid.
+def action_on_create(team_uuid, action_name, is_admin_action, action_parameters, fingerprint):
     action_uuid = str(uuid.uuid4().hex)
-    ds_kind = DS_KIND_ADMIN_ACTION if is_admin_action else DS_KIND_ACTION
     datastore_client = datastore.Client()
     with datastore_client.transaction() as transaction:
-        incomplete_key = datastore_client.key(ds_kind)
-        action_entity = datastore.Entity(key=incomplete_key)
+        if is_admin_action:
+            key = datastore_client.key(DS_KIND_ADMIN_ACTION)
+        else:
+            key = datastore_client.key(DS_KIND_ACTION, fingerprint)
+            existing_action_entity = datastore_client.get(key, transaction=transaction)
+            if existing_action_entity is not None:
+                time_delta = datetime.now(timezone.utc) - get_action_last_active_time(existing_action_entity)
+                if time_delta <= timedelta(minutes=15):
+                    return None
+                # An action that is waiting in the action scheduler's queue hasn't started yet, but
+                # it is still active.
+                if (existing_action_entity['state'] == 'created' and
+                        __is_action_queued(datastore_client, transaction, existing_action_entity['action_uuid'])):
+                    return None
+                logging.warning('storage.action_on_create - %s - replacing duplicate action that is %s old' %
+                        (action_name, str(time_delta)))
+        action_entity = datastore.Entity(key=key)
         action_entity.update({
             'team_uuid': team_uuid,
             'action_name': action_name,
             'action_uuid': action_uuid,
             'action_parameters': action_parameters,
+            'parameters_fingerprint': fingerprint,
             'create_time': datetime.now(timezone.utc),
             'state': 'created',
             'start_times': [],
@@ -1921,18 +2386,351 @@ def action_on_finish(action_uuid, is_admin_action, action_parameters):
         datastore_client.put(action_entity)
     else:
         datastore_client.delete(action_entity.key)
+    # The checkpoint is no longer needed. For admin actions, the final state is in action_parameters.
+    datastore_client.delete(datastore_client.key(DS_KIND_ACTION_CHECKPOINT, action_uuid))
     return action_entity
 
 
-def action_on_remove_old_action(action_entity):
+# Deletes action entities that haven't been active for a day. These are left behind when a cloud
+# function is killed before the action finishes. Expired dataset zips are deleted here too.
+def delete_stale_actions(action_parameters):
+    checkpoint = action.get_checkpoint(action_parameters, {
+        'num_actions_deleted': 0,
+    })
     datastore_client = datastore.Client()
-    datastore_client.delete(action_entity.key)
+    cutoff_time = datetime.now(timezone.utc) - timedelta(days=1)
+    query = datastore_client.query(kind=DS_KIND_ACTION)
+    query.add_filter('create_time', '<', cutoff_time)
+    stale_keys = []
+    for action_entity in query.fetch():
+        action.retrigger_if_necessary(action_parameters)
+        if get_action_last_active_time(action_entity) < cutoff_time:
+            stale_keys.append(action_entity.key)
+            if len(stale_keys) == 500:
+                datastore_client.delete_multi(stale_keys)
+                checkpoint['num_actions_deleted'] += len(stale_keys)
+                stale_keys = []
+    if len(stale_keys) > 0:
+        datastore_client.delete_multi(stale_keys)
+        checkpoint['num_actions_deleted'] += len(stale_keys)
+    # Also delete fan out entities whose workers were all killed.
+    __delete_entities_updated_before(datastore_client, DS_KIND_FAN_OUT, cutoff_time, action_parameters)
+    # And checkpoints of actions that were killed.
+    __delete_entities_updated_before(datastore_client, DS_KIND_ACTION_CHECKPOINT, cutoff_time, action_parameters)
+    # And dataset zips that have expired.
+    delete_expired_dataset_zips(action_parameters)
+    # Start the queued actions whose places were held by actions that were killed.
+    action.dispatch_queued_actions()
+
+
+def __delete_entities_updated_before(datastore_client, kind, cutoff_time, action_parameters):
+    while True:
+        action.retrigger_if_necessary(action_parameters)
+        query = datastore_client.query(kind=kind)
+        query.add_filter('update_time', '<', cutoff_time)
+        query.keys_only()
+        stale_keys = [entity.key for entity in query.fetch(500)]
+        if len(stale_keys) == 0:
+            return
+        datastore_client.delete_multi(stale_keys)
+
+
+# action checkpoints
+
+# The checkpoint of an action is kept in its own entity, keyed by the action_uuid, which doesn't
+# change when the action is retriggered. The state is stored as JSON and isn't indexed.
+def store_action_checkpoint(action_uuid, action_name, state):
+    datastore_client = datastore.Client()
+    key = datastore_client.key(DS_KIND_ACTION_CHECKPOINT, action_uuid)
+    checkpoint_entity = datastore.Entity(key=key, exclude_from_indexes=['state_json'])
+    checkpoint_entity.update({
+        'action_uuid': action_uuid,
+        'action_name': action_name,
+        'state_json': json.dumps(state),
+        'update_time': datetime.now(timezone.utc),
+    })
+    datastore_client.put(checkpoint_entity)
+
+
+# Returns None if there is no checkpoint for the action.
+def retrieve_action_checkpoint(action_uuid):
+    datastore_client = datastore.Client()
+    checkpoint_entity = datastore_client.get(datastore_client.key(DS_KIND_ACTION_CHECKPOINT, action_uuid))
+    if checkpoint_entity is None:
+        return None
+    return json.loads(checkpoint_entity['state_json'])
+
+
+# action scheduler
+
+# The state of the action scheduler for each priority class is kept in one entity, so that it is
+# updated atomically, and the classes don't contend with each other. Each queued action is kept in a
+# queued action entity, keyed by the action_uuid, until the action is started. The entity has the
+# action's parameters, and the finish tag and sequence number that the action scheduler gave it.
+
+def __retrieve_action_scheduler_entity(datastore_client, transaction, priority):
+    key = datastore_client.key(DS_KIND_ACTION_SCHEDULER, 'priority_%d' % priority)
+    scheduler_entity = datastore_client.get(key, transaction=transaction)
+    if scheduler_entity is None:
+        scheduler_entity = datastore.Entity(key=key, exclude_from_indexes=['state_json'])
+        scheduler_entity['state_json'] = json.dumps(action_scheduler.create_state(priority))
+    return scheduler_entity
+
+
+def __store_action_scheduler_state(transaction, scheduler_entity, state):
+    scheduler_entity['state_json'] = json.dumps(state)
+    scheduler_entity['update_time'] = datetime.now(timezone.utc)
+    transaction.put(scheduler_entity)
+
+
+# __take_queued_actions returns a list of tuples of the action name and the action parameters json
+# of the actions that were started, and deletes their queued action entities.
+def __take_queued_actions(datastore_client, transaction, action_uuids):
+    if len(action_uuids) == 0:
+        return []
+    keys = [datastore_client.key(DS_KIND_QUEUED_ACTION, action_uuid) for action_uuid in action_uuids]
+    started_actions = []
+    for queued_action_entity in datastore_client.get_multi(keys, transaction=transaction):
+        started_actions.append((queued_action_entity['action_name'], queued_action_entity['action_parameters_json']))
+        transaction.delete(queued_action_entity.key)
+    return started_actions
+
+
+# __make_next_queued returns the next_queued function that action_scheduler.dispatch uses to get a
+# team's next queued action. Queries in a transaction don't see the entities that were put in the
+# same transaction, so the action that was enqueued in this transaction, if any, is given as
+# enqueued.
+def __make_next_queued(datastore_client, priority, enqueued=None):
+    def next_queued(team_uuid, after_sequence):
+        query = datastore_client.query(kind=DS_KIND_QUEUED_ACTION)
+        query.add_filter('priority', '=', priority)
+        query.add_filter('team_uuid', '=', team_uuid)
+        query.add_filter('sequence', '>', after_sequence)
+        query.order = ['sequence']
+        for queued_action_entity in query.fetch(limit=1):
+            return {
+                'action_uuid': queued_action_entity['action_uuid'],
+                'team_uuid': team_uuid,
+                'finish_tag': queued_action_entity['finish_tag'],
+                'sequence': queued_action_entity['sequence'],
+            }
+        if enqueued is not None and enqueued['team_uuid'] == team_uuid and enqueued['sequence'] > after_sequence:
+            return enqueued
+        logging.critical('storage.action_scheduler - queued action after sequence %d for team %s not found' %
+            (after_sequence, team_uuid))
+        return None
+    return next_queued
+
+
+def __is_action_queued(datastore_client, transaction, action_uuid):
+    key = datastore_client.key(DS_KIND_QUEUED_ACTION, action_uuid)
+    return datastore_client.get(key, transaction=transaction) is not None
+
+
+# Returns a list of tuples of the action name and the action parameters json of the actions that
+# can start now, which may or may not include the submitted action.
+def action_scheduler_submit(action_uuid, team_uuid, action_name, priority, action_parameters_json):
+    return __retry_on_conflict(__action_scheduler_submit,
+        action_uuid, team_uuid, action_name, priority, action_parameters_json)
+
+
+def __action_scheduler_submit(action_uuid, team_uuid, action_name, priority, action_parameters_json):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        scheduler_entity = __retrieve_action_scheduler_entity(datastore_client, transaction, priority)
+        state = json.loads(scheduler_entity['state_json'])
+        queued = action_scheduler.enqueue(state, action_uuid, team_uuid)
+        started_uuids = action_scheduler.dispatch(state, time.time(),
+            __make_next_queued(datastore_client, priority, queued))
+        started_actions = []
+        if action_uuid in started_uuids:
+            started_uuids.remove(action_uuid)
+            started_actions.append((action_name, action_parameters_json))
+        else:
+            key = datastore_client.key(DS_KIND_QUEUED_ACTION, action_uuid)
+            queued_action_entity = datastore.Entity(key=key,
+                exclude_from_indexes=['action_parameters_json', 'finish_tag'])
+            queued_action_entity.update({
+                'team_uuid': team_uuid,
+                'action_name': action_name,
+                'action_uuid': action_uuid,
+                'priority': priority,
+                'finish_tag': queued['finish_tag'],
+                'sequence': queued['sequence'],
+                'action_parameters_json': action_parameters_json,
+                'create_time': datetime.now(timezone.utc),
+            })
+            transaction.put(queued_action_entity)
+        started_actions.extend(__take_queued_actions(datastore_client, transaction, started_uuids))
+        __store_action_scheduler_state(transaction, scheduler_entity, state)
+        return started_actions
+
+
+def action_scheduler_renew(action_uuid, priority):
+    __retry_on_conflict(__action_scheduler_renew, action_uuid, priority)
+
+
+def __action_scheduler_renew(action_uuid, priority):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        scheduler_entity = __retrieve_action_scheduler_entity(datastore_client, transaction, priority)
+        state = json.loads(scheduler_entity['state_json'])
+        if not action_scheduler.renew(state, action_uuid, time.time()):
+            logging.warning('storage.action_scheduler_renew - action %s is not running' % action_uuid)
+            return
+        __store_action_scheduler_state(transaction, scheduler_entity, state)
+
+
+# Returns a list of tuples of the action name and the action parameters json of the queued actions
+# that can start now that the given action has finished.
+def action_scheduler_finish(action_uuid, priority):
+    return __retry_on_conflict(__action_scheduler_finish, action_uuid, priority)
+
+
+def __action_scheduler_finish(action_uuid, priority):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        scheduler_entity = __retrieve_action_scheduler_entity(datastore_client, transaction, priority)
+        state = json.loads(scheduler_entity['state_json'])
+        started_uuids = action_scheduler.finish(state, action_uuid, time.time(),
+            __make_next_queued(datastore_client, priority))
+        started_actions = __take_queued_actions(datastore_client, transaction, started_uuids)
+        __store_action_scheduler_state(transaction, scheduler_entity, state)
+        return started_actions
+
+
+# Returns a list of tuples of the action name and the action parameters json of the queued actions
+# that can start because the leases of running actions that were killed have expired. Without this,
+# a class whose running actions were all killed would only be dispatched again when another action
+# of the class is submitted.
+def action_scheduler_dispatch(priority):
+    return __retry_on_conflict(__action_scheduler_dispatch, priority)
+
+
+def __action_scheduler_dispatch(priority):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        scheduler_entity = __retrieve_action_scheduler_entity(datastore_client, transaction, priority)
+        state = json.loads(scheduler_entity['state_json'])
+        started_uuids = action_scheduler.dispatch(state, time.time(),
+            __make_next_queued(datastore_client, priority))
+        started_actions = __take_queued_actions(datastore_client, transaction, started_uuids)
+        __store_action_scheduler_state(transaction, scheduler_entity, state)
+        return started_actions
+
+
+# fan out
+
+# A fan out entity is the manifest of the work items for the workers started by
+# action.trigger_fan_out. The state, lease expiration, and number of attempts of each item are kept
+# in lists in the same entity, so an item can be claimed atomically with one transaction.
+def fan_out_on_create(team_uuid, action_name, work_items):
+    fan_out_uuid = str(uuid.uuid4().hex)
+    datastore_client = datastore.Client()
+    key = datastore_client.key(DS_KIND_FAN_OUT, fan_out_uuid)
+    fan_out_entity = datastore.Entity(key=key, exclude_from_indexes=[
+        'work_items_json', 'item_states', 'lease_expirations', 'attempts'])
+    fan_out_entity.update({
+        'team_uuid': team_uuid,
+        'action_name': action_name,
+        'fan_out_uuid': fan_out_uuid,
+        'work_items_json': json.dumps(work_items),
+        'item_count': len(work_items),
+        'item_states': ['pending' for i in range(len(work_items))],
+        'lease_expirations': [None for i in range(len(work_items))],
+        'attempts': [0 for i in range(len(work_items))],
+        'watcher_index': None,
+        'watcher_expiration': None,
+        'create_time': datetime.now(timezone.utc),
+        'update_time': datetime.now(timezone.utc),
+    })
+    datastore_client.put(fan_out_entity)
+    return fan_out_uuid
+
+# Returns a tuple of the index of the claimed work item, the work item, and whether the worker
+# should wait and try again. If no item can be claimed because the remaining items are leased by
+# other workers, one worker is chosen to watch for expired leases and the others can finish.
+def fan_out_claim_work_item(fan_out_uuid, worker_index, lease_seconds, max_attempts):
+    return __retry_on_conflict(__fan_out_claim_work_item, fan_out_uuid, worker_index, lease_seconds, max_attempts)
+
+
+def __fan_out_claim_work_item(fan_out_uuid, worker_index, lease_seconds, max_attempts):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        key = datastore_client.key(DS_KIND_FAN_OUT, fan_out_uuid)
+        fan_out_entity = datastore_client.get(key, transaction=transaction)
+        if fan_out_entity is None:
+            return None, None, False
+        now = datetime.now(timezone.utc)
+        item_states = fan_out_entity['item_states']
+        lease_expirations = fan_out_entity['lease_expirations']
+        attempts = fan_out_entity['attempts']
+        changed = False
+        claimed_index = None
+        for i in range(len(item_states)):
+            if item_states[i] == 'leased' and lease_expirations[i] < now:
+                if attempts[i] >= max_attempts:
+                    logging.critical('storage.fan_out_claim_work_item - %s - work item %d failed after %d attempts' %
+                        (fan_out_entity['action_name'], i, attempts[i]))
+                    item_states[i] = 'failed'
+                    changed = True
+                    continue
+                item_states[i] = 'pending'
+            if item_states[i] == 'pending':
+                claimed_index = i
+                break
+        if claimed_index is not None:
+            item_states[claimed_index] = 'leased'
+            lease_expirations[claimed_index] = now + timedelta(seconds=lease_seconds)
+            attempts[claimed_index] += 1
+            fan_out_entity['update_time'] = now
+            transaction.put(fan_out_entity)
+            work_items = json.loads(fan_out_entity['work_items_json'])
+            return claimed_index, work_items[claimed_index], False
+        if 'leased' not in item_states:
+            transaction.delete(key)
+            return None, None, False
+        should_watch = (fan_out_entity['watcher_index'] == worker_index or
+            fan_out_entity['watcher_expiration'] is None or
+            fan_out_entity['watcher_expiration'] < now)
+        if should_watch:
+            fan_out_entity['watcher_index'] = worker_index
+            fan_out_entity['watcher_expiration'] = now + timedelta(seconds=lease_seconds)
+            changed = True
+        if changed:
+            fan_out_entity['update_time'] = now
+            transaction.put(fan_out_entity)
+        return None, None, should_watch
+
+def fan_out_work_item_finished(fan_out_uuid, item_index, failed):
+    __retry_on_conflict(__fan_out_work_item_finished, fan_out_uuid, item_index, failed)
+
+
+def __fan_out_work_item_finished(fan_out_uuid, item_index, failed):
+    datastore_client = datastore.Client()
+    with datastore_client.transaction() as transaction:
+        key = datastore_client.key(DS_KIND_FAN_OUT, fan_out_uuid)
+        fan_out_entity = datastore_client.get(key, transaction=transaction)
+        if fan_out_entity is None:
+            return
+        item_states = fan_out_entity['item_states']
+        item_states[item_index] = 'failed' if failed else 'done'
+        if 'pending' not in item_states and 'leased' not in item_states:
+            transaction.delete(key)
+        else:
+            fan_out_entity['update_time'] = datetime.now(timezone.utc)
+            transaction.put(fan_out_entity)
 
 
 # admin functions
 
 def reset_remaining_training_minutes(action_parameters):
     reset_minutes = action_parameters['reset_minutes']
+    checkpoint = action.get_checkpoint(action_parameters, {
+        'num_teams_updated': 0,
+        'teams_updated': [],
+        'failure_counts': {},
+    })
     datastore_client = datastore.Client()
     loop = True
     while loop:
@@ -1943,28 +2741,33 @@ def reset_remaining_training_minutes(action_parameters):
         for team_entity in query.fetch():
             action.retrigger_if_necessary(action_parameters)
             team_key = '%s %s' % (team_entity['program'], str(team_entity['team_number']))
-            if team_key not in action_parameters['teams_updated']:
+            if team_key not in checkpoint['teams_updated']:
                 team_entity['remaining_training_minutes'] = reset_minutes
                 try:
                     datastore_client.put(team_entity)
                 except:
                     logging.critical('reset_remaining_training_minutes - exception!!! team_key: %s traceback: %s' %
                         (team_key, traceback.format_exc().replace('\n', ' ... ')))
-                    if team_key not in action_parameters['failure_counts']:
-                        action_parameters['failure_counts'][team_key] = 1
+                    if team_key not in checkpoint['failure_counts']:
+                        checkpoint['failure_counts'][team_key] = 1
                         loop = True # repeat the outer while loop
                     else:
-                        action_parameters['failure_counts'][team_key] += 1
+                        checkpoint['failure_counts'][team_key] += 1
                         # We've failed to update this team twice, don't repeat the outer while loop
                         # just for this team.
                     continue
-                action_parameters['teams_updated'].append(team_key)
-                action_parameters['num_teams_updated'] += 1
-                action_parameters['failure_counts'].pop(team_key, None)
+                checkpoint['teams_updated'].append(team_key)
+                checkpoint['num_teams_updated'] += 1
+                checkpoint['failure_counts'].pop(team_key, None)
 
 
 def increment_remaining_training_minutes(action_parameters):
     increment_minutes = action_parameters['increment_minutes']
+    checkpoint = action.get_checkpoint(action_parameters, {
+        'num_teams_updated': 0,
+        'teams_updated': [],
+        'failure_counts': {},
+    })
     datastore_client = datastore.Client()
     loop = True
     while loop:
@@ -1975,27 +2778,33 @@ def increment_remaining_training_minutes(action_parameters):
         for team_entity in query.fetch():
             action.retrigger_if_necessary(action_parameters)
             team_key = '%s %s' % (team_entity['program'], str(team_entity['team_number']))
-            if team_key not in action_parameters['teams_updated']:
+            if team_key not in checkpoint['teams_updated']:
                 team_entity['remaining_training_minutes'] += increment_minutes
                 try:
                     datastore_client.put(team_entity)
                 except:
                     logging.critical('increment_remaining_training_minutes - exception!!! team_key: %s traceback: %s' %
                         (team_key, traceback.format_exc().replace('\n', ' ... ')))
-                    if team_key not in action_parameters['failure_counts']:
-                        action_parameters['failure_counts'][team_key] = 1
+                    if team_key not in checkpoint['failure_counts']:
+                        checkpoint['failure_counts'][team_key] = 1
                         loop = True # repeat the outer while loop
                     else:
-                        action_parameters['failure_counts'][team_key] += 1
+                        checkpoint['failure_counts'][team_key] += 1
                         # We've failed to update this team twice, don't repeat the outer while loop
                         # just for this team.
                     continue
-                action_parameters['teams_updated'].append(team_key)
-                action_parameters['num_teams_updated'] += 1
-                action_parameters['failure_counts'].pop(team_key, None)
+                checkpoint['teams_updated'].append(team_key)
+                checkpoint['num_teams_updated'] += 1
+                checkpoint['failure_counts'].pop(team_key, None)
 
 def save_end_of_season_entities(action_parameters):
     season = action_parameters['season']
+    checkpoint = action.get_checkpoint(action_parameters, {
+        'num_models': 0,
+        'num_teams_processed': 0,
+        'teams_processed': [],
+        'failure_counts': {},
+    })
     datastore_client = datastore.Client()
     loop = True
     while loop:
@@ -2006,25 +2815,25 @@ def save_end_of_season_entities(action_parameters):
         for team_entity in query.fetch():
             action.retrigger_if_necessary(action_parameters)
             team_key = '%s %s' % (team_entity['program'], str(team_entity['team_number']))
-            if team_key not in action_parameters['teams_processed']:
+            if team_key not in checkpoint['teams_processed']:
                 num_models = 0
                 try:
                     num_models = __save_end_of_season_entity(season, team_entity)
                 except:
                     logging.critical('save_end_of_season_entities - exception!!! team_key: %s traceback: %s' %
                         (team_key, traceback.format_exc().replace('\n', ' ... ')))
-                    if team_key not in action_parameters['failure_counts']:
-                        action_parameters['failure_counts'][team_key] = 1
+                    if team_key not in checkpoint['failure_counts']:
+                        checkpoint['failure_counts'][team_key] = 1
                         loop = True # repeat the outer while loop
                     else:
-                        action_parameters['failure_counts'][team_key] += 1
+                        checkpoint['failure_counts'][team_key] += 1
                         # We've failed to update this team twice, don't repeat the outer while loop
                         # just for this team.
                     continue
-                action_parameters['num_models'] += num_models
-                action_parameters['teams_processed'].append(team_key)
-                action_parameters['num_teams_processed'] += 1
-                action_parameters['failure_counts'].pop(team_key, None)
+                checkpoint['num_models'] += num_models
+                checkpoint['teams_processed'].append(team_key)
+                checkpoint['num_teams_processed'] += 1
+                checkpoint['failure_counts'].pop(team_key, None)
 
 
 def __save_end_of_season_entity(season, team_entity):
@@ -2063,6 +2872,11 @@ def __save_end_of_season_entity(season, team_entity):
 
 def reset_team_entities(action_parameters):
     logging.info('reset_team_entities')
+    checkpoint = action.get_checkpoint(action_parameters, {
+        'num_teams_updated': 0,
+        'teams_updated': [],
+        'failure_counts': {},
+    })
     datastore_client = datastore.Client()
     loop = True
     while loop:
@@ -2073,7 +2887,7 @@ def reset_team_entities(action_parameters):
         for team_entity in query.fetch():
             action.retrigger_if_necessary(action_parameters)
             team_key = '%s %s' % (team_entity['program'], str(team_entity['team_number']))
-            if team_key not in action_parameters['teams_updated']:
+            if team_key not in checkpoint['teams_updated']:
                 team_entity.update({
                     'remaining_training_minutes': constants.TOTAL_TRAINING_MINUTES_PER_TEAM,
                     'preferences': {},
@@ -2091,15 +2905,15 @@ def reset_team_entities(action_parameters):
                 except:
                     logging.critical('reset_team_entities - exception!!! team_key: %s traceback: %s' %
                         (team_key, traceback.format_exc().replace('\n', ' ... ')))
-                    if team_key not in action_parameters['failure_counts']:
-                        action_parameters['failure_counts'][team_key] = 1
+                    if team_key not in checkpoint['failure_counts']:
+                        checkpoint['failure_counts'][team_key] = 1
                         loop = True # repeat the outer while loop
                     else:
-                        action_parameters['failure_counts'][team_key] += 1
+                        checkpoint['failure_counts'][team_key] += 1
                         # We've failed to update this team twice, don't repeat the outer while loop
                         # just for this team.
                     continue
-                action_parameters['teams_updated'].append(team_key)
-                action_parameters['num_teams_updated'] += 1
-                action_parameters['failure_counts'].pop(team_key, None)
+                checkpoint['teams_updated'].append(team_key)
+                checkpoint['num_teams_updated'] += 1
+                checkpoint['failure_counts'].pop(team_key, None)
     logging.info('reset_team_entities - all done!')
@@ -14,14 +14,56 @@
 
 __author__ = "lizlooney@google.com (Liz Looney)"
 
+# Python Standard Library
+import logging
+
 # My Modules
 import action
+import blob_storage
+import exceptions
+
+
+# QUANTIZATION_DYNAMIC is dynamic range quantization, where the weights are int8 and the
+# activations are float. QUANTIZATION_INT8 is full integer quantization, where the activations are
+# also int8.
+QUANTIZATION_DYNAMIC = 'dynamic'
+QUANTIZATION_INT8 = 'int8'
+
+
+def validate_quantization(s):
+    if s != QUANTIZATION_DYNAMIC and s != QUANTIZATION_INT8:
+        message = "Error: '%s' is not a valid argument." % s
+        logging.critical(message)
+        raise exceptions.HttpErrorBadRequest(message)
+    return s
+
+
+# The training job writes a checkpoint about every checkpoint_every_n steps, and the eval job
+# evaluates them. monitor_training records the step that each checkpoint was written at in
+# dict_checkpoint_step_to_number. Returns the path of the checkpoint written at step, or '' if there
+# isn't one or the training job has already deleted it. The training job only keeps the last few
+# checkpoints, deleting the oldest first.
+def get_checkpoint_path_for_step(model_entity, step):
+    checkpoint_number = model_entity.get('dict_checkpoint_step_to_number', {}).get(str(step))
+    if checkpoint_number is None:
+        return ''
+    return blob_storage.get_checkpoint_path_for_number(model_entity['model_folder'], checkpoint_number)
 
 
-def trigger_create_tflite(team_uuid, model_uuid):
+# If step is None, the model is created from the trained checkpoint. Otherwise, it is created from
+# the checkpoint written at step, while training is in progress or after.
+# If next_quantization is given, the action for it is triggered when this one is done, so that the
+# second action finds the exported SavedModel in the cache instead of exporting it at the same time.
+def trigger_create_tflite(team_uuid, model_uuid, quantization=QUANTIZATION_DYNAMIC, step=None,
+        next_quantization=None):
     action_parameters = action.create_action_parameters(
         team_uuid, action.ACTION_NAME_CREATE_TFLITE)
     action_parameters['team_uuid'] = team_uuid
     action_parameters['model_uuid'] = model_uuid
+    action_parameters['quantization'] = quantization
+    if step is not None:
+        action_parameters['step'] = step
+    if next_quantization is not None:
+        action_parameters['next_quantization'] = next_quantization
     action.trigger_action_via_blob(action_parameters)
 
@@ -22,9 +22,15 @@ import logging
 
 # My Modules
 import action
+import exceptions
 import storage
 
 
+# How long /waitForTrackedBboxes waits for the tracker before returning to the client. The
+# storage.retrieve_tracked_bboxes loop stops 5 seconds before this limit.
+LONG_POLL_SECONDS = 25
+
+
 # These values should match the keys in tracker_fns in server/cf_tracking.py.
 tracker_fns = [
     'CSRT',
@@ -55,3 +61,12 @@ def prepare_to_start_tracking(team_uuid, video_uuid, tracker_name, scale, init_f
     action_parameters['tracker_uuid'] = tracker_uuid
     action.trigger_action_via_blob(action_parameters)
     return tracker_uuid
+
+
+def wait_for_tracked_bboxes(team_uuid, video_uuid, tracker_uuid, retrieve_frame_number, time_limit,
+        frame_number, bboxes_text):
+    if frame_number is not None:
+        # storage.continue_tracking does nothing
+        # if the video_uuid/tracker_uuid is not found.
+        storage.continue_tracking(team_uuid, video_uuid, tracker_uuid, frame_number, bboxes_text)
+    return storage.retrieve_tracked_bboxes(video_uuid, tracker_uuid, retrieve_frame_number, time_limit)
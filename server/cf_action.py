@@ -15,8 +15,10 @@
 __author__ = "lizlooney@google.com (Liz Looney)"
 
 # Python Standard Library
+import importlib
 import json
 import logging
+import time
 import traceback
 
 # My Modules
@@ -24,12 +26,35 @@ from app_engine import action
 from app_engine import blob_storage
 from app_engine import storage
 from app_engine import util
-import cf_dataset_producer
-import cf_dataset_zipper
-import cf_frame_extractor
-import cf_model_trainer
-import cf_tflite_creator
-import cf_tracking
+
+# The function that performs each action, as a module path and a function name. A module is only
+# imported the first time one of its actions is performed, so that a simple action, like
+# delete_video, doesn't have to wait for TensorFlow or OpenCV to be imported.
+ACTION_FN_PATHS = {
+    action.ACTION_NAME_TEST: 'app_engine.action.test', # For debugging purposes only
+    action.ACTION_NAME_WAIT_FOR_VIDEO_UPLOAD: 'cf_video_upload.wait_for_video_upload',
+    action.ACTION_NAME_FRAME_EXTRACTION: 'cf_frame_extractor.extract_frames',
+    action.ACTION_NAME_TRACKING: 'cf_tracking.start_tracking',
+    action.ACTION_NAME_DATASET_PRODUCE: 'cf_dataset_producer.produce_dataset',
+    action.ACTION_NAME_DATASET_PRODUCE_RECORD: 'cf_dataset_producer.produce_dataset_records',
+    action.ACTION_NAME_DELETE_DATASET_RECORD_WRITERS: 'app_engine.storage.finish_delete_dataset_record_writers',
+    action.ACTION_NAME_DATASET_ZIP: 'cf_dataset_zipper.zip_dataset',
+    action.ACTION_NAME_DATASET_ZIP_PARTITION: 'cf_dataset_zipper.zip_dataset_partitions',
+    action.ACTION_NAME_MONITOR_TRAINING: 'cf_model_trainer.monitor_training',
+    action.ACTION_NAME_CREATE_TFLITE: 'cf_tflite_creator.create_tflite',
+    action.ACTION_NAME_PRELABEL_VIDEO: 'cf_prelabeler.prelabel_video',
+    action.ACTION_NAME_DELETE_MODEL: 'app_engine.storage.finish_delete_model',
+    action.ACTION_NAME_DELETE_DATASET: 'app_engine.storage.finish_delete_dataset',
+    action.ACTION_NAME_DELETE_VIDEO: 'app_engine.storage.finish_delete_video',
+    action.ACTION_NAME_RESET_REMAINING_TRAINING_MINUTES: 'app_engine.storage.reset_remaining_training_minutes',
+    action.ACTION_NAME_INCREMENT_REMAINING_TRAINING_MINUTES: 'app_engine.storage.increment_remaining_training_minutes',
+    action.ACTION_NAME_SAVE_END_OF_SEASON_ENTITIES: 'app_engine.storage.save_end_of_season_entities',
+    action.ACTION_NAME_RESET_TEAM_ENTITIES: 'app_engine.storage.reset_team_entities',
+    action.ACTION_NAME_DELETE_STALE_ACTIONS: 'app_engine.storage.delete_stale_actions',
+}
+
+# The functions that have already been looked up, keyed by action name.
+__action_fns = {}
 
 def perform_action_from_blob(action_parameters_blob_name, time_limit):
     blob = util.storage_client().get_bucket(action.BUCKET_ACTION_PARAMETERS).blob(action_parameters_blob_name)
@@ -38,35 +63,27 @@ def perform_action_from_blob(action_parameters_blob_name, time_limit):
         action_parameters_json = blob.download_as_string()
         blob.delete()
         action_parameters = json.loads(action_parameters_json)
-        __perform_action(action_parameters, time_limit)
+        perform_action(action_parameters, time_limit)
 
 
-def __perform_action(action_parameters, time_limit):
+def perform_action(action_parameters, time_limit):
     action_parameters[action.ACTION_TIME_LIMIT] = time_limit
-    logging.info('action.__perform_action - %s - start' % action_parameters[action.ACTION_NAME])
-    storage.action_on_start(action_parameters[action.ACTION_UUID], action_parameters[action.ACTION_IS_ADMIN_ACTION])
+    logging.info('action.perform_action - %s - start' % action_parameters[action.ACTION_NAME])
+    try:
+        storage.action_on_start(action_parameters[action.ACTION_UUID], action_parameters[action.ACTION_IS_ADMIN_ACTION])
+    except Exception:
+        # The action entity was replaced or deleted. Give up the action's place in the scheduler.
+        logging.critical('action.perform_action - %s action_on_start exception!!! traceback: %s' %
+            (action_parameters[action.ACTION_NAME], traceback.format_exc().replace('\n', ' ... ')))
+        action.on_finish(action_parameters)
+        return
 
-    action_fns = {
-        action.ACTION_NAME_TEST: action.test, # For debugging purposes only
-        action.ACTION_NAME_WAIT_FOR_VIDEO_UPLOAD: cf_frame_extractor.wait_for_video_upload,
-        action.ACTION_NAME_FRAME_EXTRACTION: cf_frame_extractor.extract_frames,
-        action.ACTION_NAME_TRACKING: cf_tracking.start_tracking,
-        action.ACTION_NAME_DATASET_PRODUCE: cf_dataset_producer.produce_dataset,
-        action.ACTION_NAME_DATASET_PRODUCE_RECORD: cf_dataset_producer.produce_dataset_record,
-        action.ACTION_NAME_DELETE_DATASET_RECORD_WRITERS: storage.finish_delete_dataset_record_writers,
-        action.ACTION_NAME_DATASET_ZIP: cf_dataset_zipper.zip_dataset,
-        action.ACTION_NAME_DATASET_ZIP_PARTITION: cf_dataset_zipper.zip_dataset_partition,
-        action.ACTION_NAME_MONITOR_TRAINING: cf_model_trainer.monitor_training,
-        action.ACTION_NAME_CREATE_TFLITE: cf_tflite_creator.create_tflite,
-        action.ACTION_NAME_DELETE_MODEL: storage.finish_delete_model,
-        action.ACTION_NAME_DELETE_DATASET: storage.finish_delete_dataset,
-        action.ACTION_NAME_DELETE_VIDEO: storage.finish_delete_video,
-        action.ACTION_NAME_RESET_REMAINING_TRAINING_MINUTES: storage.reset_remaining_training_minutes,
-        action.ACTION_NAME_INCREMENT_REMAINING_TRAINING_MINUTES: storage.increment_remaining_training_minutes,
-        action.ACTION_NAME_SAVE_END_OF_SEASON_ENTITIES: storage.save_end_of_season_entities,
-        action.ACTION_NAME_RESET_TEAM_ENTITIES: storage.reset_team_entities,
-    }
-    action_fn = action_fns.get(action_parameters[action.ACTION_NAME], None)
+    try:
+        action_fn = get_action_fn(action_parameters[action.ACTION_NAME])
+    except Exception:
+        logging.critical('action.perform_action - %s import exception!!! traceback: %s' %
+            (action_parameters[action.ACTION_NAME], traceback.format_exc().replace('\n', ' ... ')))
+        action_fn = None
     if action_fn is not None:
         try:
             action_fn(action_parameters)
@@ -74,11 +91,30 @@ def __perform_action(action_parameters, time_limit):
             pass
         except Exception as e:
             if e.__class__.__name__ != 'Stop':
-                logging.critical('action.__perform_action - %s exception!!! action_parameters: %s traceback: %s' %
+                logging.critical('action.perform_action - %s exception!!! action_parameters: %s traceback: %s' %
                     (action_parameters[action.ACTION_NAME], str(action_parameters), traceback.format_exc().replace('\n', ' ... ')))
     else:
-        logging.warning('action.__perform_action - %s - action_fn is None' % action_parameters[action.ACTION_NAME])
+        logging.warning('action.perform_action - %s - action_fn is None' % action_parameters[action.ACTION_NAME])
 
     if action.ACTION_RETRIGGERED not in action_parameters:
-        logging.info('action.__perform_action - %s - finish' % action_parameters[action.ACTION_NAME])
+        logging.info('action.perform_action - %s - finish' % action_parameters[action.ACTION_NAME])
         storage.action_on_finish(action_parameters[action.ACTION_UUID], action_parameters[action.ACTION_IS_ADMIN_ACTION], action_parameters)
+        action.on_finish(action_parameters)
+
+
+# get_action_fn returns the function that performs the given action, importing its module if
+# necessary, or None if there is no such action. The time taken to import the module is logged.
+def get_action_fn(action_name):
+    if action_name in __action_fns:
+        return __action_fns[action_name]
+    action_fn_path = ACTION_FN_PATHS.get(action_name, None)
+    if action_fn_path is None:
+        return None
+    module_name, fn_name = action_fn_path.rsplit('.', 1)
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    logging.info('action.get_action_fn - %s - importing %s took %.3f seconds' %
+        (action_name, module_name, time.perf_counter() - start))
+    action_fn = getattr(module, fn_name)
+    __action_fns[action_name] = action_fn
+    return action_fn
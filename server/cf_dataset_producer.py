@@ -38,6 +38,7 @@ from app_engine import action
 from app_engine import bbox_writer
 from app_engine import blob_storage
 from app_engine import exceptions
+from app_engine import frame_sampler
 from app_engine import storage
 
 # NamedTuple for split
@@ -49,6 +50,11 @@ Split = collections.namedtuple('Split', [
 FrameData = collections.namedtuple('FrameData', [
     'video_filename', 'frame_number', 'filename', 'image', 'format', 'bboxes_text'])
 
+# The records are written by at most RECORD_WORKER_COUNT actions. A worker doesn't start another
+# record if it has less than MIN_SECONDS_PER_RECORD left.
+RECORD_WORKER_COUNT = 16
+MIN_SECONDS_PER_RECORD = 120
+
 
 def produce_dataset(action_parameters):
     team_uuid = action_parameters['team_uuid']
@@ -60,6 +66,7 @@ def produce_dataset(action_parameters):
         video_uuid_list = action_parameters['video_uuid_list']
     eval_percent = action_parameters['eval_percent']
     create_time_ms = action_parameters['create_time_ms']
+    max_frame_count = action_parameters.get('max_frame_count', 0)
 
     if len(video_uuid_list) == 0:
         message = "Error: No videos to process."
@@ -79,13 +86,26 @@ def produce_dataset(action_parameters):
     eval_record_count = 0
     label_set = set()
 
+    # Read the video_frame entities from storage. They contain the labels.
+    dict_video_uuid_to_video_frame_entities = {}
     for video_entity in video_entities:
         video_uuid = video_entity['video_uuid']
-        # Read the video_frame entities from storage. They contain the labels.
-        video_frame_entities = storage.retrieve_video_frame_entities(
+        dict_video_uuid_to_video_frame_entities[video_uuid] = storage.retrieve_video_frame_entities(
              team_uuid, video_uuid, 0, video_entity['frame_count'] - 1)
+
+    if max_frame_count > 0:
+        # Choose a diverse subset of the included frames.
+        dict_video_uuid_to_selected_frame_numbers = __sample_frames(team_uuid, dataset_uuid,
+            video_entities, dict_video_uuid_to_video_frame_entities, max_frame_count)
+    else:
+        dict_video_uuid_to_selected_frame_numbers = {}
+
+    for video_entity in video_entities:
+        video_uuid = video_entity['video_uuid']
+        video_frame_entities = dict_video_uuid_to_video_frame_entities[video_uuid]
         # Determine which frames will be used for training and which frames will be used for eval.
-        split = __split_for_records(video_frame_entities, eval_percent)
+        split = __split_for_records(video_frame_entities, eval_percent,
+            selected_frame_numbers=dict_video_uuid_to_selected_frame_numbers.get(video_uuid))
         dict_video_uuid_to_split[video_uuid] = split
         train_frame_count += split.train_frame_count
         train_record_count += len(split.train_frame_number_lists)
@@ -107,49 +127,91 @@ def produce_dataset(action_parameters):
     record_number = 0
     train_record_number = 0
     eval_record_number = 0
+    work_items = []
 
-    action_parameters = action.create_action_parameters(
-        team_uuid, action.ACTION_NAME_DATASET_PRODUCE_RECORD)
-    action_parameters['team_uuid'] = team_uuid
-    action_parameters['dataset_uuid'] = dataset_uuid
-    action_parameters['sorted_label_list'] = sorted_label_list
-
-    # Trigger actions for the train records
+    # Make work items for the train records
     for video_entity in video_entities:
         video_uuid = video_entity['video_uuid']
         split = dict_video_uuid_to_split[video_uuid]
-        action_parameters['video_uuid'] = video_uuid
         for i, train_frame_number_list in enumerate(split.train_frame_number_lists):
-            action_parameters['frame_number_list'] = train_frame_number_list
-            action_parameters['record_number'] = record_number
-            action_parameters['record_id'] = train_record_id_format % (train_record_number, train_record_count)
-            action_parameters['is_eval'] = False
-            action.trigger_action_via_blob(action_parameters)
+            work_items.append({
+                'video_uuid': video_uuid,
+                'frame_number_list': train_frame_number_list,
+                'record_number': record_number,
+                'record_id': train_record_id_format % (train_record_number, train_record_count),
+                'is_eval': False,
+            })
             train_record_number += 1
             record_number += 1
 
-    # Trigger actions for the eval records
+    # Make work items for the eval records
     for video_entity in video_entities:
         video_uuid = video_entity['video_uuid']
         split = dict_video_uuid_to_split[video_uuid]
-        action_parameters['video_uuid'] = video_uuid
         for i, eval_frame_number_list in enumerate(split.eval_frame_number_lists):
-            action_parameters['frame_number_list'] = eval_frame_number_list
-            action_parameters['record_number'] = record_number
-            action_parameters['record_id'] = eval_record_id_format % (eval_record_number, eval_record_count)
-            action_parameters['is_eval'] = True
-            action.trigger_action_via_blob(action_parameters)
+            work_items.append({
+                'video_uuid': video_uuid,
+                'frame_number_list': eval_frame_number_list,
+                'record_number': record_number,
+                'record_id': eval_record_id_format % (eval_record_number, eval_record_count),
+                'is_eval': True,
+            })
             eval_record_number += 1
             record_number += 1
 
+    # Trigger the actions that write the records
+    action_parameters = action.create_action_parameters(
+        team_uuid, action.ACTION_NAME_DATASET_PRODUCE_RECORD)
+    action_parameters['team_uuid'] = team_uuid
+    action_parameters['dataset_uuid'] = dataset_uuid
+    action_parameters['sorted_label_list'] = sorted_label_list
+    action.trigger_fan_out(action_parameters, work_items, RECORD_WORKER_COUNT)
+
 
-def __split_for_records(video_frame_entities, eval_percent, max_frames_per_record=50):
+def __sample_frames(team_uuid, dataset_uuid, video_entities, dict_video_uuid_to_video_frame_entities,
+        max_frame_count):
+    # Sort the candidates so that the selection is the same no matter what order the videos
+    # were retrieved in.
+    candidates = []
+    for video_entity in sorted(video_entities, key=lambda v: v['video_uuid']):
+        video_uuid = video_entity['video_uuid']
+        for frame_number, video_frame_entity in enumerate(dict_video_uuid_to_video_frame_entities[video_uuid]):
+            if video_frame_entity['include_frame_in_dataset']:
+                candidates.append(frame_sampler.Candidate(video_uuid, frame_number,
+                    video_frame_entity['bboxes_text'] or '', video_frame_entity.get('dhash'),
+                    video_entity['width'], video_entity['height']))
+    selected_indices = frame_sampler.select_frames(candidates, max_frame_count)
+
+    dict_video_uuid_to_selected_frame_numbers = {v['video_uuid']: set() for v in video_entities}
+    for i in selected_indices:
+        dict_video_uuid_to_selected_frame_numbers[candidates[i].video_uuid].add(candidates[i].frame_number)
+    dict_video_uuid_to_dropped_frame_numbers = {v['video_uuid']: [] for v in video_entities}
+    for candidate in candidates:
+        if candidate.frame_number not in dict_video_uuid_to_selected_frame_numbers[candidate.video_uuid]:
+            dict_video_uuid_to_dropped_frame_numbers[candidate.video_uuid].append(candidate.frame_number)
+
+    # Report which frames were dropped.
+    sampling_report = {
+        'max_frame_count': max_frame_count,
+        'candidate_frame_count': len(candidates),
+        'selected_frame_count': len(selected_indices),
+        'dropped_frame_count': len(candidates) - len(selected_indices),
+        'dropped_frame_numbers': dict_video_uuid_to_dropped_frame_numbers,
+    }
+    storage.dataset_producer_sampled_frames(team_uuid, dataset_uuid, sampling_report)
+    return dict_video_uuid_to_selected_frame_numbers
+
+
+def __split_for_records(video_frame_entities, eval_percent, max_frames_per_record=50,
+        selected_frame_numbers=None):
     # Make sure the shuffle order is the same.
     random.seed(42)
 
     included_frame_numbers = []
     label_set = set()
     for frame_number, video_frame_entity in enumerate(video_frame_entities):
+        if selected_frame_numbers is not None and frame_number not in selected_frame_numbers:
+            continue
         if video_frame_entity['include_frame_in_dataset']:
             included_frame_numbers.append(frame_number)
             bboxes_text = video_frame_entities[frame_number]['bboxes_text']
@@ -197,7 +259,11 @@ def __split_for_records(video_frame_entities, eval_percent, max_frames_per_recor
         eval_frame_count, eval_frame_number_lists, label_set)
 
 
-def produce_dataset_record(action_parameters):
+def produce_dataset_records(action_parameters):
+    action.perform_fan_out_work(action_parameters, __produce_dataset_record, MIN_SECONDS_PER_RECORD)
+
+
+def __produce_dataset_record(action_parameters):
     team_uuid = action_parameters['team_uuid']
     dataset_uuid = action_parameters['dataset_uuid']
     video_uuid = action_parameters['video_uuid']
@@ -15,9 +15,12 @@
 __author__ = "lizlooney@google.com (Liz Looney)"
 
 # Python Standard Library
-import io
+import concurrent.futures
 import os
+import queue
+import time
 import zipfile
+import zlib
 
 # My Modules
 from app_engine import action
@@ -25,45 +28,121 @@ from app_engine import blob_storage
 from app_engine import storage
 
 
+# Blobs are downloaded by a small pool of threads while earlier entries are being written. Each
+# blob holds at most PREFETCH_CHUNKS chunks in memory before its thread waits for the writer.
+PREFETCH_THREADS = 3
+PREFETCH_CHUNKS = 2
+
+# An entry is stored without compression if deflating its first chunk doesn't save at least this
+# fraction of the bytes. The TFRecords hold PNG images, which are already compressed.
+MIN_COMPRESSION_SAVINGS = 0.05
+
+# The partitions are zipped by at most PARTITION_WORKER_COUNT actions. A worker doesn't start another
+# partition if it has less than MIN_SECONDS_PER_PARTITION left.
+PARTITION_WORKER_COUNT = 8
+MIN_SECONDS_PER_PARTITION = 300
+
+
 def zip_dataset(action_parameters):
     team_uuid = action_parameters['team_uuid']
     dataset_zip_uuid = action_parameters['dataset_zip_uuid']
-    dataset_uuid = action_parameters['dataset_uuid']
     partition_count = action_parameters['partition_count']
 
-    partition_lists = [[] for i in range(partition_count)]
-    dataset_entity = storage.retrieve_dataset_entity(team_uuid, dataset_uuid)
-    partition_lists[0].append(dataset_entity['label_map_blob_name'])
-    dataset_record_entities = storage.retrieve_dataset_records(dataset_entity)
-    for i, dataset_record_entity in enumerate(dataset_record_entities):
-        partition_lists[(i + 1) % partition_count].append(dataset_record_entity['tf_record_blob_name'])
+    # The partitions were planned by dataset_zipper.prepare_to_zip_dataset.
+    partition_lists = storage.retrieve_dataset_zipper_partition_lists(team_uuid, dataset_zip_uuid, partition_count)
 
     # Trigger actions for the partitions
     action_parameters = action.create_action_parameters(
         team_uuid, action.ACTION_NAME_DATASET_ZIP_PARTITION)
     action_parameters['team_uuid'] = team_uuid
     action_parameters['dataset_zip_uuid'] = dataset_zip_uuid
+    work_items = []
     for partition_index, partition_list in enumerate(partition_lists):
-        file_count = len(partition_list)
-        storage.update_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index, file_count, 0)
-        action_parameters['partition_list'] = partition_list
-        action_parameters['partition_index'] = partition_index
-        action.trigger_action_via_blob(action_parameters)
+        work_items.append({
+            'partition_list': partition_list,
+            'partition_index': partition_index,
+        })
+    action.trigger_fan_out(action_parameters, work_items, PARTITION_WORKER_COUNT)
+
+def zip_dataset_partitions(action_parameters):
+    action.perform_fan_out_work(action_parameters, __zip_dataset_partition, MIN_SECONDS_PER_PARTITION)
 
-def zip_dataset_partition(action_parameters):
+def __zip_dataset_partition(action_parameters):
     team_uuid = action_parameters['team_uuid']
     dataset_zip_uuid = action_parameters['dataset_zip_uuid']
     partition_list = action_parameters['partition_list']
     partition_index = action_parameters['partition_index']
     files_written = 0
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
-        # Write the files.
-        file_count = len(partition_list)
+    # The zip is streamed: each blob is read a chunk at a time, compressed, and uploaded a chunk at
+    # a time, so memory use doesn't depend on the size of the partition.
+    zip_stream = blob_storage.open_dataset_zip_stream(team_uuid, dataset_zip_uuid, partition_index)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=PREFETCH_THREADS)
+    cancelled = [False]
+    chunk_queues = []
+    try:
+        # The executor starts the downloads in the order they were submitted, so the blob that is
+        # being written is always being downloaded.
         for blob_name in partition_list:
-            content = blob_storage.retrieve_dataset_blob(blob_name)
-            filename = os.path.basename(blob_name)
-            zip_file.writestr(filename, content)
-            files_written += 1
-            storage.update_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index, file_count, files_written)
-    blob_storage.store_dataset_zip(team_uuid, dataset_zip_uuid, partition_index, zip_buffer.getvalue())
+            chunk_queue = queue.Queue(maxsize=PREFETCH_CHUNKS)
+            executor.submit(__prefetch_blob, blob_name, chunk_queue, cancelled)
+            chunk_queues.append(chunk_queue)
+        with zipfile.ZipFile(zip_stream, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+            # Write the files.
+            file_count = len(partition_list)
+            for blob_name, chunk_queue in zip(partition_list, chunk_queues):
+                chunks = __iterate_prefetched_chunks(chunk_queue)
+                first_chunk = next(chunks, b'')
+                zip_info = zipfile.ZipInfo(os.path.basename(blob_name),
+                    date_time=time.localtime(time.time())[:6])
+                zip_info.external_attr = 0o600 << 16
+                zip_info.compress_type = __choose_compress_type(first_chunk)
+                with zip_file.open(zip_info, "w", force_zip64=True) as zip_entry:
+                    zip_entry.write(first_chunk)
+                    for chunk in chunks:
+                        zip_entry.write(chunk)
+                files_written += 1
+                storage.update_dataset_zipper(team_uuid, dataset_zip_uuid, partition_index, file_count, files_written)
+        zip_stream.finish()
+    finally:
+        # Stop any downloads that are still running.
+        cancelled[0] = True
+        for chunk_queue in chunk_queues:
+            __drain(chunk_queue)
+        executor.shutdown(wait=False, cancel_futures=True)
+        zip_stream.close()
+
+def __prefetch_blob(blob_name, chunk_queue, cancelled):
+    try:
+        if cancelled[0]:
+            return
+        for chunk in blob_storage.iterate_dataset_blob_chunks(blob_name):
+            if cancelled[0]:
+                return
+            chunk_queue.put(chunk)
+        chunk_queue.put(None)
+    except Exception as e:
+        chunk_queue.put(e)
+
+def __iterate_prefetched_chunks(chunk_queue):
+    while True:
+        item = chunk_queue.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def __drain(chunk_queue):
+    try:
+        while True:
+            chunk_queue.get_nowait()
+    except queue.Empty:
+        pass
+
+def __choose_compress_type(first_chunk):
+    if len(first_chunk) == 0:
+        return zipfile.ZIP_DEFLATED
+    compressed_size = len(zlib.compress(first_chunk, 1))
+    if compressed_size > len(first_chunk) * (1 - MIN_COMPRESSION_SAVINGS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
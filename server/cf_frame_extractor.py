@@ -15,10 +15,8 @@
 __author__ = "lizlooney@google.com (Liz Looney)"
 
 # Python Standard Library
-from datetime import timedelta
 import logging
 import os
-import time
 import uuid
 
 # Other Modules
@@ -29,29 +27,7 @@ from app_engine import action
 from app_engine import blob_storage
 from app_engine import constants
 from app_engine import storage
-from app_engine import frame_extractor
-
-
-def wait_for_video_upload(action_parameters):
-    team_uuid = action_parameters['team_uuid']
-    video_uuid = action_parameters['video_uuid']
-    description = action_parameters['description']
-    video_filename = action_parameters['video_filename']
-    file_size = action_parameters['file_size']
-    content_type = action_parameters['content_type']
-    create_time_ms = action_parameters['create_time_ms']
-
-    while action.remaining_timedelta(action_parameters) > timedelta(seconds=30):
-        time.sleep(10)
-        # Check to see whether the blob exists.
-        if blob_storage.video_blob_exists(team_uuid, video_uuid):
-            video_entity = storage.create_video_entity(
-                team_uuid, video_uuid, description, video_filename, file_size, content_type, create_time_ms)
-            storage.prepare_to_start_frame_extraction(team_uuid, video_uuid)
-            frame_extractor.start_frame_extraction(video_entity)
-            return
-        # Note that we don't retrigger this action. If the video isn't there by now, it's probably
-        # failed.
+from app_engine import frame_hash
 
 
 def extract_frames(action_parameters):
@@ -161,7 +137,7 @@ def extract_frames(action_parameters):
                 if success:
                     try:
                         video_entity = storage.store_frame_image(team_uuid, video_uuid, frame_number,
-                            'image/jpg', buffer.tostring())
+                            'image/jpg', buffer.tostring(), __compute_dhash(frame))
                     except:
                         # Check if the video has been deleted.
                         team_entity = storage.retrieve_team_entity(team_uuid)
@@ -182,3 +158,9 @@ def extract_frames(action_parameters):
     finally:
         # Delete the temporary file.
         os.remove(video_filename)
+
+
+def __compute_dhash(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return frame_hash.compute_dhash(small)
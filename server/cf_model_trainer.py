@@ -15,27 +15,30 @@
 __author__ = "lizlooney@google.com (Liz Looney)"
 
 # Python Standard Library
+import concurrent.futures
 from datetime import datetime, timedelta, timezone
 import dateutil.parser
 import io
+import logging
 import math
 import time
 
 # Other Modules
 from google.api_core.exceptions import GoogleAPIError
 import PIL.Image
-import tensorflow as tf
-from tensorflow.core.util import event_pb2
 
 # My Modules
 from app_engine import action
 from app_engine import blob_storage
+from app_engine import early_stopping
 from app_engine import model_trainer
 from app_engine import storage
 from app_engine import tflite_creator
+import event_file_reader
+import poll_scheduler
 
 
-def __update_model_entity_job_state(model_entity):
+def __update_model_entity_job_state(model_entity, poll_state):
     # If the training and eval jobs weren't done last time we checked, check now.
     if is_not_done(model_entity):
         ml = model_trainer.get_ml_service()
@@ -62,15 +65,77 @@ def __update_model_entity_job_state(model_entity):
                 eval_job_response = ml.projects().jobs().get(name=eval_job_name).execute()
         else:
             eval_job_response = None
+        # Only list the checkpoints if the checkpoint file has changed since the last time.
+        model_folder = model_entity['model_folder']
+        checkpoint_generation = blob_storage.get_checkpoint_file_generation(model_folder)
+        if checkpoint_generation is not None and checkpoint_generation == poll_state.get('checkpoint_generation'):
+            trained_checkpoint_path = model_entity['trained_checkpoint_path']
+        else:
+            dict_number_to_path = blob_storage.get_checkpoint_paths(model_folder)
+            if len(dict_number_to_path) > 0:
+                trained_checkpoint_path = dict_number_to_path[max(dict_number_to_path.keys())]
+            else:
+                trained_checkpoint_path = ''
+            model_entity = __record_checkpoint_steps(model_entity, dict_number_to_path)
+            poll_state['checkpoint_generation'] = checkpoint_generation
         try:
             model_entity = storage.update_model_entity_job_state(
-                model_entity['team_uuid'], model_entity['model_uuid'], train_job_response, eval_job_response)
+                model_entity['team_uuid'], model_entity['model_uuid'], train_job_response, eval_job_response,
+                trained_checkpoint_path)
         except GoogleAPIError:
             # This happens from time to time. It's not fatal if we can't update the job state in
             # the model entity.
             pass
     return model_entity
 
+# The object detection API saves the training step in its checkpoints as step.
+CHECKPOINT_STEP_KEY = 'step/.ATTRIBUTES/VARIABLE_VALUE'
+
+
+# The training job doesn't write checkpoints at exact multiples of checkpoint_every_n, so the step
+# that each new checkpoint was written at is read from the checkpoint and recorded in the model
+# entity. tflite_creator.get_checkpoint_path_for_step uses it to find the checkpoint that was
+# evaluated at a step.
+# If the team asked for checkpoints to be exported every export_checkpoints_every_n steps, each new
+# checkpoint that is the first one at or past a multiple of export_checkpoints_every_n is exported.
+def __record_checkpoint_steps(model_entity, dict_number_to_path):
+    recorded_numbers = set(model_entity.get('dict_checkpoint_step_to_number', {}).values())
+    dict_step_to_number = {}
+    for checkpoint_number, checkpoint_path in dict_number_to_path.items():
+        if checkpoint_number in recorded_numbers:
+            continue
+        step = __read_checkpoint_step(checkpoint_path)
+        if step is not None:
+            dict_step_to_number[str(step)] = checkpoint_number
+    if len(dict_step_to_number) == 0:
+        return model_entity
+    previous_step = max([int(step) for step in model_entity.get('dict_checkpoint_step_to_number', {})], default=0)
+    team_uuid = model_entity['team_uuid']
+    model_uuid = model_entity['model_uuid']
+    # The steps are stored before the exports are triggered, so that the exports can find them.
+    model_entity = storage.checkpoint_steps_found(team_uuid, model_uuid, dict_step_to_number)
+    export_checkpoints_every_n = model_entity.get('export_checkpoints_every_n', 0)
+    if export_checkpoints_every_n > 0:
+        for step in sorted(int(step) for step in dict_step_to_number):
+            if step // export_checkpoints_every_n > previous_step // export_checkpoints_every_n:
+                tflite_creator.trigger_create_tflite(team_uuid, model_uuid, step=step)
+            previous_step = max(previous_step, step)
+    return model_entity
+
+
+# Returns None if the checkpoint was deleted by the training job before it could be read.
+def __read_checkpoint_step(checkpoint_path):
+    # tensorflow is slow to import, so it is only imported when there is a new checkpoint.
+    import tensorflow as tf
+    # Remove trailing .index.
+    if checkpoint_path.endswith('.index'):
+        checkpoint_path = checkpoint_path[:-6]
+    try:
+        return int(tf.train.load_checkpoint(checkpoint_path).get_tensor(CHECKPOINT_STEP_KEY))
+    except tf.errors.NotFoundError:
+        return None
+
+
 def is_not_done(model_entity):
     return (
         __is_not_done(model_entity['train_job_state']) or
@@ -103,37 +168,61 @@ def monitor_training(action_parameters):
     model_entity = storage.retrieve_model_entity(team_uuid, model_uuid)
     model_folder = model_entity['model_folder']
     prev_training_done = __is_done(model_entity['train_job_state'])
+    # The poll state is the action's checkpoint, so that it is still there if the action is
+    # retriggered.
+    poll_state = action.get_checkpoint(action_parameters, poll_scheduler.create_state())
 
     while True:
+        __wait_for_next_poll(poll_state, action_parameters)
         model_entity = storage.monitor_training_active(team_uuid, model_uuid)
-        model_entity = __update_model_entity_job_state(model_entity)
+        previous_job_states = (model_entity['train_job_state'], model_entity['eval_job_state'])
+        model_entity = __update_model_entity_job_state(model_entity, poll_state)
         previous_time_ms = model_entity['monitor_training_active_time_ms']
+        changed = (model_entity['train_job_state'], model_entity['eval_job_state']) != previous_job_states
 
         if not prev_training_done:
             training_done = __is_done(model_entity['train_job_state'])
             if training_done:
-                # Training just finished. Trigger the action to create the tflite model if there is
-                # a checkpoint.
+                # Training just finished. Trigger the actions to create the tflite models if there
+                # is a checkpoint. Both models are converted from the same SavedModel, so the int8
+                # model is created after the dynamic model.
                 if model_entity['trained_checkpoint_path'] != '':
-                    tflite_creator.trigger_create_tflite(team_uuid, model_uuid)
+                    tflite_creator.trigger_create_tflite(team_uuid, model_uuid,
+                        next_quantization=tflite_creator.QUANTIZATION_INT8)
             prev_training_done = training_done
 
         for job_type in ['train', 'eval']:
-            dict_path_to_updated = blob_storage.get_event_file_paths(model_folder, job_type)
-            for event_file_path, updated in dict_path_to_updated.items():
-                if ('dict_event_file_path_to_updated' in model_entity and
-                        event_file_path in model_entity['dict_event_file_path_to_updated'] and
-                        model_entity['dict_event_file_path_to_updated'][event_file_path] == updated):
+            dict_path_to_updated, dict_path_to_size = blob_storage.get_event_file_sizes(model_folder, job_type)
+            for event_file_path, size in dict_path_to_size.items():
+                updated = dict_path_to_updated[event_file_path]
+                # Only the records that were added since the last time are read.
+                offset = model_entity.get('dict_event_file_path_to_offset', {}).get(event_file_path, 0)
+                if offset == size:
                     continue
-                largest_step, scalar_summary_items, image_summary_items = __monitor_training_for_event_file(
-                    model_folder, job_type, event_file_path, action_parameters)
-                scalar_modified_count = storage.store_model_summary_items(team_uuid, model_uuid, job_type,
-                    'scalar', scalar_summary_items)
-                image_modified_count = storage.store_model_summary_items(team_uuid, model_uuid, job_type,
-                    'image', image_summary_items)
-                model_entity, modified_model_entity = storage.update_model_entity_for_event_file(team_uuid, model_uuid, job_type,
-                    event_file_path, updated, largest_step)
-                if scalar_modified_count > 0 or image_modified_count > 0 or modified_model_entity:
+                crc = model_entity.get('dict_event_file_path_to_crc', {}).get(event_file_path, '')
+                if job_type == 'eval':
+                    image_blob_names = blob_storage.list_event_summary_images(model_folder, job_type)
+                else:
+                    # Training images aren't saved.
+                    image_blob_names = None
+                modified = False
+                for records, offset, crc in __tail_event_file(event_file_path, size, offset, crc):
+                    largest_step, scalar_summary_items, image_summary_items = __monitor_training_for_records(
+                        model_folder, job_type, records, image_blob_names, action_parameters)
+                    scalar_modified_count = storage.store_model_summary_items(model_entity, job_type,
+                        'scalar', scalar_summary_items)
+                    image_modified_count = storage.store_model_summary_items(model_entity, job_type,
+                        'image', image_summary_items)
+                    # Save the offset after each piece, so that if this action is retriggered, the
+                    # next one continues from here.
+                    model_entity, modified_model_entity = storage.update_model_entity_for_event_file(team_uuid, model_uuid, job_type,
+                        event_file_path, updated, largest_step, offset, crc)
+                    if scalar_modified_count > 0 or image_modified_count > 0 or modified_model_entity:
+                        modified = True
+                if modified and job_type == 'eval':
+                    model_entity = __evaluate_checkpoints(model_entity)
+                if modified:
+                    poll_scheduler.mark_changed(poll_state)
                     action.retrigger_now(action_parameters)
 
         if is_done(model_entity):
@@ -142,64 +231,179 @@ def monitor_training(action_parameters):
                 model_entity = storage.monitor_training_finished(team_uuid, model_uuid)
                 return
 
-        if action.remaining_timedelta(action_parameters) > timedelta(minutes=2):
-            time.sleep(30)
+        seconds = poll_scheduler.seconds_until_next_poll(poll_state, time.time(), changed,
+            model_entity['trained_steps'], model_entity.get('checkpoint_every_n', 0),
+            __is_done(model_entity['train_job_state']))
+        poll_state['next_poll_time'] = time.time() + seconds
         action.retrigger_if_necessary(action_parameters)
 
 
-def __monitor_training_for_event_file(model_folder, job_type, event_file_path, action_parameters):
+# __evaluate_checkpoints is called when new eval scalars have been stored. It keeps track of the
+# best eval checkpoint, exports it if the team asked for that, and stops training early if the model
+# has an early stopping policy and the eval metric has stopped improving.
+def __evaluate_checkpoints(model_entity):
+    if model_entity['cancel_requested'] or not model_trainer.is_alive(model_entity['train_job_state']):
+        return model_entity
+    policy = model_entity.get('early_stopping')
+    if policy is not None:
+        metric = policy['metric']
+        min_delta = policy['min_delta']
+    else:
+        metric = early_stopping.DEFAULT_METRIC
+        min_delta = 0
+    dict_step_to_value = {}
+    for summary_items in storage.get_model_summary_items_all_steps(model_entity, 'eval', 'scalar'):
+        for item in summary_items.values():
+            if item['tag'] == metric:
+                dict_step_to_value[item['step']] = item['value']
+    if len(dict_step_to_value) == 0:
+        return model_entity
+    team_uuid = model_entity['team_uuid']
+    model_uuid = model_entity['model_uuid']
+
+    best_step, best_value, evaluations_since_best = early_stopping.find_best(metric, min_delta, dict_step_to_value)
+    if best_step != model_entity.get('best_eval_step'):
+        model_entity = storage.best_eval_checkpoint_found(team_uuid, model_uuid, best_step, best_value)
+        if model_entity.get('export_best_checkpoints', False):
+            tflite_creator.trigger_create_tflite(team_uuid, model_uuid, step=best_step)
+
+    # The team gets the unused training minutes back when the training job ends, the same as when
+    # the user stops training.
+    if policy is None or model_entity.get('early_stopping_triggered', False):
+        return model_entity
+    if evaluations_since_best < policy['patience']:
+        return model_entity
+    # The training job only keeps the last few checkpoints. If the one that was evaluated at
+    # best_step has been deleted, checkpoint_path is '' and the trained checkpoint is the latest
+    # checkpoint, as it is when training isn't stopped early.
+    checkpoint_path = tflite_creator.get_checkpoint_path_for_step(model_entity, best_step)
+    if checkpoint_path == '':
+        logging.warning('Early stopping for model_uuid=%s: the checkpoint evaluated at best step %d has been deleted. The latest checkpoint will be used.' %
+            (model_uuid, best_step))
+    storage.early_stopping_triggered(team_uuid, model_uuid, best_step, best_value, checkpoint_path)
+    return model_trainer.stop_training_model(team_uuid, model_uuid)
+
+
+def __wait_for_next_poll(poll_state, action_parameters):
+    while True:
+        seconds = poll_state.get('next_poll_time', 0) - time.time()
+        if seconds <= 0:
+            return
+        # Leave enough time for the action to be retriggered before it runs out of time. The next
+        # action will wait for the rest of the time.
+        available_seconds = action.remaining_timedelta(action_parameters).total_seconds() - 80
+        if available_seconds <= 0:
+            action.retrigger_now(action_parameters)
+        time.sleep(min(seconds, available_seconds))
+
+
+# Event files are read this many bytes at a time.
+EVENT_FILE_READ_BYTES = 16 * 1024 * 1024
+
+
+# __tail_event_file yields lists of the complete records that follow offset, along with the offset
+# and crc after the last of them. An incomplete record at the end of the file is left for next time.
+def __tail_event_file(event_file_path, size, offset, crc):
+    # If the file is shorter than before, or the record that ends at offset isn't the one that was
+    # consumed last time, the file was rewritten and must be read from the beginning.
+    if offset > size:
+        offset = 0
+    elif offset > 0:
+        previous_crc = blob_storage.retrieve_event_file_bytes(event_file_path,
+            offset - event_file_reader.RECORD_FOOTER_BYTES, offset)
+        if previous_crc.hex() != crc:
+            offset = 0
+    buffer = b''
+    read_offset = offset
+    while read_offset < size:
+        end = min(read_offset + EVENT_FILE_READ_BYTES, size)
+        buffer += blob_storage.retrieve_event_file_bytes(event_file_path, read_offset, end)
+        read_offset = end
+        records, position, last_crc = event_file_reader.split_records(buffer)
+        if last_crc is not None:
+            crc = last_crc
+        buffer = buffer[position:]
+        offset += position
+        if len(records) > 0:
+            yield records, offset, crc
+
+
+# Eval images are converted to JPEG and stored by a pool of threads while the records are parsed.
+# At most MAX_PENDING_IMAGES images are waiting to be stored at once.
+IMAGE_WORKER_COUNT = 8
+MAX_PENDING_IMAGES = 32
+
+
+def __monitor_training_for_records(model_folder, job_type, records, image_blob_names, action_parameters):
     largest_step = None
     scalar_summary_items = {}
     image_summary_items = {}
-    for record in tf.data.TFRecordDataset(event_file_path):
-        action.retrigger_if_necessary(action_parameters)
-        event = event_pb2.Event.FromString(record.numpy())
-        if not hasattr(event, 'step'):
-            continue
-        if largest_step is None or event.step > largest_step:
-            largest_step = event.step
-        if not hasattr(event, 'summary'):
-            continue
-        for value in event.summary.value:
-            if (not hasattr(value, 'metadata') or
-                    not hasattr(value.metadata, 'plugin_data') or
-                    not hasattr(value.metadata.plugin_data, 'plugin_name')):
-                continue
-            if value.metadata.plugin_data.plugin_name == 'scalars':
-                item_value = float(tf.make_ndarray(value.tensor))
-                if math.isnan(item_value):
-                    continue
-                item = {
-                    'step': event.step,
-                    'tag': value.tag,
-                    'value': item_value
-                }
-                scalar_summary_items[model_trainer.make_key(event.step, value.tag)] = item
-            elif value.metadata.plugin_data.plugin_name == 'images':
-                if job_type == 'train':
-                    # Don't bother saving training images.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=IMAGE_WORKER_COUNT)
+    pending = set()
+    try:
+        for record in records:
+            action.retrigger_if_necessary(action_parameters)
+            event = event_file_reader.parse_event(record)
+            if largest_step is None or event.step > largest_step:
+                largest_step = event.step
+            for value in event.summary_values:
+                if value.tensor is None:
                     continue
-                image_value = tf.make_ndarray(value.tensor)
-                if len(image_value) < 3: # width, height, image bytes
-                    continue
-                width = int(float(image_value[0].decode('utf-8')))
-                height = int(float(image_value[1].decode('utf-8')))
-                image_bytes = image_value[2]
-
-                # Convert to JPEG with lower quality.
-                im = PIL.Image.open(io.BytesIO(image_bytes))
-                arr = io.BytesIO()
-                im.save(arr, format='JPEG', quality=50)
-                jpeg_image_bytes = arr.getvalue()
-
-                blob_storage.store_event_summary_image(model_folder, job_type,
-                    event.step, value.tag, jpeg_image_bytes)
-                item = {
-                    'job_type': job_type,
-                    'step': event.step,
-                    'tag': value.tag,
-                    'width': width,
-                    'height': height,
-                }
-                image_summary_items[model_trainer.make_key(event.step, value.tag)] = item
+                if value.plugin_name == 'scalars':
+                    item_value = float(event_file_reader.make_ndarray(value.tensor))
+                    if math.isnan(item_value):
+                        continue
+                    item = {
+                        'step': event.step,
+                        'tag': value.tag,
+                        'value': item_value
+                    }
+                    scalar_summary_items[model_trainer.make_key(event.step, value.tag)] = item
+                elif value.plugin_name == 'images':
+                    if job_type == 'train':
+                        # Don't bother saving training images.
+                        continue
+                    image_value = event_file_reader.make_ndarray(value.tensor)
+                    if len(image_value) < 3: # width, height, image bytes
+                        continue
+                    width = int(float(image_value[0].decode('utf-8')))
+                    height = int(float(image_value[1].decode('utf-8')))
+                    image_bytes = image_value[2]
+
+                    if not blob_storage.event_summary_image_exists_in(image_blob_names,
+                            model_folder, job_type, event.step, value.tag):
+                        if len(pending) >= MAX_PENDING_IMAGES:
+                            done, pending = concurrent.futures.wait(pending,
+                                return_when=concurrent.futures.FIRST_COMPLETED)
+                            __add_stored_images(done, image_blob_names)
+                        pending.add(executor.submit(__store_image, model_folder, job_type,
+                            event.step, value.tag, image_bytes))
+                    item = {
+                        'job_type': job_type,
+                        'step': event.step,
+                        'tag': value.tag,
+                        'width': width,
+                        'height': height,
+                    }
+                    image_summary_items[model_trainer.make_key(event.step, value.tag)] = item
+        # Wait for the images to be stored before the caller saves the offset.
+        done, pending = concurrent.futures.wait(pending)
+        __add_stored_images(done, image_blob_names)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     return largest_step, scalar_summary_items, image_summary_items
+
+
+def __store_image(model_folder, job_type, step, tag, image_bytes):
+    # Convert to JPEG with lower quality.
+    im = PIL.Image.open(io.BytesIO(image_bytes))
+    arr = io.BytesIO()
+    im.save(arr, format='JPEG', quality=50)
+    jpeg_image_bytes = arr.getvalue()
+    return blob_storage.store_event_summary_image(model_folder, job_type, step, tag, jpeg_image_bytes)
+
+
+def __add_stored_images(done, image_blob_names):
+    for future in done:
+        # This raises the exception if converting or storing the image failed.
+        image_blob_names.add(future.result())
@@ -0,0 +1,161 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Python Standard Library
+import logging
+import os
+import shutil
+import uuid
+
+# Other Modules
+import cv2
+import numpy as np
+import tensorflow as tf
+
+# My Modules
+from app_engine import action
+from app_engine import blob_storage
+from app_engine import exceptions
+from app_engine import storage
+
+
+# The proposed bboxes are stored this many frames at a time.
+FRAMES_PER_BATCH = 100
+
+
+def prelabel_video(action_parameters):
+    team_uuid = action_parameters['team_uuid']
+    video_uuid = action_parameters['video_uuid']
+    model_uuid = action_parameters['model_uuid']
+    confidence_threshold = action_parameters['confidence_threshold']
+    prelabeling_uuid = action_parameters['prelabeling_uuid']
+
+    try:
+        video_entity = storage.retrieve_video_entity(team_uuid, video_uuid)
+        if not video_entity.get('prelabeling_in_progress', False):
+            return
+        if video_entity.get('prelabeling_uuid') != prelabeling_uuid:
+            # This action's lock expired and prelabeling was started again.
+            return
+        model_entity = storage.retrieve_model_entity(team_uuid, model_uuid)
+        sorted_label_list = model_entity['sorted_label_list']
+        # If this action was retriggered, continue where the previous one stopped.
+        frame_number = video_entity['prelabeling_next_frame_number']
+
+        temp_folder = '/tmp/prelabeler/%s' % str(uuid.uuid4().hex)
+        os.makedirs(temp_folder, exist_ok=True)
+        try:
+            model_filename = '%s/model_with_metadata.tflite' % temp_folder
+            if not blob_storage.write_tflite_model_with_metadata_to_file(
+                    model_entity['tflite_files_folder'], model_filename):
+                message = 'Error: TensorFlow Lite model for model_uuid=%s not found.' % model_uuid
+                logging.critical(message)
+                raise exceptions.HttpErrorNotFound(message)
+            video_filename = '%s/video' % temp_folder
+            if not blob_storage.write_video_to_file(video_entity['video_blob_name'], video_filename):
+                message = 'Error: Video for video_uuid=%s not found.' % video_uuid
+                logging.critical(message)
+                raise exceptions.HttpErrorNotFound(message)
+
+            # The TFLite CPU kernels (and the XNNPACK delegate, when the runtime applies it) use
+            # one thread per core.
+            interpreter = tf.lite.Interpreter(model_path=model_filename, num_threads=os.cpu_count())
+            interpreter.allocate_tensors()
+
+            vid = cv2.VideoCapture(video_filename)
+            if not vid.isOpened():
+                message = 'Error: Unable to open video for video_uuid=%s.' % video_uuid
+                logging.critical(message)
+                raise exceptions.HttpErrorInternalServerError(message)
+            try:
+                # Setting the CAP_PROP_POS_FRAMES property is not reliable. Instead, we skip
+                # through frames using vid.grab().
+                for i in range(frame_number):
+                    vid.grab()
+                while True:
+                    min_frame_number = frame_number
+                    list_of_bboxes_text = []
+                    while len(list_of_bboxes_text) < FRAMES_PER_BATCH:
+                        success, frame = vid.read()
+                        if not success:
+                            break
+                        list_of_bboxes_text.append(__detect(interpreter, frame, sorted_label_list,
+                            confidence_threshold))
+                        frame_number += 1
+                    if len(list_of_bboxes_text) > 0:
+                        storage.store_prelabeled_bboxes(team_uuid, video_uuid, model_uuid,
+                            min_frame_number, list_of_bboxes_text)
+                    if len(list_of_bboxes_text) < FRAMES_PER_BATCH:
+                        # We've reached the end of the video.
+                        break
+                    action.retrigger_if_necessary(action_parameters)
+            finally:
+                # Release the cv2 video.
+                vid.release()
+        finally:
+            # Delete the temporary directory.
+            shutil.rmtree(temp_folder)
+        storage.prelabeling_finished(team_uuid, video_uuid, prelabeling_uuid)
+    except action.Stop:
+        raise
+    except:
+        storage.prelabeling_finished(team_uuid, video_uuid, prelabeling_uuid,
+            error_message='Unable to prelabel the video.')
+        # Check if the video or the model has been deleted.
+        team_entity = storage.retrieve_team_entity(team_uuid)
+        if 'video_uuids_deleted' in team_entity:
+            if video_uuid in team_entity['video_uuids_deleted']:
+                return
+        if 'model_uuids_deleted' in team_entity:
+            if model_uuid in team_entity['model_uuids_deleted']:
+                return
+        raise
+
+
+def __detect(interpreter, frame, sorted_label_list, confidence_threshold):
+    input_details = interpreter.get_input_details()[0]
+    _, input_height, input_width, _ = input_details['shape']
+    frame_height, frame_width = frame.shape[:2]
+    image = cv2.cvtColor(cv2.resize(frame, (input_width, input_height)), cv2.COLOR_BGR2RGB)
+    if input_details['dtype'] == np.float32:
+        # This matches the input_norm_mean and input_norm_std used in cf_tflite_creator.
+        image = (image.astype(np.float32) - 127.5) / 127.5
+    interpreter.set_tensor(input_details['index'], np.expand_dims(image, axis=0))
+    interpreter.invoke()
+
+    # The outputs of the TFLite_Detection_PostProcess op are boxes, classes, scores, and count,
+    # in that order. This is the same order that the FTC SDK uses.
+    output_details = interpreter.get_output_details()
+    boxes = interpreter.get_tensor(output_details[0]['index'])[0]
+    classes = interpreter.get_tensor(output_details[1]['index'])[0]
+    scores = interpreter.get_tensor(output_details[2]['index'])[0]
+    count = int(interpreter.get_tensor(output_details[3]['index'])[0])
+
+    bboxes_text = ''
+    for i in range(count):
+        if scores[i] < confidence_threshold:
+            continue
+        class_index = int(classes[i])
+        if class_index < 0 or class_index >= len(sorted_label_list):
+            continue
+        y1, x1, y2, x2 = boxes[i]
+        bboxes_text += '%d,%d,%d,%d,%s\n' % (
+            int(max(x1, 0) * frame_width),
+            int(max(y1, 0) * frame_height),
+            int(min(x2, 1) * frame_width),
+            int(min(y2, 1) * frame_height),
+            sorted_label_list[class_index])
+    return bboxes_text
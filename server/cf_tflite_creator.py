@@ -15,6 +15,8 @@
 __author__ = "lizlooney@google.com (Liz Looney)"
 
 # Python Standard Library
+import hashlib
+import json
 import logging
 import os
 import shutil
@@ -23,90 +25,117 @@ import uuid
 # Other Modules
 from google.protobuf import text_format
 from object_detection import export_tflite_graph_lib_tf2
+from object_detection.builders import model_builder
 from object_detection.protos import pipeline_pb2
 import tensorflow as tf
 from tflite_support.metadata_writers import object_detector
-from tflite_support.metadata_writers import writer_utils
 
 # My Modules
 from app_engine import action
 from app_engine import blob_storage
 from app_engine import exceptions
 from app_engine import storage
+from app_engine import tflite_creator
+import tflite_benchmark
+
+
+# Full integer quantization is calibrated with this many frames from the model's training records.
+REPRESENTATIVE_FRAME_COUNT = 300
+
+MAX_DETECTIONS = 10  # This matches the default for TFObjectDetector.Parameters.maxNumDetections in the the FTC SDK.
+
+# The normalization that is written in the metadata.
+INPUT_NORM_MEAN = 127.5
+INPUT_NORM_STD = 127.5
 
 
 def create_tflite(action_parameters):
     team_uuid = action_parameters['team_uuid']
     model_uuid = action_parameters['model_uuid']
+    # Actions triggered before full integer quantization was added don't have quantization.
+    quantization = action_parameters.get('quantization', tflite_creator.QUANTIZATION_DYNAMIC)
+    # If step is given, the model is created from the checkpoint written at that step.
+    step = action_parameters.get('step', None)
 
     try:
         model_entity = storage.retrieve_model_entity(team_uuid, model_uuid)
         model_folder = model_entity['model_folder']
-        tflite_files_folder = model_entity['tflite_files_folder']
+        if step is None:
+            tflite_files_folder = model_entity['tflite_files_folder']
+            checkpoint_path = model_entity['trained_checkpoint_path']
+        else:
+            tflite_files_folder = blob_storage.get_checkpoint_export_folder(model_entity['tflite_files_folder'], step)
+            checkpoint_path = tflite_creator.get_checkpoint_path_for_step(model_entity, step)
+        if checkpoint_path == '':
+            message = 'Error: Trained checkpoint not found for model_uuid=%s.' % model_uuid
+            logging.critical(message)
+            raise exceptions.HttpErrorNotFound(message)
+        # Remove trailing .index if it's there.
+        if checkpoint_path.endswith('.index'):
+            checkpoint_path = checkpoint_path[:-6]
+
+        # Each stage is keyed by everything that goes into it. The metadata and the labels are only
+        # part of the last key, so changing them doesn't export or convert the model again.
+        exporter = __get_exporter(model_folder)
+        saved_model_key = __make_key(checkpoint_path, exporter['pipeline_config_hash'], MAX_DETECTIONS)
+        tflite_model_key = __make_key(saved_model_key, quantization)
+        label_map_txt = '\n'.join(model_entity['sorted_label_list'])
+        model_with_metadata_key = __make_key(tflite_model_key, label_map_txt, INPUT_NORM_MEAN, INPUT_NORM_STD)
 
         # The following code is inspired by
         # https://colab.sandbox.google.com/github/tensorflow/models/blob/master/research/object_detection/colab_tutorials/convert_odt_model_to_TFLite.ipynb
         # and
         # https://github.com/tensorflow/models/blob/b3483b3942ab9bddc94fcbc5bd00fc790d1ddfcb/research/object_detection/export_tflite_graph_tf2.py
 
-        if not blob_storage.tflite_saved_model_exists(model_folder):
-            # Export TFLite inference graph.
-            pipeline_config_path = blob_storage.get_pipeline_config_path(model_folder)
-            pipeline_config = pipeline_pb2.TrainEvalPipelineConfig()
-            with tf.io.gfile.GFile(pipeline_config_path, 'r') as f:
-                text_format.Parse(f.read(), pipeline_config)
-            trained_checkpoint_path = model_entity['trained_checkpoint_path']
-            if trained_checkpoint_path == '':
-                message = 'Error: Trained checkpoint not found for model_uuid=%s.' % model_uuid
-                logging.critical(message)
-                raise exceptions.HttpErrorNotFound(message)
-            trained_checkpoint_dir = trained_checkpoint_path[:trained_checkpoint_path.rindex('/')]
-            output_directory = blob_storage.get_tflite_saved_model_parent_path(model_folder)
-            max_detections = 10  # This matches the default for TFObjectDetector.Parameters.maxNumDetections in the the FTC SDK.
-            export_tflite_graph_lib_tf2.export_tflite_model(pipeline_config, trained_checkpoint_dir,
-                output_directory, max_detections, use_regular_nms=False)
-
-        action.retrigger_if_necessary(action_parameters)
+        tflite_model_with_metadata = None
+        if blob_storage.get_tflite_model_with_metadata_key(tflite_files_folder, quantization) != model_with_metadata_key:
+            tflite_model = blob_storage.retrieve_tflite_cached_model(model_folder, tflite_model_key)
+            if tflite_model is None:
+                saved_model_path = blob_storage.get_tflite_cached_saved_model_path(model_folder, saved_model_key)
+                if not blob_storage.tflite_cached_saved_model_exists(model_folder, saved_model_key):
+                    # Export TFLite inference graph.
+                    __export_tflite_saved_model(exporter, checkpoint_path, saved_model_path)
+                    action.retrigger_if_necessary(action_parameters)
 
-        if not blob_storage.tflite_quantized_model_exists(model_folder):
-            # Convert to a quantized tflite model
-            saved_model_path = blob_storage.get_tflite_saved_model_path(model_folder)
-            converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_path)
-            converter.optimizations = [tf.lite.Optimize.DEFAULT] # DEFAULT means the tflite model will be quantized.
-            tflite_quantized_model = converter.convert()
-            blob_storage.store_tflite_quantized_model(model_folder, tflite_quantized_model)
+                # Convert to a quantized tflite model
+                converter = __make_converter(exporter, saved_model_path, quantization, model_entity)
+                tflite_model = converter.convert()
+                blob_storage.store_tflite_cached_model(model_folder, tflite_model_key, tflite_model)
+                action.retrigger_if_necessary(action_parameters)
 
-        action.retrigger_if_necessary(action_parameters)
+            # Write the label map every time, so that it matches the labels in the model.
+            blob_storage.store_tflite_label_map_txt(tflite_files_folder, label_map_txt)
 
-        if not blob_storage.tflite_label_map_txt_exists(tflite_files_folder):
-            # Create the label map.
-            blob_storage.store_tflite_label_map_txt(tflite_files_folder,
-                    '\n'.join(model_entity['sorted_label_list']))
+            # Add Metadata
+            tflite_model_with_metadata = __add_metadata(tflite_model, label_map_txt)
+            blob_storage.store_tflite_model_with_metadata(tflite_files_folder, tflite_model_with_metadata,
+                model_with_metadata_key, quantization)
+            storage.tflite_model_created(team_uuid, model_uuid, quantization,
+                len(tflite_model_with_metadata), step)
 
         action.retrigger_if_necessary(action_parameters)
 
-        if not blob_storage.tflite_model_with_metadata_exists(tflite_files_folder):
-            # Add Metadata
-            # Make a temporary directory
-            temp_folder = '/tmp/tflite_creater/%s' % str(uuid.uuid4().hex)
-            os.makedirs(temp_folder, exist_ok=True)
-            try:
-                quantized_model_filename = '%s/quantized_model' % temp_folder
-                blob_storage.write_tflite_quantized_model_to_file(model_folder, quantized_model_filename)
-                label_map_txt_filename = '%s/label_map.txt' % temp_folder
-                blob_storage.write_tflite_label_map_txt_to_file(tflite_files_folder, label_map_txt_filename)
-                model_with_metadata_filename = '%s/model_with_metadata.tflite' % temp_folder
-
-                writer = object_detector.MetadataWriter.create_for_inference(
-                        writer_utils.load_file(quantized_model_filename),
-                        input_norm_mean=[127.5],  input_norm_std=[127.5],
-                        label_file_paths=[label_map_txt_filename])
-                writer_utils.save_file(writer.populate(), model_with_metadata_filename)
-
-                blob_storage.store_tflite_model_with_metadata(tflite_files_folder, model_with_metadata_filename)
-            finally:
-                # Delete the temporary directory.
-                shutil.rmtree(temp_folder)
+        # Models created from intermediate checkpoints have the same architecture as the final
+        # model, so only the final model is benchmarked.
+        model_entity = storage.retrieve_model_entity(team_uuid, model_uuid)
+        previous_benchmark = model_entity.get('tflite_benchmarks', {}).get(quantization, {})
+        if step is None and previous_benchmark.get('key') != model_with_metadata_key:
+            # Measure how fast the model runs on real frames.
+            if tflite_model_with_metadata is None:
+                tflite_model_with_metadata = blob_storage.retrieve_tflite_model_with_metadata(
+                    tflite_files_folder, quantization)
+            if model_entity['eval_frame_count'] > 0:
+                frames = tflite_benchmark.read_frames_from_records(model_entity['eval_input_path'])
+            else:
+                frames = tflite_benchmark.read_frames_from_records(model_entity['train_input_path'])
+            if len(frames) > 0:
+                benchmark = tflite_benchmark.benchmark(tflite_model_with_metadata, frames)
+                benchmark['key'] = model_with_metadata_key
+                storage.tflite_model_benchmarked(team_uuid, model_uuid, quantization, benchmark)
+
+        next_quantization = action_parameters.get('next_quantization', None)
+        if next_quantization is not None:
+            tflite_creator.trigger_create_tflite(team_uuid, model_uuid, next_quantization, step)
     except:
         # Check if the model has been deleted.
         team_entity = storage.retrieve_team_entity(team_uuid)
@@ -114,3 +143,132 @@ def create_tflite(action_parameters):
             if model_uuid in team_entity['model_uuids_deleted']:
                 return
         raise
+
+
+def __make_key(*parts):
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def __make_converter(exporter, saved_model_path, quantization, model_entity):
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_path)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT] # DEFAULT means the tflite model will be quantized.
+    if quantization == tflite_creator.QUANTIZATION_INT8:
+        # Without a representative dataset, DEFAULT only quantizes the weights. With one, the
+        # activations are quantized too. The detection post-processing op has no int8 kernel, so
+        # it is allowed to stay float.
+        height, width = __get_input_size(exporter['pipeline_config'])
+        converter.representative_dataset = __make_representative_dataset(
+            __get_representative_images(exporter, model_entity['train_input_path']), height, width)
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+        converter.inference_input_type = tf.uint8
+    return converter
+
+
+def __add_metadata(tflite_model, label_map_txt):
+    # The metadata writer only reads the label map from a file.
+    temp_folder = '/tmp/tflite_creater/%s' % str(uuid.uuid4().hex)
+    os.makedirs(temp_folder, exist_ok=True)
+    try:
+        label_map_txt_filename = '%s/label_map.txt' % temp_folder
+        with open(label_map_txt_filename, 'w') as f:
+            f.write(label_map_txt)
+        writer = object_detector.MetadataWriter.create_for_inference(bytearray(tflite_model),
+                input_norm_mean=[INPUT_NORM_MEAN],  input_norm_std=[INPUT_NORM_STD],
+                label_file_paths=[label_map_txt_filename])
+        return bytes(writer.populate())
+    finally:
+        # Delete the temporary directory.
+        shutil.rmtree(temp_folder)
+
+
+# The parsed pipeline config, the detection model built from it, the traced inference function,
+# and the representative images are kept between exports of the same model, for example when
+# intermediate checkpoints are exported. Exporting another checkpoint then only restores the
+# variables and saves the SavedModel.
+__exporter = {}
+
+
+def __get_exporter(model_folder):
+    if __exporter.get('model_folder') != model_folder:
+        __exporter.clear()
+        pipeline_config_path = blob_storage.get_pipeline_config_path(model_folder)
+        with tf.io.gfile.GFile(pipeline_config_path, 'r') as f:
+            pipeline_config_text = f.read()
+        pipeline_config = pipeline_pb2.TrainEvalPipelineConfig()
+        text_format.Parse(pipeline_config_text, pipeline_config)
+        if pipeline_config.model.WhichOneof('model') != 'ssd':
+            message = 'Error: Only SSD models can be converted to TensorFlow Lite.'
+            logging.critical(message)
+            raise exceptions.HttpErrorInternalServerError(message)
+        __exporter.update({
+            'model_folder': model_folder,
+            'pipeline_config': pipeline_config,
+            'pipeline_config_hash': hashlib.sha256(pipeline_config_text.encode('utf-8')).hexdigest(),
+            'checkpoint': None,
+            'detection_module': None,
+            'concrete_function': None,
+            'representative_images': None,
+        })
+    return __exporter
+
+
+# __export_tflite_saved_model does what export_tflite_graph_lib_tf2.export_tflite_model does, except
+# that it restores the given checkpoint instead of the latest one in the checkpoint directory.
+def __export_tflite_saved_model(exporter, checkpoint_path, saved_model_path):
+    if exporter['detection_module'] is None:
+        detection_model = model_builder.build(exporter['pipeline_config'].model, is_training=False)
+        exporter['checkpoint'] = tf.train.Checkpoint(model=detection_model)
+        exporter['detection_module'] = export_tflite_graph_lib_tf2.SSDModule(exporter['pipeline_config'],
+            detection_model, MAX_DETECTIONS, use_regular_nms=False)
+    status = exporter['checkpoint'].restore(checkpoint_path).expect_partial()
+    if exporter['concrete_function'] is None:
+        # Getting the concrete function traces the graph and forces variables to be constructed.
+        status.assert_existing_objects_matched()
+        detection_module = exporter['detection_module']
+        exporter['concrete_function'] = detection_module.inference_fn.get_concrete_function(
+            tf.TensorSpec(shape=detection_module.input_shape(), dtype=tf.float32, name='input'))
+    status.assert_existing_objects_matched()
+    tf.saved_model.save(exporter['detection_module'], saved_model_path,
+        signatures=exporter['concrete_function'])
+
+
+def __get_input_size(pipeline_config):
+    # All the starting models are SSD models with a fixed shape resizer.
+    fixed_shape_resizer = pipeline_config.model.ssd.image_resizer.fixed_shape_resizer
+    return fixed_shape_resizer.height, fixed_shape_resizer.width
+
+
+# __get_representative_images returns the encoded images of up to REPRESENTATIVE_FRAME_COUNT frames
+# from the model's training records. The records are interleaved so that the frames come from all of
+# the model's datasets.
+def __get_representative_images(exporter, train_input_path):
+    if exporter['representative_images'] is None:
+        filenames = []
+        for pattern in train_input_path:
+            filenames.extend(tf.io.gfile.glob(pattern))
+        records = tf.data.Dataset.from_tensor_slices(sorted(filenames)).interleave(
+            tf.data.TFRecordDataset, cycle_length=max(min(len(filenames), 16), 1),
+            num_parallel_calls=tf.data.AUTOTUNE)
+        feature_description = {
+            'image/encoded': tf.io.FixedLenFeature([], tf.string),
+        }
+        representative_images = []
+        for record in records.take(REPRESENTATIVE_FRAME_COUNT):
+            example = tf.io.parse_single_example(record, feature_description)
+            representative_images.append(example['image/encoded'].numpy())
+        exporter['representative_images'] = representative_images
+    return exporter['representative_images']
+
+
+# __make_representative_dataset returns a generator function that yields the images, preprocessed
+# the same way as the input of the exported model.
+def __make_representative_dataset(representative_images, height, width):
+    def representative_dataset():
+        for encoded_image in representative_images:
+            image = tf.io.decode_image(encoded_image, channels=3, expand_animations=False)
+            image = tf.image.resize(tf.cast(image, tf.float32), [height, width])
+            # Normalize to [-1, 1], matching the input_norm_mean and input_norm_std in the metadata.
+            image = (image - INPUT_NORM_MEAN) / INPUT_NORM_STD
+            yield [tf.expand_dims(image, 0)]
+    return representative_dataset
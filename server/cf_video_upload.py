@@ -0,0 +1,49 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# wait_for_video_upload is kept apart from cf_frame_extractor so that it doesn't have to import cv2.
+
+# Python Standard Library
+from datetime import timedelta
+import time
+
+# My Modules
+from app_engine import action
+from app_engine import blob_storage
+from app_engine import frame_extractor
+from app_engine import storage
+
+
+def wait_for_video_upload(action_parameters):
+    team_uuid = action_parameters['team_uuid']
+    video_uuid = action_parameters['video_uuid']
+    description = action_parameters['description']
+    video_filename = action_parameters['video_filename']
+    file_size = action_parameters['file_size']
+    content_type = action_parameters['content_type']
+    create_time_ms = action_parameters['create_time_ms']
+
+    while action.remaining_timedelta(action_parameters) > timedelta(seconds=30):
+        time.sleep(10)
+        # Check to see whether the blob exists.
+        if blob_storage.video_blob_exists(team_uuid, video_uuid):
+            video_entity = storage.create_video_entity(
+                team_uuid, video_uuid, description, video_filename, file_size, content_type, create_time_ms)
+            storage.prepare_to_start_frame_extraction(team_uuid, video_uuid)
+            frame_extractor.start_frame_extraction(video_entity)
+            return
+        # Note that we don't retrigger this action. If the video isn't there by now, it's probably
+        # failed.
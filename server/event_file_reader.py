@@ -0,0 +1,355 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# A reader for TensorFlow event files that doesn't need tensorflow.
+#
+# Event files are TFRecord files whose records are serialized Event protos. Only the parts of
+# Event, Summary, and TensorProto that monitor_training uses are decoded; everything else is
+# skipped. tests/event_file_reader_test.py compares this reader with tensorflow on events written
+# by tf.summary. To compare them on a real event file, run
+#   python event_file_reader.py EVENT_FILE
+# in an environment where tensorflow is installed.
+
+# Python Standard Library
+import argparse
+import collections
+import struct
+import sys
+
+# Other Modules
+import google_crc32c
+import numpy as np
+
+
+# Each record is a little-endian uint64 length, the masked crc32c of the length, the data, and the
+# masked crc32c of the data.
+RECORD_HEADER_BYTES = 12
+RECORD_FOOTER_BYTES = 4
+
+
+class DataLossError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+def masked_crc32c(data):
+    crc = google_crc32c.value(bytes(data))
+    return (((crc >> 15) | (crc << 17)) + 0xa282ead8) & 0xffffffff
+
+
+# split_records returns the complete records at the start of buffer, the number of bytes they
+# occupy, and the hex of the last record's data crc (or None if there are no complete records).
+# An incomplete record at the end of buffer is not consumed.
+def split_records(buffer):
+    records = []
+    position = 0
+    crc = None
+    while len(buffer) - position >= RECORD_HEADER_BYTES:
+        length_bytes = buffer[position:position + 8]
+        length_crc = struct.unpack('<I', buffer[position + 8:position + RECORD_HEADER_BYTES])[0]
+        if masked_crc32c(length_bytes) != length_crc:
+            raise DataLossError('Corrupted record length at offset %d.' % position)
+        length = struct.unpack('<Q', length_bytes)[0]
+        data_start = position + RECORD_HEADER_BYTES
+        record_end = data_start + length + RECORD_FOOTER_BYTES
+        if record_end > len(buffer):
+            break
+        data = buffer[data_start:data_start + length]
+        data_crc = buffer[record_end - RECORD_FOOTER_BYTES:record_end]
+        if masked_crc32c(data) != struct.unpack('<I', data_crc)[0]:
+            raise DataLossError('Corrupted record data at offset %d.' % position)
+        records.append(bytes(data))
+        crc = bytes(data_crc).hex()
+        position = record_end
+    return records, position, crc
+
+
+# Protocol buffer wire format.
+
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+
+def __read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        b = data[position]
+        position += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, position
+        shift += 7
+
+
+def __iterate_fields(data):
+    # Yields (field_number, wire_type, value). The value of a varint is an int, the value of a
+    # fixed64 or fixed32 is its raw bytes, and the value of a length-delimited field is its bytes.
+    position = 0
+    while position < len(data):
+        key, position = __read_varint(data, position)
+        field_number = key >> 3
+        wire_type = key & 7
+        if wire_type == WIRETYPE_VARINT:
+            value, position = __read_varint(data, position)
+        elif wire_type == WIRETYPE_FIXED64:
+            value = data[position:position + 8]
+            position += 8
+        elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+            length, position = __read_varint(data, position)
+            value = data[position:position + length]
+            position += length
+        elif wire_type == WIRETYPE_FIXED32:
+            value = data[position:position + 4]
+            position += 4
+        else:
+            raise DataLossError('Unsupported wire type %d.' % wire_type)
+        yield field_number, wire_type, value
+
+
+def __to_int64(value):
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+
+def __unpack_varints(data):
+    values = []
+    position = 0
+    while position < len(data):
+        value, position = __read_varint(data, position)
+        values.append(__to_int64(value))
+    return values
+
+
+# Event protos.
+
+# NamedTuples for the decoded protos.
+Event = collections.namedtuple('Event', ['wall_time', 'step', 'summary_values'])
+SummaryValue = collections.namedtuple('SummaryValue', ['tag', 'plugin_name', 'simple_value', 'tensor'])
+Tensor = collections.namedtuple('Tensor', ['dtype', 'shape', 'tensor_content', 'values'])
+
+# Event fields
+EVENT_WALL_TIME = 1
+EVENT_STEP = 2
+EVENT_SUMMARY = 5
+# Summary fields
+SUMMARY_VALUE = 1
+# Summary.Value fields
+VALUE_TAG = 1
+VALUE_SIMPLE_VALUE = 2
+VALUE_TENSOR = 8
+VALUE_METADATA = 9
+# SummaryMetadata fields
+METADATA_PLUGIN_DATA = 1
+# SummaryMetadata.PluginData fields
+PLUGIN_DATA_PLUGIN_NAME = 1
+# TensorProto fields
+TENSOR_DTYPE = 1
+TENSOR_SHAPE = 2
+TENSOR_CONTENT = 4
+TENSOR_FLOAT_VAL = 5
+TENSOR_DOUBLE_VAL = 6
+TENSOR_INT_VAL = 7
+TENSOR_STRING_VAL = 8
+TENSOR_INT64_VAL = 10
+TENSOR_BOOL_VAL = 11
+TENSOR_HALF_VAL = 13
+# TensorShapeProto fields
+SHAPE_DIM = 2
+# TensorShapeProto.Dim fields
+DIM_SIZE = 1
+
+# DataType values, with the numpy dtype used for tensor_content.
+DT_FLOAT = 1
+DT_DOUBLE = 2
+DT_INT32 = 3
+DT_UINT8 = 4
+DT_INT16 = 5
+DT_INT8 = 6
+DT_STRING = 7
+DT_INT64 = 9
+DT_BOOL = 10
+DT_HALF = 19
+DICT_DTYPE_TO_NUMPY = {
+    DT_FLOAT: np.float32,
+    DT_DOUBLE: np.float64,
+    DT_INT32: np.int32,
+    DT_UINT8: np.uint8,
+    DT_INT16: np.int16,
+    DT_INT8: np.int8,
+    DT_INT64: np.int64,
+    DT_BOOL: np.bool_,
+    DT_HALF: np.float16,
+}
+
+
+def parse_event(record):
+    wall_time = 0.0
+    step = 0
+    summary_values = []
+    for field_number, wire_type, value in __iterate_fields(record):
+        if field_number == EVENT_WALL_TIME and wire_type == WIRETYPE_FIXED64:
+            wall_time = struct.unpack('<d', value)[0]
+        elif field_number == EVENT_STEP and wire_type == WIRETYPE_VARINT:
+            step = __to_int64(value)
+        elif field_number == EVENT_SUMMARY and wire_type == WIRETYPE_LENGTH_DELIMITED:
+            for summary_field_number, _, summary_value in __iterate_fields(value):
+                if summary_field_number == SUMMARY_VALUE:
+                    summary_values.append(__parse_summary_value(summary_value))
+    return Event(wall_time, step, summary_values)
+
+
+def __parse_summary_value(data):
+    tag = ''
+    plugin_name = ''
+    simple_value = None
+    tensor = None
+    for field_number, wire_type, value in __iterate_fields(data):
+        if field_number == VALUE_TAG:
+            tag = bytes(value).decode('utf-8')
+        elif field_number == VALUE_SIMPLE_VALUE and wire_type == WIRETYPE_FIXED32:
+            simple_value = struct.unpack('<f', value)[0]
+        elif field_number == VALUE_TENSOR:
+            tensor = __parse_tensor(value)
+        elif field_number == VALUE_METADATA:
+            for metadata_field_number, _, metadata_value in __iterate_fields(value):
+                if metadata_field_number == METADATA_PLUGIN_DATA:
+                    for plugin_data_field_number, _, plugin_data_value in __iterate_fields(metadata_value):
+                        if plugin_data_field_number == PLUGIN_DATA_PLUGIN_NAME:
+                            plugin_name = bytes(plugin_data_value).decode('utf-8')
+    return SummaryValue(tag, plugin_name, simple_value, tensor)
+
+
+def __parse_tensor(data):
+    dtype = 0
+    shape = []
+    tensor_content = b''
+    values = []
+    for field_number, wire_type, value in __iterate_fields(data):
+        if field_number == TENSOR_DTYPE:
+            dtype = value
+        elif field_number == TENSOR_SHAPE:
+            for shape_field_number, _, dim in __iterate_fields(value):
+                if shape_field_number == SHAPE_DIM:
+                    size = 0
+                    for dim_field_number, _, dim_value in __iterate_fields(dim):
+                        if dim_field_number == DIM_SIZE:
+                            size = __to_int64(dim_value)
+                    shape.append(size)
+        elif field_number == TENSOR_CONTENT:
+            tensor_content = bytes(value)
+        elif field_number == TENSOR_STRING_VAL:
+            values.append(bytes(value))
+        elif field_number == TENSOR_FLOAT_VAL:
+            values.extend(__unpack_repeated(value, wire_type, '<f', 4))
+        elif field_number == TENSOR_DOUBLE_VAL:
+            values.extend(__unpack_repeated(value, wire_type, '<d', 8))
+        elif field_number in (TENSOR_INT_VAL, TENSOR_INT64_VAL, TENSOR_BOOL_VAL, TENSOR_HALF_VAL):
+            if wire_type == WIRETYPE_LENGTH_DELIMITED:
+                values.extend(__unpack_varints(value))
+            else:
+                values.append(__to_int64(value))
+    return Tensor(dtype, shape, tensor_content, values)
+
+
+def __unpack_repeated(value, wire_type, fmt, size):
+    if wire_type == WIRETYPE_LENGTH_DELIMITED:
+        # Packed
+        return [v[0] for v in struct.iter_unpack(fmt, value)]
+    return [struct.unpack(fmt, value)[0]]
+
+
+# make_ndarray is the equivalent of tf.make_ndarray for the dtypes that appear in summaries.
+def make_ndarray(tensor):
+    shape = tuple(tensor.shape)
+    count = int(np.prod(shape)) if len(shape) > 0 else 1
+    if tensor.dtype == DT_STRING:
+        values = list(tensor.values)
+        if len(values) == 1 and count > 1:
+            values = values * count
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array.reshape(shape)
+    if tensor.dtype not in DICT_DTYPE_TO_NUMPY:
+        raise TypeError('Unsupported tensor dtype %d.' % tensor.dtype)
+    numpy_dtype = DICT_DTYPE_TO_NUMPY[tensor.dtype]
+    if len(tensor.tensor_content) > 0:
+        return np.frombuffer(tensor.tensor_content, dtype=numpy_dtype).copy().reshape(shape)
+    if tensor.dtype == DT_HALF:
+        # half_val holds the bits of each value.
+        array = np.array(tensor.values, dtype=np.uint16).view(np.float16)
+    else:
+        array = np.array(tensor.values, dtype=numpy_dtype)
+    if len(array) == count:
+        return array.reshape(shape)
+    # As in tf.make_ndarray, the last value is repeated to fill the tensor.
+    if len(array) == 0:
+        return np.zeros(shape, dtype=numpy_dtype)
+    return np.concatenate([array, np.repeat(array[-1:], count - len(array))]).reshape(shape)
+
+
+def read_events(filename):
+    with open(filename, 'rb') as f:
+        records, _, _ = split_records(f.read())
+    return [parse_event(record) for record in records]
+
+
+def __compare_with_tensorflow(filename):
+    import tensorflow as tf
+    from tensorflow.core.util import event_pb2
+    events = read_events(filename)
+    tf_records = [record.numpy() for record in tf.data.TFRecordDataset(filename)]
+    if len(events) != len(tf_records):
+        print('Record count differs: %d != %d' % (len(events), len(tf_records)))
+        return False
+    mismatch_count = 0
+    value_count = 0
+    for event, record in zip(events, tf_records):
+        tf_event = event_pb2.Event.FromString(record)
+        if event.step != tf_event.step or len(event.summary_values) != len(tf_event.summary.value):
+            print('Event differs at step %d' % tf_event.step)
+            mismatch_count += 1
+            continue
+        for value, tf_value in zip(event.summary_values, tf_event.summary.value):
+            value_count += 1
+            if (value.tag != tf_value.tag or
+                    value.plugin_name != tf_value.metadata.plugin_data.plugin_name):
+                print('Value differs at step %d tag %s' % (tf_event.step, tf_value.tag))
+                mismatch_count += 1
+                continue
+            if not tf_value.HasField('tensor'):
+                continue
+            array = make_ndarray(value.tensor)
+            tf_array = tf.make_ndarray(tf_value.tensor)
+            if array.shape != tf_array.shape or not np.array_equal(array, tf_array):
+                print('Tensor differs at step %d tag %s' % (tf_event.step, tf_value.tag))
+                mismatch_count += 1
+    print('Compared %d events and %d values; %d mismatches.' % (len(events), value_count, mismatch_count))
+    return mismatch_count == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare this reader with tensorflow on event files.')
+    parser.add_argument('event_files', nargs='+')
+    args = parser.parse_args()
+    ok = True
+    for filename in args.event_files:
+        print(filename)
+        ok = __compare_with_tensorflow(filename) and ok
+    sys.exit(0 if ok else 1)
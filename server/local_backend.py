@@ -0,0 +1,632 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Runs actions in this process, without Cloud Storage, Datastore, or Cloud Functions.
+#
+# install replaces the action transport with a LocalExecutor, which runs each action on a thread
+# pool the same way that main.perform_action runs it in a cloud function: with a time limit, and
+# with retriggered actions going back into the pool. Interactive actions, which the action scheduler
+# never queues, are each run on their own thread, the way a new cloud function instance would start.
+# The scheduler's limits on running actions are lowered to fit in the pool, so the actions wait in
+# the scheduler's queue, in the scheduler's order, instead of in the pool. It also replaces the
+# Cloud Storage client with LocalStorageClient, which keeps blobs in a directory, and the Datastore
+# module used by storage.py with LocalDatastore, which keeps entities in memory.
+#
+# The cloud functions import the app engine modules as app_engine.X, but the app engine modules
+# import each other as X, so each module can be loaded twice. Importing this module makes both
+# names refer to the same module, so that the stand-ins are seen everywhere. That means this module
+# must be imported before any module that imports from app_engine.
+#
+# Usage:
+#   import local_backend
+#   executor = local_backend.install('/tmp/fmltc_blobs')
+#   ...trigger actions...
+#   executor.wait()
+
+# Python Standard Library
+import collections
+import copy
+from datetime import datetime, timedelta, timezone
+import http.server
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+import uuid
+
+# My Modules
+import app_engine
+import action
+import action_scheduler
+import storage
+import util
+
+
+# The same time limit that main.perform_action gives an action.
+ACTION_TIME_LIMIT_SECONDS = 500
+# How long a cloud function can run before it is killed.
+CLOUD_FUNCTION_TIMEOUT_SECONDS = 540
+
+
+def __share_app_engine_modules():
+    app_engine_dir = os.path.dirname(os.path.realpath(app_engine.__file__))
+    for name, module in list(sys.modules.items()):
+        if '.' in name or getattr(module, '__file__', None) is None:
+            continue
+        if os.path.dirname(os.path.realpath(module.__file__)) != app_engine_dir:
+            continue
+        qualified_name = 'app_engine.%s' % name
+        if qualified_name in sys.modules and sys.modules[qualified_name] is not module:
+            raise RuntimeError('local_backend must be imported before %s.' % qualified_name)
+        sys.modules[qualified_name] = module
+        setattr(app_engine, name, module)
+
+
+__share_app_engine_modules()
+
+
+# install returns the LocalExecutor that the actions are run on.
+def install(blob_root, max_workers=8, time_limit_seconds=ACTION_TIME_LIMIT_SECONDS):
+    local_storage_client = LocalStorageClient(blob_root)
+    util.storage_client = lambda: local_storage_client
+    storage.datastore = LocalDatastore()
+    # Scale the limits of the priority classes down so that together they fit in the pool.
+    total = sum(action_scheduler.MAX_RUNNING_ACTIONS.values())
+    if total > max_workers:
+        for priority, max_running_actions in action_scheduler.MAX_RUNNING_ACTIONS.items():
+            action_scheduler.MAX_RUNNING_ACTIONS[priority] = max(max_running_actions * max_workers // total, 1)
+    executor = LocalExecutor(max_workers, time_limit_seconds)
+    action.set_transport(executor.transport)
+    return executor
+
+
+# action executor
+
+class LocalExecutor:
+    def __init__(self, max_workers, time_limit_seconds):
+        self.time_limit_seconds = time_limit_seconds
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.stats = collections.OrderedDict()
+        # The threads are started here, instead of by concurrent.futures.ThreadPoolExecutor, so
+        # that an action that is still running when the program exits doesn't stop it from exiting.
+        self.queue = collections.deque()
+        for i in range(max_workers):
+            threading.Thread(target=self.__work, daemon=True).start()
+
+    # transport is given to action.set_transport.
+    def transport(self, action_parameters_blob_name, action_parameters_json):
+        action_name = json.loads(action_parameters_json)[action.ACTION_NAME]
+        with self.condition:
+            self.pending += 1
+            if action.get_priority(action_name) == action_scheduler.PRIORITY_INTERACTIVE:
+                threading.Thread(target=self.__work_on,
+                    args=(action_parameters_json, time.perf_counter()), daemon=True).start()
+            else:
+                self.queue.append((action_parameters_json, time.perf_counter()))
+                self.condition.notify_all()
+
+    # wait returns True when all the actions, including the actions that they triggered, have
+    # finished, or False if timeout seconds pass first.
+    def wait(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.pending == 0, timeout)
+
+    # get_stats returns a dict with the number of runs, retriggers, and seconds for each action
+    # name. wait_seconds is the time between the action being started by the scheduler and a
+    # thread running it.
+    def get_stats(self):
+        with self.condition:
+            return copy.deepcopy(self.stats)
+
+    def __work(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.queue) > 0)
+                action_parameters_json, transport_time = self.queue.popleft()
+            self.__work_on(action_parameters_json, transport_time)
+
+    def __work_on(self, action_parameters_json, transport_time):
+        try:
+            self.__run(json.loads(action_parameters_json), time.perf_counter() - transport_time)
+        except:
+            logging.critical('local_backend.LocalExecutor - exception!!! traceback: %s' %
+                traceback.format_exc().replace('\n', ' ... '))
+        finally:
+            with self.condition:
+                self.pending -= 1
+                self.condition.notify_all()
+
+    def __run(self, action_parameters, wait_seconds):
+        # Import cf_action here, so that it is imported after the app engine modules are shared.
+        import cf_action
+        action_name = action_parameters[action.ACTION_NAME]
+        start_time = datetime.now(timezone.utc)
+        time_limit = start_time + timedelta(seconds=self.time_limit_seconds)
+        cf_action.perform_action(action_parameters, time_limit)
+        end_time = datetime.now(timezone.utc)
+        # The cloud function would have been killed.
+        if end_time - start_time > timedelta(seconds=CLOUD_FUNCTION_TIMEOUT_SECONDS):
+            logging.warning('local_backend.LocalExecutor - %s - ran for %s, which is longer than a cloud function can run' %
+                (action_name, str(end_time - start_time)))
+        with self.condition:
+            if action_name not in self.stats:
+                self.stats[action_name] = {
+                    'runs': 0,
+                    'retriggers': 0,
+                    'seconds': 0,
+                    'wait_seconds': 0,
+                }
+            self.stats[action_name]['runs'] += 1
+            if action.ACTION_RETRIGGERED in action_parameters:
+                self.stats[action_name]['retriggers'] += 1
+            self.stats[action_name]['seconds'] += (end_time - start_time).total_seconds()
+            self.stats[action_name]['wait_seconds'] += wait_seconds
+
+
+# blob storage
+
+# LocalStorageClient stands in for google.cloud.storage.Client. Each bucket is a directory under
+# root. The generation, content type, and metadata of each blob are kept in a json file next to it.
+class LocalStorageClient:
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.upload_server = None
+
+    def bucket(self, bucket_name):
+        return LocalBucket(self, bucket_name)
+
+    def get_bucket(self, bucket_name):
+        return LocalBucket(self, bucket_name)
+
+    def list_blobs(self, bucket_name, prefix=''):
+        return self.bucket(bucket_name).list_blobs(prefix)
+
+    def get_upload_server(self):
+        with self.lock:
+            if self.upload_server is None:
+                self.upload_server = LocalUploadServer(self)
+            return self.upload_server
+
+
+class LocalBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.cors = []
+
+    def get_path(self, blob_name):
+        return os.path.join(self.client.root, self.name, blob_name)
+
+    def blob(self, blob_name, generation=None):
+        return LocalBlob(self, blob_name, generation)
+
+    def get_blob(self, blob_name):
+        blob = self.blob(blob_name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix=''):
+        bucket_path = os.path.join(self.client.root, self.name)
+        blobs = []
+        for dirpath, dirnames, filenames in os.walk(bucket_path):
+            for filename in filenames:
+                if filename.endswith(LocalBlob.INFO_SUFFIX):
+                    continue
+                blob_name = os.path.relpath(os.path.join(dirpath, filename), bucket_path).replace(os.sep, '/')
+                if blob_name.startswith(prefix):
+                    blob = self.get_blob(blob_name)
+                    if blob is not None:
+                        blobs.append(blob)
+        return sorted(blobs, key=lambda blob: blob.name)
+
+    def delete_blobs(self, blob_names, on_error=None):
+        for blob_name in blob_names:
+            blob = self.blob(blob_name)
+            if blob.exists():
+                blob.delete()
+            elif on_error is not None:
+                on_error(blob)
+
+    def update(self):
+        pass
+
+
+class LocalBlob:
+    INFO_SUFFIX = '.local_blob_info.json'
+
+    def __init__(self, bucket, name, generation=None):
+        self.bucket = bucket
+        self.name = name
+        self.path = bucket.get_path(name)
+        self.info_path = self.path + LocalBlob.INFO_SUFFIX
+        # Like google.cloud.storage.Blob, the properties are only set by reload or get_blob.
+        self.generation = generation
+        self.size = None
+        self.updated = None
+        self.content_type = None
+        self.metadata = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def reload(self):
+        with open(self.info_path) as f:
+            info = json.load(f)
+        self.generation = info['generation']
+        self.content_type = info['content_type']
+        self.metadata = info['metadata']
+        self.size = os.path.getsize(self.path)
+        self.updated = datetime.fromtimestamp(os.path.getmtime(self.path), timezone.utc)
+
+    def upload_from_string(self, data, content_type='text/plain'):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.__write(data, content_type)
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, 'rb') as f:
+            self.__write(f.read(), content_type)
+
+    def __write(self, data, content_type):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write to a temporary file and rename it, so that readers never see a partial blob.
+        temp_path = '%s.%s.tmp' % (self.path, uuid.uuid4().hex)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        temp_info_path = '%s.%s.tmp' % (self.info_path, uuid.uuid4().hex)
+        with open(temp_info_path, 'w') as f:
+            json.dump({
+                'generation': time.time_ns(),
+                'content_type': content_type,
+                'metadata': self.metadata,
+            }, f)
+        os.replace(temp_path, self.path)
+        os.replace(temp_info_path, self.info_path)
+
+    def __check_exists(self):
+        if not self.exists():
+            raise FileNotFoundError('Blob %s not found in bucket %s.' % (self.name, self.bucket.name))
+
+    def download_as_bytes(self, start=None, end=None):
+        self.__check_exists()
+        with open(self.path, 'rb') as f:
+            if start is None:
+                return f.read()
+            f.seek(start)
+            if end is None:
+                return f.read()
+            return f.read(end - start + 1)
+
+    def download_as_string(self, start=None, end=None):
+        return self.download_as_bytes(start=start, end=end)
+
+    def download_to_filename(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.download_as_bytes())
+
+    def delete(self):
+        self.__check_exists()
+        os.remove(self.path)
+        if os.path.exists(self.info_path):
+            os.remove(self.info_path)
+
+    def generate_signed_url(self, expiration, method='GET', content_type=None):
+        return 'file://%s' % urllib.parse.quote(os.path.abspath(self.path))
+
+    def create_resumable_upload_session(self, content_type=None):
+        return self.bucket.client.get_upload_server().create_session(self, content_type)
+
+
+# LocalUploadServer is a local http server that speaks enough of the resumable upload protocol for
+# blob_storage.ResumableUploadStream.
+class LocalUploadServer:
+    def __init__(self, client):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_PUT(self):
+                data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status, headers = server.put_chunk(self.path.lstrip('/'), data, self.headers.get('Content-Range', ''))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    def create_session(self, blob, content_type):
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[session_id] = {
+                'blob': blob,
+                'content_type': content_type,
+                'data': bytearray(),
+            }
+        return 'http://127.0.0.1:%d/%s' % (self.http_server.server_address[1], session_id)
+
+    def put_chunk(self, session_id, data, content_range):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return 404, {}
+            m = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)', content_range)
+            if m is None:
+                return 400, {}
+            if m.group(1) is not None:
+                if int(m.group(1)) != len(session['data']):
+                    return 400, {}
+                session['data'].extend(data)
+            if m.group(3) == '*' or int(m.group(3)) != len(session['data']):
+                if len(session['data']) == 0:
+                    return 308, {}
+                return 308, {'Range': 'bytes=0-%d' % (len(session['data']) - 1)}
+            del self.sessions[session_id]
+        session['blob'].upload_from_string(bytes(session['data']), content_type=session['content_type'])
+        return 200, {}
+
+
+# datastore
+
+# LocalDatastore stands in for the google.cloud.datastore module. Transactions hold a lock for their
+# whole duration, so they are serialized. Like Datastore, a query only finds an entity if it has
+# the properties that are filtered or sorted on and they are not excluded from indexes.
+class LocalDatastore:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entities = {}
+        self.ids = itertools.count(1)
+        self.Entity = LocalEntity
+        self.Key = LocalKey
+
+    def Client(self, *args, **kwargs):
+        return LocalDatastoreClient(self)
+
+    def complete_key(self, key):
+        if key.is_partial:
+            return key.completed_key(next(self.ids))
+        return key
+
+    def get(self, key):
+        with self.lock:
+            stored = self.entities.get(key)
+            if stored is None:
+                return None
+            return stored.copy()
+
+    def apply(self, mutations):
+        with self.lock:
+            for entity_or_key in mutations:
+                if isinstance(entity_or_key, LocalKey):
+                    self.entities.pop(entity_or_key, None)
+                else:
+                    entity = entity_or_key
+                    entity.key = self.complete_key(entity.key)
+                    self.entities[entity.key] = entity.copy()
+
+    def snapshot(self, kind):
+        with self.lock:
+            return [entity.copy() for key, entity in self.entities.items() if key.kind == kind]
+
+
+class LocalKey:
+    def __init__(self, kind, id_or_name=None):
+        self.kind = kind
+        self.id = id_or_name if isinstance(id_or_name, int) else None
+        self.name = id_or_name if isinstance(id_or_name, str) else None
+
+    @property
+    def id_or_name(self):
+        return self.id if self.id is not None else self.name
+
+    @property
+    def is_partial(self):
+        return self.id_or_name is None
+
+    def completed_key(self, id_or_name):
+        return LocalKey(self.kind, id_or_name)
+
+    def __eq__(self, other):
+        return isinstance(other, LocalKey) and (self.kind, self.id_or_name) == (other.kind, other.id_or_name)
+
+    def __hash__(self):
+        return hash((self.kind, self.id_or_name))
+
+    def __repr__(self):
+        return '<Key %s %s>' % (self.kind, self.id_or_name)
+
+
+class LocalEntity(dict):
+    def __init__(self, key=None, exclude_from_indexes=()):
+        dict.__init__(self)
+        self.key = key
+        self.exclude_from_indexes = set(exclude_from_indexes)
+
+    @property
+    def kind(self):
+        return self.key.kind if self.key is not None else None
+
+    def copy(self):
+        entity = LocalEntity(key=self.key, exclude_from_indexes=self.exclude_from_indexes)
+        entity.update(copy.deepcopy(dict(self)))
+        return entity
+
+
+class LocalDatastoreClient:
+    def __init__(self, local_datastore):
+        self.local_datastore = local_datastore
+
+    def key(self, kind, id_or_name=None):
+        return LocalKey(kind, id_or_name)
+
+    def get(self, key, transaction=None):
+        return self.local_datastore.get(key)
+
+    def get_multi(self, keys, transaction=None):
+        entities = [self.local_datastore.get(key) for key in keys]
+        return [entity for entity in entities if entity is not None]
+
+    def put(self, entity):
+        self.local_datastore.apply([entity])
+
+    def put_multi(self, entities):
+        self.local_datastore.apply(list(entities))
+
+    def delete(self, key):
+        self.local_datastore.apply([key])
+
+    def delete_multi(self, keys):
+        self.local_datastore.apply(list(keys))
+
+    def query(self, kind=None):
+        return LocalQuery(self.local_datastore, kind)
+
+    def transaction(self):
+        return LocalTransaction(self.local_datastore)
+
+    def batch(self):
+        return LocalBatch(self.local_datastore)
+
+
+class LocalBatch:
+    def __init__(self, local_datastore):
+        self.local_datastore = local_datastore
+        self.mutations = []
+
+    def begin(self):
+        self.mutations = []
+
+    def put(self, entity):
+        self.mutations.append(entity)
+
+    def delete(self, key):
+        self.mutations.append(key)
+
+    def commit(self):
+        self.local_datastore.apply(self.mutations)
+        self.mutations = []
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+
+
+class LocalTransaction(LocalBatch):
+    def __enter__(self):
+        self.local_datastore.lock.acquire()
+        return LocalBatch.__enter__(self)
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            return LocalBatch.__exit__(self, exc_type, exc_value, exc_traceback)
+        finally:
+            self.local_datastore.lock.release()
+
+
+class LocalQuery:
+    def __init__(self, local_datastore, kind):
+        self.local_datastore = local_datastore
+        self.kind = kind
+        self.filters = []
+        self.order = []
+        self.projection = []
+
+    # The order of values of different types, as in Datastore.
+    @staticmethod
+    def __value_sort_key(value):
+        if value is None:
+            return (0, 0)
+        if isinstance(value, bool):
+            return (3, value)
+        if isinstance(value, (int, float)):
+            return (1, value)
+        if isinstance(value, datetime):
+            return (2, value.timestamp())
+        if isinstance(value, bytes):
+            return (4, value)
+        if isinstance(value, str):
+            return (5, value)
+        return (6, repr(value))
+
+    @staticmethod
+    def __matches(entity_value, op, value):
+        # A filter on a list property matches if any of the values in the list matches.
+        if isinstance(entity_value, list):
+            return any(LocalQuery.__matches(v, op, value) for v in entity_value)
+        a = LocalQuery.__value_sort_key(entity_value)
+        b = LocalQuery.__value_sort_key(value)
+        if op == '=':
+            return a == b
+        if op == '<':
+            return a < b
+        if op == '<=':
+            return a <= b
+        if op == '>':
+            return a > b
+        if op == '>=':
+            return a >= b
+        if op == '!=':
+            return a != b
+        raise ValueError('Unsupported filter operator %s' % op)
+
+    def add_filter(self, property_name, operator, value):
+        self.filters.append((property_name, operator, value))
+        return self
+
+    def keys_only(self):
+        self.projection = ['__key__']
+
+    def __is_indexed(self, entity, property_name):
+        return property_name in entity and property_name not in entity.exclude_from_indexes
+
+    def fetch(self, limit=None):
+        entities = []
+        for entity in self.local_datastore.snapshot(self.kind):
+            property_names = [f[0] for f in self.filters] + [o.lstrip('-') for o in self.order]
+            if not all(self.__is_indexed(entity, property_name) for property_name in property_names):
+                continue
+            if all(LocalQuery.__matches(entity[property_name], op, value) for property_name, op, value in self.filters):
+                entities.append(entity)
+        # Sort by the last order first, so that the earlier orders take precedence.
+        entities.sort(key=lambda entity: LocalQuery.__value_sort_key(entity.key.id_or_name))
+        for o in reversed(self.order):
+            property_name = o.lstrip('-')
+            entities.sort(key=lambda entity: LocalQuery.__value_sort_key(entity[property_name]),
+                reverse=o.startswith('-'))
+        if limit is not None:
+            entities = entities[:limit]
+        return iter(entities)
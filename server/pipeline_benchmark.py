@@ -0,0 +1,229 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# End to end throughput benchmark of frame extraction, dataset production, and dataset zipping.
+#
+# The actions are run in this process by local_backend, with blobs in a temporary directory and
+# entities in memory, so no cloud project is needed. The videos are generated moving-rectangle
+# videos, labeled with their ground truth boxes. The report has the time taken by each stage and
+# the number of runs, retriggers, and seconds of each action.
+#
+# Usage, from the server directory:
+#   python pipeline_benchmark.py --output pipeline_benchmark.json
+#   python pipeline_benchmark.py --videos 4 --frame_count 300 --workers 16
+
+# Python Standard Library
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import urllib.parse
+
+# Other Modules
+import cv2
+
+# My Modules
+# local_backend must be imported before the modules that import from app_engine.
+import local_backend
+from app_engine import action
+from app_engine import blob_storage
+from app_engine import dataset_producer
+from app_engine import dataset_zipper
+from app_engine import frame_extractor
+from app_engine import storage
+from app_engine import util
+import tracker_benchmark
+
+
+RESOLUTIONS = tracker_benchmark.RESOLUTIONS
+FPS = 30
+
+
+def __write_video(filename, frames):
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'mp4v'), FPS, (width, height))
+    try:
+        for frame in frames:
+            writer.write(frame)
+    finally:
+        writer.release()
+
+
+def __upload_video(team_uuid, video_filename):
+    video_uuid, upload_url = storage.prepare_to_upload_video(team_uuid, 'video/mp4')
+    video_blob_name = blob_storage.get_video_blob_name(team_uuid, video_uuid)
+    blob = util.storage_client().bucket(blob_storage.BUCKET_BLOBS).blob(video_blob_name)
+    blob.upload_from_filename(video_filename, content_type='video/mp4')
+    # This is what cf_video_upload.wait_for_video_upload does when it finds the video blob.
+    create_time_ms = util.ms_from_datetime(datetime.now(timezone.utc))
+    video_entity = storage.create_video_entity(team_uuid, video_uuid, 'benchmark',
+        os.path.basename(video_filename), os.path.getsize(video_filename), 'video/mp4', create_time_ms)
+    storage.prepare_to_start_frame_extraction(team_uuid, video_uuid)
+    return video_entity
+
+
+def __run_stage(executor, stage_name, timeout):
+    start = time.perf_counter()
+    if not executor.wait(timeout):
+        raise RuntimeError('The %s stage did not finish within %d seconds.' % (stage_name, timeout))
+    seconds = time.perf_counter() - start
+    logging.info('%s took %.2f seconds' % (stage_name, seconds))
+    return seconds
+
+
+def __run_extraction(executor, team_uuid, video_filenames, timeout):
+    video_entities = [__upload_video(team_uuid, video_filename) for video_filename in video_filenames]
+    for video_entity in video_entities:
+        frame_extractor.start_frame_extraction(video_entity)
+    seconds = __run_stage(executor, 'extraction', timeout)
+    frame_count = 0
+    for video_entity in video_entities:
+        video_entity = storage.retrieve_video_entity(team_uuid, video_entity['video_uuid'])
+        if video_entity['frame_extraction_failed']:
+            raise RuntimeError('Frame extraction failed: %s' % video_entity['frame_extraction_error_message'])
+        frame_count += video_entity['extracted_frame_count']
+    result = {
+        'seconds': round(seconds, 3),
+        'frame_count': frame_count,
+        'frames_per_second': round(frame_count / seconds, 2),
+    }
+    return [video_entity['video_uuid'] for video_entity in video_entities], result
+
+
+def __run_dataset_production(executor, team_uuid, video_uuids, eval_percent, timeout):
+    create_time_ms = util.ms_from_datetime(datetime.now(timezone.utc))
+    dataset_uuid = dataset_producer.prepare_to_start_dataset_production(
+        team_uuid, 'benchmark', video_uuids, eval_percent, create_time_ms)
+    action.trigger_action_via_blob(dataset_producer.make_action_parameters(
+        team_uuid, dataset_uuid, video_uuids, eval_percent, create_time_ms))
+    seconds = __run_stage(executor, 'dataset', timeout)
+    dataset_entity = storage.retrieve_dataset_entity(team_uuid, dataset_uuid)
+    if not dataset_entity['dataset_completed']:
+        raise RuntimeError('The dataset was not completed.')
+    frame_count = dataset_entity['train_frame_count'] + dataset_entity['eval_frame_count']
+    result = {
+        'seconds': round(seconds, 3),
+        'frame_count': frame_count,
+        'record_count': dataset_entity['total_record_count'],
+        'frames_per_second': round(frame_count / seconds, 2),
+    }
+    return dataset_uuid, result
+
+
+def __run_dataset_zipping(executor, team_uuid, dataset_uuid, timeout):
+    dataset_zip_uuid, partition_count, created = dataset_zipper.prepare_to_zip_dataset(team_uuid, dataset_uuid)
+    action.trigger_action_via_blob(dataset_zipper.make_action_parameters(
+        team_uuid, dataset_uuid, dataset_zip_uuid, partition_count))
+    seconds = __run_stage(executor, 'zip', timeout)
+    exists_array, download_url_array = blob_storage.get_dataset_zip_download_url(
+        team_uuid, dataset_zip_uuid, partition_count)
+    zip_bytes = 0
+    for partition_index in range(partition_count):
+        if not exists_array[partition_index]:
+            raise RuntimeError('Zip partition %d was not written.' % partition_index)
+        # local_backend's download urls are file urls.
+        zip_bytes += os.path.getsize(urllib.parse.unquote(urllib.parse.urlparse(download_url_array[partition_index]).path))
+    return {
+        'seconds': round(seconds, 3),
+        'partition_count': partition_count,
+        'zip_bytes': zip_bytes,
+        'megabytes_per_second': round(zip_bytes / (1024 * 1024) / seconds, 2),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark frame extraction, dataset production, and dataset zipping locally.')
+    parser.add_argument('--videos', type=int, default=2,
+        help='Number of generated videos.')
+    parser.add_argument('--resolution', default='720p',
+        help='Resolution of the generated videos. Choose from %s.' % ', '.join(RESOLUTIONS))
+    parser.add_argument('--frame_count', type=int, default=150,
+        help='Number of frames in each generated video.')
+    parser.add_argument('--box_count', type=int, default=3,
+        help='Number of labeled boxes in each frame.')
+    parser.add_argument('--eval_percent', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=8,
+        help='Number of actions that can run at the same time.')
+    parser.add_argument('--timeout', type=int, default=3600,
+        help='Seconds to wait for each stage.')
+    parser.add_argument('--blob_root',
+        help='Directory to keep the blobs in. Default: a temporary directory that is deleted afterwards.')
+    parser.add_argument('--output',
+        help='File to write the JSON results to. Default: standard output.')
+    args = parser.parse_args(argv)
+    if args.resolution not in RESOLUTIONS:
+        parser.error('Unknown resolution %s. Choose from %s.' % (args.resolution, ', '.join(RESOLUTIONS)))
+
+    blob_root = args.blob_root or tempfile.mkdtemp(prefix='fmltc_blobs_')
+    try:
+        executor = local_backend.install(blob_root, max_workers=args.workers)
+        width, height = RESOLUTIONS[args.resolution]
+        video_filenames = []
+        list_of_bboxes_texts = []
+        for seed in range(args.videos):
+            frames, bboxes_texts = tracker_benchmark.generate_synthetic_video(
+                width, height, args.frame_count, args.box_count, seed)
+            video_filename = os.path.join(blob_root, 'benchmark_video_%d.mp4' % seed)
+            __write_video(video_filename, frames)
+            video_filenames.append(video_filename)
+            list_of_bboxes_texts.append(bboxes_texts)
+
+        report = {}
+        team_uuid = storage.retrieve_team_uuid('FTC', 'benchmark')
+        video_uuids, report['extraction'] = __run_extraction(executor, team_uuid, video_filenames, args.timeout)
+
+        # Label the frames, as a user would on the label video page.
+        for video_uuid, bboxes_texts in zip(video_uuids, list_of_bboxes_texts):
+            video_entity = storage.retrieve_video_entity(team_uuid, video_uuid)
+            for frame_number in range(video_entity['extracted_frame_count']):
+                storage.store_video_frame_bboxes_text(team_uuid, video_uuid, frame_number, bboxes_texts[frame_number])
+
+        dataset_uuid, report['dataset'] = __run_dataset_production(
+            executor, team_uuid, video_uuids, args.eval_percent, args.timeout)
+        report['zip'] = __run_dataset_zipping(executor, team_uuid, dataset_uuid, args.timeout)
+    finally:
+        if args.blob_root is None:
+            shutil.rmtree(blob_root, ignore_errors=True)
+
+    report.update({
+        'videos': args.videos,
+        'resolution': args.resolution,
+        'frames_per_video': args.frame_count,
+        'workers': args.workers,
+        'actions': executor.get_stats(),
+        'opencv_version': cv2.__version__,
+        'python_version': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    })
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    main(sys.argv[1:])
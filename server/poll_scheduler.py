@@ -0,0 +1,93 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Decides how long monitor_training waits between polls.
+#
+# When a poll finds nothing new, the interval grows, up to MAX_INTERVAL_SECONDS. When a poll finds
+# something new, the interval goes back to BASE_INTERVAL_SECONDS. If the training step rate is known,
+# the wait is shortened so that the poll after the next checkpoint happens soon after the checkpoint
+# is expected to be written.
+#
+# The state is a dict of plain values so that it can be stored in the action parameters and
+# survive when the action is retriggered.
+
+
+MIN_INTERVAL_SECONDS = 10
+BASE_INTERVAL_SECONDS = 30
+MAX_INTERVAL_SECONDS = 180
+BACKOFF_FACTOR = 1.5
+
+# How long after the expected checkpoint time to poll, to give the checkpoint and the event files
+# time to be written.
+CHECKPOINT_SLACK_SECONDS = 15
+
+# The step rate is measured over at most this many seconds.
+STEP_RATE_WINDOW_SECONDS = 600
+
+
+def create_state():
+    return {
+        'interval': BASE_INTERVAL_SECONDS,
+        'step_samples': [],
+    }
+
+
+def __observe_steps(state, now, trained_steps):
+    samples = state['step_samples']
+    if len(samples) == 0 or samples[-1][1] != trained_steps:
+        samples.append([now, trained_steps])
+    while len(samples) > 2 and now - samples[0][0] > STEP_RATE_WINDOW_SECONDS:
+        samples.pop(0)
+
+
+def __step_rate(state):
+    samples = state['step_samples']
+    if len(samples) < 2:
+        return None
+    elapsed = samples[-1][0] - samples[0][0]
+    steps = samples[-1][1] - samples[0][1]
+    if elapsed <= 0 or steps <= 0:
+        return None
+    return steps / elapsed
+
+
+# mark_changed records that something new was found, for when the action is retriggered before
+# seconds_until_next_poll is called.
+def mark_changed(state):
+    state['changed'] = True
+
+
+# seconds_until_next_poll updates state and returns how many seconds to wait. now is a time in
+# seconds, changed is whether the poll that just finished found anything new, and trained_steps and
+# checkpoint_every_n come from the model entity.
+def seconds_until_next_poll(state, now, changed, trained_steps, checkpoint_every_n, training_done):
+    if changed or state.pop('changed', False):
+        state['interval'] = BASE_INTERVAL_SECONDS
+    else:
+        state['interval'] = min(state['interval'] * BACKOFF_FACTOR, MAX_INTERVAL_SECONDS)
+    interval = state['interval']
+    if training_done:
+        return interval
+
+    __observe_steps(state, now, trained_steps)
+    step_rate = __step_rate(state)
+    if step_rate is not None and checkpoint_every_n > 0:
+        # The step written in the event file lags behind the real step, so estimate the real step.
+        estimated_steps = trained_steps + step_rate * (now - state['step_samples'][-1][0])
+        next_checkpoint_step = (int(estimated_steps) // checkpoint_every_n + 1) * checkpoint_every_n
+        seconds_until_checkpoint = (next_checkpoint_step - estimated_steps) / step_rate
+        interval = min(interval, seconds_until_checkpoint + CHECKPOINT_SLACK_SECONDS)
+    return max(interval, MIN_INTERVAL_SECONDS)
@@ -51,6 +51,12 @@ fmltc.Admin = function() {
   this.saveEndOfSeasonEntitiesActionUuid = document.getElementById('saveEndOfSeasonEntitiesActionUuid');
   this.saveEndOfSeasonEntitiesButton.onclick = this.saveEndOfSeasonEntitiesButton_onclick.bind(this);
 
+  this.deleteStaleActionsButton = document.getElementById('deleteStaleActionsButton');
+  this.deleteStaleActionsResponse = document.getElementById('deleteStaleActionsResponse');
+  this.deleteStaleActionsMonitorInfo = document.getElementById('deleteStaleActionsMonitorInfo');
+  this.deleteStaleActionsActionUuid = document.getElementById('deleteStaleActionsActionUuid');
+  this.deleteStaleActionsButton.onclick = this.deleteStaleActionsButton_onclick.bind(this);
+
   this.resetTeamEntitiesButton = document.getElementById('resetTeamEntitiesButton');
   this.resetTeamEntitiesResponse = document.getElementById('resetTeamEntitiesResponse');
   this.resetTeamEntitiesMonitorInfo = document.getElementById('resetTeamEntitiesMonitorInfo');
@@ -92,6 +98,8 @@ fmltc.Admin.prototype.enableInputsAndButtons = function(enable) {
   this.seasonInput.disabled = !enable;
   this.saveEndOfSeasonEntitiesButton.disabled = !enable;
 
+  this.deleteStaleActionsButton.disabled = !enable;
+
   this.resetTeamEntitiesButton.disabled = !enable;
 
   this.refreshConfigButton.disables = !enable;
@@ -186,6 +194,32 @@ fmltc.Admin.prototype.xhr_saveEndOfSeasonEntities_onreadystatechange = function(
   }
 };
 
+fmltc.Admin.prototype.deleteStaleActionsButton_onclick = function() {
+  this.enableInputsAndButtons(false);
+
+  const xhr = new XMLHttpRequest();
+  const params = 'date_time_string=' + encodeURIComponent(new Date().toLocaleString());
+  xhr.open('POST', '/deleteStaleActions', true);
+  xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+  xhr.onreadystatechange = this.xhr_deleteStaleActions_onreadystatechange.bind(this, xhr, params);
+  xhr.send(params);
+};
+
+fmltc.Admin.prototype.xhr_deleteStaleActions_onreadystatechange = function(xhr, params) {
+  if (xhr.readyState === 4) {
+    xhr.onreadystatechange = null;
+
+    if (xhr.status === 200) {
+      const response = JSON.parse(xhr.responseText);
+      this.deleteStaleActionsActionUuid.textContent = response.action_uuid;
+      this.deleteStaleActionsMonitorInfo.style.display = 'block';
+
+    } else {
+      this.deleteStaleActionsResponse.textContent = 'Failure - status: ' + xhr.status + ', statusText: ' + xhr.status;
+    }
+  }
+};
+
 fmltc.Admin.prototype.resetTeamEntitiesButton_onclick = function() {
   this.confirmationTitle.textContent = 'Reset Team Entities';
   this.confirmationAreYouSure.textContent = 'Are you sure you want to reset all team entities?';
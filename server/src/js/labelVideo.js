@@ -73,6 +73,10 @@ fmltc.LabelVideo = function(util, videoEntity, videoFrameEntity0) {
   this.trackingContinueButton = document.getElementById('trackingContinueButton');
   this.trackingStopButton = document.getElementById('trackingStopButton');
   this.trackingMessageDiv = document.getElementById('trackingMessageDiv');
+  this.prelabelingModelSelect = document.getElementById('prelabelingModelSelect');
+  this.prelabelingConfidenceInput = document.getElementById('prelabelingConfidenceInput');
+  this.prelabelingStartButton = document.getElementById('prelabelingStartButton');
+  this.prelabelingMessageDiv = document.getElementById('prelabelingMessageDiv');
 
   this.bboxColors = [
       '#F08080', // LightCoral
@@ -140,6 +144,8 @@ fmltc.LabelVideo = function(util, videoEntity, videoFrameEntity0) {
   this.trackerUuid = '';
   this.trackingRequestSentTime = 0;
 
+  this.prelabelingInProgress = false;
+
   this.updateUI(true);
   this.setVideoEntity(videoEntity);
   this.videoFrameEntityLoaded(videoFrameEntity0, 0);
@@ -232,6 +238,15 @@ fmltc.LabelVideo.prototype.setVideoEntity = function(videoEntity) {
   this.trackingPauseButton.onclick = this.trackingPauseButton_onclick.bind(this);
   this.trackingContinueButton.onclick = this.trackingContinueButton_onclick.bind(this);
   this.trackingStopButton.onclick = this.trackingStopButton_onclick.bind(this);
+  this.prelabelingConfidenceInput.onchange = this.prelabelingConfidenceInput_onchange.bind(this);
+  this.prelabelingStartButton.onclick = this.prelabelingStartButton_onclick.bind(this);
+
+  this.prelabelingInProgress = this.videoEntity.prelabeling_in_progress;
+  if (this.prelabelingInProgress) {
+    this.prelabelingMessageDiv.textContent = 'Prelabeling is in progress.';
+    setTimeout(this.retrievePrelabelingStatus.bind(this), 10 * 1000);
+  }
+  this.retrieveModelEntities();
 
   this.updateUI(true);
 };
@@ -325,6 +340,11 @@ fmltc.LabelVideo.prototype.redrawBboxes = function(updateCanvasPosition) {
 };
 
 fmltc.LabelVideo.prototype.updateUI = function(setTrackingMessageDivText) {
+  this.prelabelingStartButton.disabled = (
+      this.prelabelingInProgress ||
+      this.trackingInProgress ||
+      this.prelabelingModelSelect.options.length == 0);
+
   if (!this.videoEntity ||
       this.bboxes[this.currentFrameNumber] == undefined) {
     this.firstFrameButton.disabled = true;
@@ -1364,7 +1384,7 @@ fmltc.LabelVideo.prototype.retrieveTrackedBboxes = function(frameNumber, failure
       'video_uuid=' + encodeURIComponent(this.videoUuid) +
       '&tracker_uuid=' + encodeURIComponent(this.trackerUuid) +
       '&retrieve_frame_number=' + encodeURIComponent(frameNumber);
-  xhr.open('POST', '/retrieveTrackedBboxes', true);
+  xhr.open('POST', '/waitForTrackedBboxes', true);
   xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
   xhr.onreadystatechange = this.xhr_retrieveTrackedBboxes_onreadystatechange.bind(this, xhr, params,
       frameNumber, failureCount);
@@ -1416,8 +1436,8 @@ fmltc.LabelVideo.prototype.xhr_retrieveTrackedBboxes_onreadystatechange = functi
         }
 
       } else {
-        // The tracked bboxes are not ready yet. Try again in a moment.
-        setTimeout(this.retrieveTrackedBboxes.bind(this, frameNumber, 0), 100);
+        // The tracked bboxes are not ready yet. The server has already waited, so try again now.
+        this.retrieveTrackedBboxes(frameNumber, 0);
       }
 
     } else {
@@ -1463,14 +1483,16 @@ fmltc.LabelVideo.prototype.sendContinueTracking = function(failureCount) {
       '&tracker_uuid=' + encodeURIComponent(this.trackerUuid) +
       '&frame_number=' + encodeURIComponent(this.currentFrameNumber) +
       '&bboxes_text=' + encodeURIComponent(this.videoFrameEntity[this.currentFrameNumber].bboxes_text);
-  xhr.open('POST', '/continueTracking', true);
-  xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
   if (this.currentFrameNumber < this.trackingFinalFrameNumber) {
     const retrieveFrameNumber = this.currentFrameNumber + 1;
     params += '&retrieve_frame_number=' + encodeURIComponent(retrieveFrameNumber);
+    xhr.open('POST', '/waitForTrackedBboxes', true);
+    xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
     xhr.onreadystatechange = this.xhr_retrieveTrackedBboxes_onreadystatechange.bind(this, xhr, params,
         retrieveFrameNumber, 0);
   } else {
+    xhr.open('POST', '/continueTracking', true);
+    xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
     xhr.onreadystatechange = this.xhr_continueTracking_onreadystatechange.bind(this, xhr, params,
         failureCount);
   }
@@ -1531,3 +1553,126 @@ fmltc.LabelVideo.prototype.xhr_stopTracking_onreadystatechange = function(xhr, p
     }
   }
 };
+
+fmltc.LabelVideo.prototype.retrieveModelEntities = function() {
+  const xhr = new XMLHttpRequest();
+  xhr.open('POST', '/retrieveModelEntities', true);
+  xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+  xhr.onreadystatechange = this.xhr_retrieveModelEntities_onreadystatechange.bind(this, xhr);
+  xhr.send();
+};
+
+fmltc.LabelVideo.prototype.xhr_retrieveModelEntities_onreadystatechange = function(xhr) {
+  if (xhr.readyState === 4) {
+    xhr.onreadystatechange = null;
+
+    if (xhr.status === 200) {
+      const response = JSON.parse(xhr.responseText);
+      // Only models whose TensorFlow Lite model has been created can be used for prelabeling.
+      for (let i = 0; i < response.model_entities.length; i++) {
+        const modelEntity = response.model_entities[i];
+        if (modelEntity.tflite_model_sizes && 'dynamic' in modelEntity.tflite_model_sizes) {
+          const option = document.createElement('option');
+          option.value = modelEntity.model_uuid;
+          option.textContent = modelEntity.description;
+          this.prelabelingModelSelect.appendChild(option);
+        }
+      }
+      if (this.prelabelingModelSelect.options.length == 0 && !this.prelabelingInProgress) {
+        this.prelabelingMessageDiv.textContent =
+            'To enable prelabeling, train a model and download its TensorFlow Lite model.';
+      }
+      this.updateUI(false);
+
+    } else {
+      // TODO(lizlooney): handle error properly
+      console.log('Failure! /retrieveModelEntities?' +
+          ' xhr.status is ' + xhr.status + '. xhr.statusText is ' + xhr.statusText);
+    }
+  }
+};
+
+fmltc.LabelVideo.prototype.prelabelingConfidenceInput_onchange = function() {
+  this.prelabelingConfidenceInput.value = Math.max(this.prelabelingConfidenceInput.min, Math.min(this.prelabelingConfidenceInput.value, this.prelabelingConfidenceInput.max));
+};
+
+fmltc.LabelVideo.prototype.prelabelingStartButton_onclick = function() {
+  this.saveBboxes();
+  this.prelabelingMessageDiv.textContent = 'Starting prelabeling.';
+  this.prelabelingInProgress = true;
+  this.updateUI(false);
+
+  const confidenceThreshold = Math.max(this.prelabelingConfidenceInput.min, Math.min(this.prelabelingConfidenceInput.value, this.prelabelingConfidenceInput.max));
+
+  const xhr = new XMLHttpRequest();
+  const params =
+      'video_uuid=' + encodeURIComponent(this.videoUuid) +
+      '&model_uuid=' + encodeURIComponent(this.prelabelingModelSelect.options[this.prelabelingModelSelect.selectedIndex].value) +
+      '&confidence_threshold=' + encodeURIComponent(confidenceThreshold);
+  xhr.open('POST', '/startPrelabeling', true);
+  xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+  xhr.onreadystatechange = this.xhr_startPrelabeling_onreadystatechange.bind(this, xhr, params);
+  xhr.send(params);
+};
+
+fmltc.LabelVideo.prototype.xhr_startPrelabeling_onreadystatechange = function(xhr, params) {
+  if (xhr.readyState === 4) {
+    xhr.onreadystatechange = null;
+
+    if (xhr.status === 200) {
+      this.prelabelingMessageDiv.textContent = 'Prelabeling is in progress.';
+      setTimeout(this.retrievePrelabelingStatus.bind(this), 10 * 1000);
+
+    } else {
+      // TODO(lizlooney): handle error properly
+      console.log('Failure! /startPrelabeling?' + params +
+          ' xhr.status is ' + xhr.status + '. xhr.statusText is ' + xhr.statusText);
+      this.prelabelingInProgress = false;
+      this.prelabelingMessageDiv.textContent = 'Unable to start prelabeling.';
+      this.updateUI(false);
+    }
+  }
+};
+
+fmltc.LabelVideo.prototype.retrievePrelabelingStatus = function() {
+  const xhr = new XMLHttpRequest();
+  const params = 'video_uuid=' + encodeURIComponent(this.videoUuid);
+  xhr.open('POST', '/retrieveVideoEntity', true);
+  xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+  xhr.onreadystatechange = this.xhr_retrievePrelabelingStatus_onreadystatechange.bind(this, xhr, params);
+  xhr.send(params);
+};
+
+fmltc.LabelVideo.prototype.xhr_retrievePrelabelingStatus_onreadystatechange = function(xhr, params) {
+  if (xhr.readyState === 4) {
+    xhr.onreadystatechange = null;
+
+    if (xhr.status === 200) {
+      const response = JSON.parse(xhr.responseText);
+      const videoEntity = response.video_entity;
+      if (videoEntity.prelabeling_in_progress) {
+        this.prelabelingMessageDiv.textContent = 'Prelabeling is in progress. ' +
+            videoEntity.prelabeled_frame_count + ' frames have been labeled so far.';
+        setTimeout(this.retrievePrelabelingStatus.bind(this), 10 * 1000);
+        return;
+      }
+      this.prelabelingInProgress = false;
+      if (videoEntity.prelabeling_error_message) {
+        this.prelabelingMessageDiv.textContent = videoEntity.prelabeling_error_message;
+      } else {
+        // The proposed boxes are stored on the server. The frames shown here were loaded before
+        // prelabeling, so the page must be reloaded to review the proposed boxes.
+        this.prelabelingMessageDiv.textContent = 'Prelabeling finished. ' +
+            videoEntity.prelabeled_frame_count + ' frames were labeled. ' +
+            'Reload the page to review the proposed boxes.';
+      }
+      this.updateUI(false);
+
+    } else {
+      // TODO(lizlooney): handle error properly
+      console.log('Failure! /retrieveVideoEntity?' + params +
+          ' xhr.status is ' + xhr.status + '. xhr.statusText is ' + xhr.statusText);
+      setTimeout(this.retrievePrelabelingStatus.bind(this), 10 * 1000);
+    }
+  }
+};
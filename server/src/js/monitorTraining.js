@@ -81,34 +81,24 @@ fmltc.MonitorTraining = function(util, modelUuid, modelEntitiesByUuid, datasetEn
   this.trainingScalars = {};
   this.trainingScalars.jobType = 'train';
   this.trainingScalars.valueType = 'scalar';
-  this.trainingScalars.maxItemsPerRequest = 50;
-  this.trainingScalars.parallelization = 2;
+  this.trainingScalars.maxPoints = 800; // The width of the chart, in pixels.
   this.trainingScalars.scalarsHeading = this.trainingScalarsHeading;
   this.trainingScalars.parentDiv = this.trainingScalarsDiv;
-  this.trainingScalars.mapTagToSteps = {}; // map<tag, sortedArray<step>>
   this.trainingScalars.sortedTags = [];
   this.trainingScalars.mapTagToDiv = {}; // map<tag, div>
   this.trainingScalars.mapTagToLineChart = {}; // map<tag, LineChart>
   this.trainingScalars.mapTagToDataTable = {}; // map<tag, DataTable>
-  // items has properties whose names are <step>_<tag> and values are objects with properties
-  // 'step', 'tag', and 'value'. Values are numbers
-  this.trainingScalars.items = {};
 
   this.evalScalars = {};
   this.evalScalars.jobType = 'eval';
   this.evalScalars.valueType = 'scalar';
-  this.evalScalars.maxItemsPerRequest = 50;
-  this.evalScalars.parallelization = 2;
+  this.evalScalars.maxPoints = 800; // The width of the chart, in pixels.
   this.evalScalars.scalarsHeading = this.evalScalarsHeading;
   this.evalScalars.parentDiv = this.evalScalarsDiv;
-  this.evalScalars.mapTagToSteps = {}; // map<tag, sortedArray<step>>
   this.evalScalars.sortedTags = [];
   this.evalScalars.mapTagToDiv = {}; // map<tag, div>
   this.evalScalars.mapTagToLineChart = {}; // map<tag, LineChart>
   this.evalScalars.mapTagToDataTable = {}; // map<tag, DataTable>
-  // items has properties whose names are <step>_<tag> and values are objects with properties
-  // 'step', 'tag', and 'value'. Values are numbers
-  this.evalScalars.items = {};
 
   this.evalImages = {};
   this.evalImages.jobType = 'eval';
@@ -353,8 +343,8 @@ fmltc.MonitorTraining.prototype.xhr_retrieveSummariesUpdated_onreadystatechange
         this.evalUpdated = response.eval_updated;
 
         this.retrieveTagsAndSteps(this.evalImages, 0);
-        this.retrieveTagsAndSteps(this.trainingScalars, 0);
-        this.retrieveTagsAndSteps(this.evalScalars, 0);
+        this.retrieveScalarSeries(this.trainingScalars, 0);
+        this.retrieveScalarSeries(this.evalScalars, 0);
       }
 
       this.decrementRetrieveDataInProgressCounter('scalar');
@@ -418,34 +408,24 @@ fmltc.MonitorTraining.prototype.xhr_retrieveTagsAndSteps_onreadystatechange = fu
       const newMapTagToSteps = {};
       this.addToMapTagToSteps(newStepAndTagPairs, newMapTagToSteps);
 
-      // Add the charts or images.
-      if (o.valueType == 'scalar') {
-        this.addCharts(o, newMapTagToSteps);
-      } else /* if (o.valueType == 'image') */ {
-        this.addImages(o, newMapTagToSteps);
-      }
+      // Add the images. Scalars are retrieved with retrieveScalarSeries instead.
+      this.addImages(o, newMapTagToSteps);
 
       let requestStepAndTagPairs = [];
-      if (o.valueType == 'image') {
-        for (let i = 0; i < newStepAndTagPairs.length; i++) {
-          const stepAndTagPair = newStepAndTagPairs[i];
-          const tag = stepAndTagPair.tag;
-          if (this.util.isDisplayed(o.mapTagToDiv[tag], o.parentDiv)) {
-            requestStepAndTagPairs.push(stepAndTagPair);
+      for (let i = 0; i < newStepAndTagPairs.length; i++) {
+        const stepAndTagPair = newStepAndTagPairs[i];
+        const tag = stepAndTagPair.tag;
+        if (this.util.isDisplayed(o.mapTagToDiv[tag], o.parentDiv)) {
+          requestStepAndTagPairs.push(stepAndTagPair);
+        } else {
+          let steps; // array<step>
+          if (tag in o.mapTagToStepsNotRequestedYet) {
+            steps = o.mapTagToStepsNotRequestedYet[tag];
           } else {
-            let steps; // array<step>
-            if (tag in o.mapTagToStepsNotRequestedYet) {
-              steps = o.mapTagToStepsNotRequestedYet[tag];
-            } else {
-              steps = [];
-              o.mapTagToStepsNotRequestedYet[tag] = steps;
-            }
-            steps.push(stepAndTagPair.step);
+            steps = [];
+            o.mapTagToStepsNotRequestedYet[tag] = steps;
           }
-        }
-      } else {
-        for (let i = 0; i < newStepAndTagPairs.length; i++) {
-          requestStepAndTagPairs.push(newStepAndTagPairs[i]);
+          steps.push(stepAndTagPair.step);
         }
       }
       this.retrieveSummaryItemsInParallel(o, requestStepAndTagPairs);
@@ -467,6 +447,57 @@ fmltc.MonitorTraining.prototype.xhr_retrieveTagsAndSteps_onreadystatechange = fu
   }
 };
 
+fmltc.MonitorTraining.prototype.retrieveScalarSeries = function(o, failureCount) {
+  if (failureCount == 0) {
+    this.incrementRetrieveDataInProgressCounter(o.valueType);
+  }
+
+  const xhr = new XMLHttpRequest();
+  const params =
+      'model_uuid=' + encodeURIComponent(this.modelUuid) +
+      '&job_type=' + encodeURIComponent(o.jobType) +
+      '&max_points=' + encodeURIComponent(o.maxPoints);
+  xhr.open('POST', '/retrieveScalarSeries', true);
+  xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
+  xhr.onreadystatechange = this.xhr_retrieveScalarSeries_onreadystatechange.bind(this, xhr, params,
+      o, failureCount);
+  xhr.send(params);
+};
+
+fmltc.MonitorTraining.prototype.xhr_retrieveScalarSeries_onreadystatechange = function(xhr, params,
+    o, failureCount) {
+  if (xhr.readyState === 4) {
+    xhr.onreadystatechange = null;
+
+    if (xhr.status === 200) {
+      const response = JSON.parse(xhr.responseText);
+
+      const newMapTagToSteps = {};
+      for (const tag in response.series) {
+        newMapTagToSteps[tag] = response.series[tag].steps;
+      }
+      this.addCharts(o, newMapTagToSteps);
+      for (const tag in response.series) {
+        this.setScalarSeries(o, tag, response.series[tag]);
+      }
+
+      this.decrementRetrieveDataInProgressCounter(o.valueType);
+
+    } else {
+      failureCount++;
+      if (failureCount < 2) {
+        const delay = Math.pow(2, failureCount);
+        console.log('Will retry /retrieveScalarSeries?' + params + ' in ' + delay + ' seconds.');
+        setTimeout(this.retrieveScalarSeries.bind(this, o, failureCount), delay * 1000);
+      } else {
+        console.log('Unable to retrieve the scalar series.');
+
+        this.decrementRetrieveDataInProgressCounter(o.valueType);
+      }
+    }
+  }
+};
+
 fmltc.MonitorTraining.prototype.makeKey = function(stepAndTagPair) {
   return stepAndTagPair.step + '_' + stepAndTagPair.tag;
 };
@@ -542,18 +573,11 @@ fmltc.MonitorTraining.prototype.xhr_retrieveSummaryItems_onreadystatechange = fu
         o.items[key] = item;
       }
 
-      if (o.valueType == 'scalar') {
-        for (let i = 0; i < response.summary_items.length; i++) {
-          const item = response.summary_items[i];
-          this.addScalarValue(o, item.tag, item.step, item.value);
-        }
-      } else /* if (o.valueType == 'image') */ {
-        let delayForImage = 0;
-        for (let i = 0; i < response.summary_items.length; i++) {
-          const item = response.summary_items[i];
-          this.addImageValue(o, item.tag, item.step, item.value, delayForImage);
-          delayForImage += 10;
-        }
+      let delayForImage = 0;
+      for (let i = 0; i < response.summary_items.length; i++) {
+        const item = response.summary_items[i];
+        this.addImageValue(o, item.tag, item.step, item.value, delayForImage);
+        delayForImage += 10;
       }
 
       // Request the next batch of summary items.
@@ -852,16 +876,22 @@ fmltc.MonitorTraining.prototype.addCharts = function(o, newMapTagToSteps) {
   }
 };
 
-fmltc.MonitorTraining.prototype.addScalarValue = function(o, tag, step, value) {
+fmltc.MonitorTraining.prototype.setScalarSeries = function(o, tag, series) {
   if (! (tag in o.mapTagToDataTable)) {
     // Try again in 1 second.
-    console.log('Will retry addScalarValue for tag ' + tag + ' in 1 second.');
-    setTimeout(this.addScalarValue.bind(this, o, tag, step, value), 1000);
+    console.log('Will retry setScalarSeries for tag ' + tag + ' in 1 second.');
+    setTimeout(this.setScalarSeries.bind(this, o, tag, series), 1000);
     return;
   }
 
-  o.mapTagToDataTable[tag].addRow([step, value]);
-  o.mapTagToDataTable[tag].sort([{column: 0}])
+  // The series is already downsampled and sorted by step. It replaces whatever was there before.
+  const dataTable = o.mapTagToDataTable[tag];
+  dataTable.removeRows(0, dataTable.getNumberOfRows());
+  const rows = [];
+  for (let i = 0; i < series.steps.length; i++) {
+    rows.push([series.steps[i], series.values[i]]);
+  }
+  dataTable.addRows(rows);
   this.drawChart(o, tag);
 };
 
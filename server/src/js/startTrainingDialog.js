@@ -46,6 +46,8 @@ fmltc.StartTrainingDialog = function(
   this.advancedDiv = document.getElementById('stAdvancedDiv');
   this.maxRunningMinutesInput = document.getElementById('stMaxRunningMinutesInput');
   this.remainingTrainingMinutesSpan = document.getElementById('stRemainingTrainingMinutesSpan');
+  this.exportCheckpointsEveryNInput = document.getElementById('stExportCheckpointsEveryNInput');
+  this.exportBestCheckpointsCheckbox = document.getElementById('stExportBestCheckpointsCheckbox');
   this.startingModelSelect = document.getElementById('stStartingModelSelect');
   this.numTrainingStepsInput = document.getElementById('stNumTrainingStepsInput');
   this.descriptionInput = document.getElementById('stDescriptionInput');
@@ -77,6 +79,12 @@ fmltc.StartTrainingDialog = function(
   this.numTrainingStepsInput.step = this.util.modelTrainerData['checkpoint_every_n'];
   this.updateHelpfulText();
 
+  this.exportCheckpointsEveryNInput.min = 0;
+  this.exportCheckpointsEveryNInput.max = this.util.modelTrainerData['max_training_steps'];
+  this.exportCheckpointsEveryNInput.step = this.util.modelTrainerData['checkpoint_every_n'];
+  this.exportCheckpointsEveryNInput.value = 0;
+  this.exportBestCheckpointsCheckbox.checked = false;
+
   this.descriptionInput.value = '';
 
   this.updateStartButton();
@@ -90,6 +98,7 @@ fmltc.StartTrainingDialog = function(
   this.numTrainingStepsInput.onchange = this.numTrainingStepsInput_onchange.bind(this);
   this.advanced.onclick = this.advanced_onclick.bind(this);
   this.maxRunningMinutesInput.onchange = this.maxRunningMinutesInput_onchange.bind(this);
+  this.exportCheckpointsEveryNInput.onchange = this.exportCheckpointsEveryNInput_onchange.bind(this);
   this.descriptionInput.oninput = this.descriptionInput_oninput.bind(this);
   this.startButton.onclick = this.startButton_onclick.bind(this);
   this.dialog.style.display = 'block';
@@ -177,6 +186,11 @@ fmltc.StartTrainingDialog.prototype.maxRunningMinutesInput_onchange = function()
   this.updateStartButton();
 };
 
+fmltc.StartTrainingDialog.prototype.exportCheckpointsEveryNInput_onchange = function() {
+  this.exportCheckpointsEveryNInput.value = Math.max(this.exportCheckpointsEveryNInput.min, Math.min(Math.round(this.exportCheckpointsEveryNInput.value), this.exportCheckpointsEveryNInput.max));
+  this.updateStartButton();
+};
+
 fmltc.StartTrainingDialog.prototype.descriptionInput_oninput = function() {
   this.updateStartButton();
 };
@@ -188,6 +202,8 @@ fmltc.StartTrainingDialog.prototype.updateStartButton = function() {
       Number(this.numTrainingStepsInput.value) > Number(this.numTrainingStepsInput.max) ||
       Number(this.maxRunningMinutesInput.value) < Number(this.maxRunningMinutesInput.min) ||
       Number(this.maxRunningMinutesInput.value) > Number(this.maxRunningMinutesInput.max) ||
+      Number(this.exportCheckpointsEveryNInput.value) < Number(this.exportCheckpointsEveryNInput.min) ||
+      Number(this.exportCheckpointsEveryNInput.value) > Number(this.exportCheckpointsEveryNInput.max) ||
       this.descriptionInput.value.length == 0 ||
       this.descriptionInput.value.length > this.util.limitData.MAX_DESCRIPTION_LENGTH);
 };
@@ -211,6 +227,8 @@ fmltc.StartTrainingDialog.prototype.startButton_onclick = function() {
       '&starting_model=' + encodeURIComponent(startingModel) +
       '&max_running_minutes=' + this.maxRunningMinutesInput.value +
       '&num_training_steps=' + this.numTrainingStepsInput.value +
+      '&export_checkpoints_every_n=' + this.exportCheckpointsEveryNInput.value +
+      '&export_best_checkpoints=' + this.exportBestCheckpointsCheckbox.checked +
       '&create_time_ms=' + Date.now();
   xhr.open('POST', '/startTrainingModel', true);
   xhr.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded');
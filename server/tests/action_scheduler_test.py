@@ -0,0 +1,148 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Usage, from the server directory:
+#   python -m unittest discover -s tests -p '*_test.py'
+
+# Python Standard Library
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# My Modules
+from app_engine import action_scheduler
+
+
+# Queue keeps the queued actions outside of the state, the way storage keeps them in queued action
+# entities.
+class Queue:
+    def __init__(self, priority):
+        self.state = action_scheduler.create_state(priority)
+        self.queued = []
+
+    def next_queued(self, team_uuid, after_sequence):
+        following = [q for q in self.queued if q['team_uuid'] == team_uuid and q['sequence'] > after_sequence]
+        if len(following) == 0:
+            return None
+        return min(following, key=lambda q: q['sequence'])
+
+    def __remove_started(self, started):
+        self.queued = [q for q in self.queued if q['action_uuid'] not in started]
+        return started
+
+    def submit(self, action_uuid, team_uuid, now=0):
+        self.queued.append(action_scheduler.enqueue(self.state, action_uuid, team_uuid))
+        return self.__remove_started(action_scheduler.dispatch(self.state, now, self.next_queued))
+
+    def finish(self, action_uuid, now=0):
+        return self.__remove_started(action_scheduler.finish(self.state, action_uuid, now, self.next_queued))
+
+    def dispatch(self, now):
+        return self.__remove_started(action_scheduler.dispatch(self.state, now, self.next_queued))
+
+    def running(self):
+        return [r['action_uuid'] for r in self.state['running']]
+
+
+class ActionSchedulerTest(unittest.TestCase):
+    def test_team_cap(self):
+        queue = Queue(action_scheduler.PRIORITY_EXTRACTION)
+        self.assertLess(action_scheduler.MAX_RUNNING_ACTIONS_PER_TEAM,
+            action_scheduler.MAX_RUNNING_ACTIONS[action_scheduler.PRIORITY_EXTRACTION])
+        started = []
+        for i in range(action_scheduler.MAX_RUNNING_ACTIONS_PER_TEAM + 2):
+            started.extend(queue.submit('a%d' % i, 'A'))
+        self.assertEqual(started, ['a%d' % i for i in range(action_scheduler.MAX_RUNNING_ACTIONS_PER_TEAM)])
+        # Another team can still start.
+        self.assertEqual(queue.submit('b0', 'B'), ['b0'])
+        # When one of team A's actions finishes, its next action starts.
+        self.assertEqual(queue.finish('a0'), ['a%d' % action_scheduler.MAX_RUNNING_ACTIONS_PER_TEAM])
+
+    def test_class_cap(self):
+        priority = action_scheduler.PRIORITY_ZIP
+        max_running_actions = action_scheduler.MAX_RUNNING_ACTIONS[priority]
+        queue = Queue(priority)
+        started = []
+        for i in range(max_running_actions):
+            for team_uuid in ['A', 'B']:
+                started.extend(queue.submit('%s%d' % (team_uuid, i), team_uuid))
+        self.assertEqual(len(started), max_running_actions)
+        self.assertEqual(len(queue.running()), max_running_actions)
+        self.assertEqual(len(queue.queued), max_running_actions)
+        # The other classes are not affected.
+        other_queue = Queue(action_scheduler.PRIORITY_DATASET)
+        self.assertEqual(other_queue.submit('C0', 'C'), ['C0'])
+
+    def test_teams_take_turns(self):
+        priority = action_scheduler.PRIORITY_ZIP
+        max_running_actions = action_scheduler.MAX_RUNNING_ACTIONS[priority]
+        queue = Queue(priority)
+        # Team A fills the class, then queues more actions before team B queues any.
+        for i in range(max_running_actions + 4):
+            queue.submit('a%d' % i, 'A')
+        for i in range(4):
+            self.assertEqual(queue.submit('b%d' % i, 'B'), [])
+        started = []
+        for i in range(8):
+            started.extend(queue.finish('a%d' % i))
+        # Team A queued first, so it goes first, but then the teams take turns.
+        self.assertEqual(started,
+            ['a%d' % max_running_actions, 'b0', 'a%d' % (max_running_actions + 1), 'b1',
+             'a%d' % (max_running_actions + 2), 'b2', 'a%d' % (max_running_actions + 3), 'b3'])
+
+    def test_lease_expiration(self):
+        priority = action_scheduler.PRIORITY_ZIP
+        max_running_actions = action_scheduler.MAX_RUNNING_ACTIONS[priority]
+        queue = Queue(priority)
+        for i in range(max_running_actions + 1):
+            queue.submit('a%d' % i, 'A' if i % 2 == 0 else 'B', now=0)
+        self.assertEqual(len(queue.queued), 1)
+        self.assertTrue(action_scheduler.renew(queue.state, 'a0', 500))
+        # The other running actions were killed, so their leases expire, and the queued action starts.
+        now = action_scheduler.LEASE_SECONDS + 1
+        self.assertEqual(queue.dispatch(now), ['a%d' % max_running_actions])
+        self.assertEqual(queue.running(), ['a0', 'a%d' % max_running_actions])
+        self.assertFalse(action_scheduler.renew(queue.state, 'a1', now))
+        self.assertTrue(action_scheduler.renew(queue.state, 'a0', now))
+
+    def test_state_size(self):
+        queue = Queue(action_scheduler.PRIORITY_ADMIN)
+        for i in range(1000):
+            queue.submit('a%d' % i, 'A')
+        # Only the head of each team's queued actions is kept in the state.
+        self.assertEqual(queue.state['teams']['A']['queued_count'], 1000 - action_scheduler.MAX_RUNNING_ACTIONS_PER_TEAM)
+        self.assertLess(len(json.dumps(queue.state)), 2000)
+        # The team is removed from the state when it has no more queued actions.
+        for i in range(1000):
+            queue.finish('a%d' % i)
+        self.assertEqual(queue.state['teams'], {})
+        self.assertEqual(queue.running(), [])
+
+    def test_missing_queued_action(self):
+        queue = Queue(action_scheduler.PRIORITY_ZIP)
+        for i in range(action_scheduler.MAX_RUNNING_ACTIONS_PER_TEAM + 2):
+            queue.submit('a%d' % i, 'A')
+        # If the queued actions are lost, the team is removed instead of waiting forever.
+        queue.queued = []
+        self.assertEqual(queue.finish('a0'), ['a%d' % action_scheduler.MAX_RUNNING_ACTIONS_PER_TEAM])
+        self.assertEqual(queue.state['teams'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Usage, from the server directory:
+#   python -m unittest discover -s tests -p '*_test.py'
+
+# Python Standard Library
+import glob
+import importlib.util
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# Other Modules
+import numpy as np
+
+# My Modules
+import event_file_reader
+
+
+HAS_TENSORFLOW = importlib.util.find_spec('tensorflow') is not None
+
+
+def make_record(data):
+    length_bytes = struct.pack('<Q', len(data))
+    return (length_bytes + struct.pack('<I', event_file_reader.masked_crc32c(length_bytes)) +
+        data + struct.pack('<I', event_file_reader.masked_crc32c(data)))
+
+
+class SplitRecordsTest(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(event_file_reader.split_records(b''), ([], 0, None))
+
+    def test_complete_records(self):
+        first = make_record(b'first')
+        second = make_record(b'second record')
+        records, position, last_crc = event_file_reader.split_records(first + second)
+        self.assertEqual(records, [b'first', b'second record'])
+        self.assertEqual(position, len(first) + len(second))
+        self.assertEqual(last_crc, second[-event_file_reader.RECORD_FOOTER_BYTES:].hex())
+
+    def test_truncated_trailing_record(self):
+        first = make_record(b'first')
+        second = make_record(b'second record')
+        # Cut the second record in its header, its data, and its footer.
+        for cut in (1, event_file_reader.RECORD_HEADER_BYTES + 3, len(second) - 1):
+            records, position, last_crc = event_file_reader.split_records(first + second[:cut])
+            self.assertEqual(records, [b'first'])
+            self.assertEqual(position, len(first))
+            self.assertEqual(last_crc, first[-event_file_reader.RECORD_FOOTER_BYTES:].hex())
+
+    def test_truncated_only_record(self):
+        record = make_record(b'only')
+        self.assertEqual(event_file_reader.split_records(record[:-1]), ([], 0, None))
+
+    def test_bad_length_crc(self):
+        record = bytearray(make_record(b'data'))
+        record[8] ^= 0xff
+        with self.assertRaises(event_file_reader.DataLossError):
+            event_file_reader.split_records(bytes(record))
+
+    def test_bad_length(self):
+        record = bytearray(make_record(b'data'))
+        record[0] ^= 0x01
+        with self.assertRaises(event_file_reader.DataLossError):
+            event_file_reader.split_records(bytes(record))
+
+    def test_bad_data_crc(self):
+        first = make_record(b'first')
+        second = bytearray(make_record(b'second'))
+        second[event_file_reader.RECORD_HEADER_BYTES] ^= 0xff
+        with self.assertRaises(event_file_reader.DataLossError):
+            event_file_reader.split_records(first + bytes(second))
+
+    def test_tailing_in_pieces(self):
+        # Reading the file in pieces, keeping the unconsumed bytes as cf_model_trainer's
+        # __tail_event_file does, gives the same records, offset, and crc as reading it at once.
+        data = b''.join(make_record(b'record %d' % i * (i + 1)) for i in range(20))
+        expected = event_file_reader.split_records(data)
+        for piece_size in (1, 7, 50, 1000):
+            all_records = []
+            buffer = b''
+            offset = 0
+            crc = None
+            for start in range(0, len(data), piece_size):
+                buffer += data[start:start + piece_size]
+                records, position, last_crc = event_file_reader.split_records(buffer)
+                if last_crc is not None:
+                    crc = last_crc
+                buffer = buffer[position:]
+                offset += position
+                all_records.extend(records)
+            self.assertEqual((all_records, offset, crc), expected)
+            # The crc is the footer of the record that ends at offset, which is what
+            # __tail_event_file reads to check that the file wasn't rewritten.
+            self.assertEqual(data[offset - event_file_reader.RECORD_FOOTER_BYTES:offset].hex(), crc)
+
+
+@unittest.skipUnless(HAS_TENSORFLOW, 'tensorflow is not installed')
+class CompareWithTensorFlowTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='event_file_reader_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_event_file(self):
+        import tensorflow as tf
+        writer = tf.summary.create_file_writer(self.folder)
+        with writer.as_default():
+            for step in range(1, 4):
+                tf.summary.scalar('Loss/total_loss', 1.0 / step, step=step)
+                tf.summary.scalar('DetectionBoxes_Precision/mAP', np.float64(0.25 * step), step=step)
+                tf.summary.image('eval_side_by_side',
+                    np.random.RandomState(step).randint(0, 256, size=(2, 8, 12, 3)).astype(np.uint8),
+                    step=step)
+                tf.summary.histogram('weights', np.arange(10, dtype=np.float32) * step, step=step)
+                tf.summary.text('label_map', 'step %d' % step, step=step)
+        writer.flush()
+        writer.close()
+        return glob.glob(os.path.join(self.folder, 'events.out.tfevents.*'))[0]
+
+    def test_events_match(self):
+        import tensorflow as tf
+        event_file_path = self.write_event_file()
+        events = event_file_reader.read_events(event_file_path)
+        tf_events = list(tf.compat.v1.train.summary_iterator(event_file_path))
+        self.assertEqual(len(events), len(tf_events))
+        value_count = 0
+        for event, tf_event in zip(events, tf_events):
+            self.assertEqual(event.wall_time, tf_event.wall_time)
+            self.assertEqual(event.step, tf_event.step)
+            self.assertEqual(len(event.summary_values), len(tf_event.summary.value))
+            for value, tf_value in zip(event.summary_values, tf_event.summary.value):
+                value_count += 1
+                self.assertEqual(value.tag, tf_value.tag)
+                self.assertEqual(value.plugin_name, tf_value.metadata.plugin_data.plugin_name)
+                if tf_value.HasField('simple_value'):
+                    self.assertEqual(value.simple_value, tf_value.simple_value)
+                if tf_value.HasField('tensor'):
+                    array = event_file_reader.make_ndarray(value.tensor)
+                    tf_array = tf.make_ndarray(tf_value.tensor)
+                    self.assertEqual(array.dtype, tf_array.dtype)
+                    self.assertEqual(array.shape, tf_array.shape)
+                    self.assertTrue(np.array_equal(array, tf_array))
+        self.assertEqual(value_count, 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
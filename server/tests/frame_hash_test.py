@@ -0,0 +1,98 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Usage, from the server directory:
+#   python -m unittest discover -s tests -p '*_test.py'
+
+# Python Standard Library
+import os
+import random
+import time
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# My Modules
+from app_engine import frame_hash
+
+
+# brute_force_groups compares every pair of frames and returns the same dict as
+# frame_hash.find_near_duplicates.
+def brute_force_groups(dict_frame_number_to_dhash, max_distance):
+    frame_numbers = sorted(dict_frame_number_to_dhash.keys())
+    representative = {frame_number: frame_number for frame_number in frame_numbers}
+    for i, a in enumerate(frame_numbers):
+        for b in frame_numbers[i + 1:]:
+            if frame_hash.hamming_distance(dict_frame_number_to_dhash[a], dict_frame_number_to_dhash[b]) <= max_distance:
+                old = max(representative[a], representative[b])
+                new = min(representative[a], representative[b])
+                for frame_number in frame_numbers:
+                    if representative[frame_number] == old:
+                        representative[frame_number] = new
+    return representative
+
+
+def random_dhashes(rng, frame_count, max_distance):
+    # A few base hashes, each with many nearby hashes, so that groups chain together.
+    bases = [rng.getrandbits(frame_hash.DHASH_BITS) for i in range(4)]
+    dict_frame_number_to_dhash = {}
+    for frame_number in range(frame_count):
+        value = rng.choice(bases)
+        for bit in rng.sample(range(frame_hash.DHASH_BITS), rng.randint(0, 2 * max_distance)):
+            value ^= 1 << bit
+        dict_frame_number_to_dhash[frame_number] = '%016x' % value
+    return dict_frame_number_to_dhash
+
+
+class FindNearDuplicatesTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        for run in range(200):
+            max_distance = rng.randint(0, 8)
+            dict_frame_number_to_dhash = random_dhashes(rng, rng.randint(1, 60), max_distance)
+            self.assertEqual(
+                frame_hash.find_near_duplicates(dict_frame_number_to_dhash, max_distance),
+                brute_force_groups(dict_frame_number_to_dhash, max_distance))
+
+    def test_chain_through_later_member(self):
+        # 0 and 2 are far apart, but both are near 1, which comes last.
+        dict_frame_number_to_dhash = {
+            0: '0000000000000000',
+            2: '00000000000000ff',
+            1: '000000000000000f',
+        }
+        self.assertEqual(frame_hash.find_near_duplicates(dict_frame_number_to_dhash, 4),
+            {0: 0, 1: 0, 2: 0})
+
+    def test_many_identical_hashes(self):
+        # A static scene, with a few frames where something moves.
+        frame_count = 5000
+        dict_frame_number_to_dhash = {frame_number: '0f0f0f0f0f0f0f0f' for frame_number in range(frame_count)}
+        dict_frame_number_to_dhash[1000] = '0f0f0f0f0f0f0f0e'
+        dict_frame_number_to_dhash[2000] = 'f0f0f0f0f0f0f0f0'
+        dict_frame_number_to_dhash[2001] = 'f0f0f0f0f0f0f0f0'
+        start = time.monotonic()
+        result = frame_hash.find_near_duplicates(dict_frame_number_to_dhash, frame_hash.MAX_MAX_DISTANCE)
+        self.assertLess(time.monotonic() - start, 1)
+        expected = {frame_number: 0 for frame_number in range(frame_count)}
+        expected[2000] = 2000
+        expected[2001] = 2000
+        self.assertEqual(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# CPU latency benchmark for TensorFlow Lite models.
+#
+# The model is loaded in tf.lite.Interpreter with a fixed number of threads, run a few times to
+# warm up, and then timed on real frames. cf_tflite_creator runs it after each model is created and
+# stores the results in the model entity. The numbers come from the cloud function's CPU, not the
+# robot's, so they are for comparing models with each other.
+#
+# Usage, from the server directory:
+#   python tflite_benchmark.py model_with_metadata.tflite --images frame1.jpg frame2.jpg
+#   python tflite_benchmark.py model_with_metadata.tflite --records 'train_dataset.record-?????-00004'
+
+# Python Standard Library
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+# Other Modules
+import numpy as np
+import PIL.Image
+import psutil
+import tensorflow as tf
+
+
+# The Control Hub and the Robot Controller phones have 4 cores.
+NUM_THREADS = 4
+WARMUP_RUNS = 5
+TIMED_RUNS = 50
+FRAME_COUNT = 10
+
+
+# read_frames_from_records returns up to count frames, as RGB numpy arrays, from the TFRecord files
+# that match the given patterns.
+def read_frames_from_records(patterns, count=FRAME_COUNT):
+    filenames = []
+    for pattern in patterns:
+        filenames.extend(tf.io.gfile.glob(pattern))
+    frames = []
+    feature_description = {
+        'image/encoded': tf.io.FixedLenFeature([], tf.string),
+    }
+    for record in tf.data.TFRecordDataset(sorted(filenames)).take(count):
+        example = tf.io.parse_single_example(record, feature_description)
+        frames.append(__decode_image(example['image/encoded'].numpy()))
+    return frames
+
+
+def __decode_image(image_bytes):
+    return np.asarray(PIL.Image.open(io.BytesIO(image_bytes)).convert('RGB'))
+
+
+def __prepare_input(frame, input_detail):
+    _, height, width, _ = input_detail['shape']
+    image = np.asarray(PIL.Image.fromarray(frame).resize((width, height)), dtype=np.float32)
+    if input_detail['dtype'] == np.float32:
+        # Normalize to [-1, 1], matching the input_norm_mean and input_norm_std in the metadata.
+        image = (image - 127.5) / 127.5
+    return np.expand_dims(image.astype(input_detail['dtype']), 0)
+
+
+# benchmark returns a dict with the p50 and p95 latency in milliseconds, the peak memory used by
+# the interpreter in bytes, and the model size in bytes. model is either the filename or the
+# content of the model.
+def benchmark(model, frames, num_threads=NUM_THREADS, warmup_runs=WARMUP_RUNS, timed_runs=TIMED_RUNS):
+    process = psutil.Process()
+    base_rss = process.memory_info().rss
+    if isinstance(model, bytes):
+        interpreter = tf.lite.Interpreter(model_content=model, num_threads=num_threads)
+        model_size = len(model)
+    else:
+        interpreter = tf.lite.Interpreter(model_path=model, num_threads=num_threads)
+        model_size = os.path.getsize(model)
+    interpreter.allocate_tensors()
+    input_detail = interpreter.get_input_details()[0]
+    inputs = [__prepare_input(frame, input_detail) for frame in frames]
+    peak_rss = process.memory_info().rss
+
+    latencies = []
+    for i in range(warmup_runs + timed_runs):
+        interpreter.set_tensor(input_detail['index'], inputs[i % len(inputs)])
+        start = time.perf_counter()
+        interpreter.invoke()
+        if i >= warmup_runs:
+            latencies.append(time.perf_counter() - start)
+        peak_rss = max(peak_rss, process.memory_info().rss)
+
+    return {
+        'p50_latency_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+        'p95_latency_ms': round(float(np.percentile(latencies, 95)) * 1000, 3),
+        'peak_memory_bytes': max(peak_rss - base_rss, 0),
+        'model_size_bytes': model_size,
+        'num_threads': num_threads,
+        'timed_runs': timed_runs,
+        'input_type': np.dtype(input_detail['dtype']).name,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the CPU latency of a TensorFlow Lite model.')
+    parser.add_argument('model', help='The .tflite file.')
+    parser.add_argument('--images', nargs='+', default=[],
+        help='Image files to run the model on.')
+    parser.add_argument('--records', nargs='+', default=[],
+        help='TFRecord files or patterns to read frames from.')
+    parser.add_argument('--threads', type=int, default=NUM_THREADS)
+    parser.add_argument('--warmup_runs', type=int, default=WARMUP_RUNS)
+    parser.add_argument('--runs', type=int, default=TIMED_RUNS)
+    args = parser.parse_args(argv)
+
+    frames = []
+    for filename in args.images:
+        with open(filename, 'rb') as f:
+            frames.append(__decode_image(f.read()))
+    if len(args.records) > 0:
+        frames.extend(read_frames_from_records(args.records))
+    if len(frames) == 0:
+        parser.error('Give at least one image with --images or --records.')
+
+    result = benchmark(args.model, frames, args.threads, args.warmup_runs, args.runs)
+    result.update({
+        'model': args.model,
+        'tensorflow_version': tf.__version__,
+        'python_version': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    })
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
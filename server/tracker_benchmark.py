@@ -0,0 +1,345 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "lizlooney@google.com (Liz Looney)"
+
+# Offline benchmark for the trackers in cf_tracking.tracker_fns.
+#
+# Each tracker is run over a corpus of videos that have ground truth boxes, the same way that
+# cf_tracking.start_tracking runs it: one tracker per box, initialized with the boxes enlarged by
+# scale, and the tracked boxes shrunk by scale again. The corpus contains generated
+# moving-rectangle videos, so no network or stored videos are needed, plus any recorded videos
+# given on the command line.
+#
+# Usage, from the server directory:
+#   python tracker_benchmark.py --output tracker_benchmark.json
+#   python tracker_benchmark.py --trackers CSRT,KCF --resolutions 720p --recorded video.mp4 labels.json
+#
+# The labels file for a recorded video is a JSON list with one bboxes_text string per frame,
+# in the same format that is stored in the VideoFrame entities.
+
+# Python Standard Library
+import argparse
+import json
+import logging
+import math
+import platform
+import sys
+import time
+
+# Other Modules
+import cv2
+import numpy as np
+import psutil
+
+# My Modules
+from app_engine import bbox_writer
+from cf_tracking import tracker_fns
+
+
+RESOLUTIONS = {
+    '360p': (640, 360),
+    '480p': (854, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+# A tracked box whose IoU with the ground truth falls below this value is counted as a failure,
+# even if the tracker reported success.
+FAILURE_IOU_THRESHOLD = 0.1
+
+# The IoU drift is reported as the mean IoU in each of this many equal windows of the video.
+DRIFT_WINDOW_COUNT = 10
+
+
+def generate_synthetic_video(width, height, frame_count, box_count, seed):
+    rng = np.random.default_rng(seed)
+    # A blurred noise background gives the trackers something to lock onto besides the boxes.
+    background = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (0, 0), sigmaX=max(width, height) / 200)
+
+    objects = []
+    for i in range(box_count):
+        box_width = int(width * rng.uniform(0.06, 0.14))
+        box_height = int(height * rng.uniform(0.1, 0.22))
+        # Each object has its own textured appearance.
+        texture = rng.integers(0, 256, size=(box_height, box_width, 3), dtype=np.uint8)
+        color = rng.integers(0, 256, size=3)
+        texture = ((texture.astype(np.uint16) + color) // 2).astype(np.uint8)
+        cv2.rectangle(texture, (0, 0), (box_width - 1, box_height - 1), (255, 255, 255), 2)
+        speed = rng.uniform(0.002, 0.008) * width
+        angle = rng.uniform(0, 2 * math.pi)
+        objects.append({
+            'texture': texture,
+            'x': rng.uniform(0, width - box_width),
+            'y': rng.uniform(0, height - box_height),
+            'dx': speed * math.cos(angle),
+            'dy': speed * math.sin(angle),
+        })
+
+    frames = []
+    bboxes_texts = []
+    for frame_number in range(frame_count):
+        frame = background.copy()
+        bboxes_text = ''
+        for i, o in enumerate(objects):
+            box_height, box_width = o['texture'].shape[:2]
+            x1 = int(o['x'])
+            y1 = int(o['y'])
+            frame[y1:y1 + box_height, x1:x1 + box_width] = o['texture']
+            bboxes_text += '%d,%d,%d,%d,object%d\n' % (x1, y1, x1 + box_width, y1 + box_height, i)
+            # Move the object, bouncing off the edges of the frame.
+            o['x'] += o['dx']
+            o['y'] += o['dy']
+            if o['x'] < 0 or o['x'] > width - box_width:
+                o['dx'] = -o['dx']
+                o['x'] = min(max(o['x'], 0), width - box_width)
+            if o['y'] < 0 or o['y'] > height - box_height:
+                o['dy'] = -o['dy']
+                o['y'] = min(max(o['y'], 0), height - box_height)
+        frames.append(frame)
+        bboxes_texts.append(bboxes_text)
+    return frames, bboxes_texts
+
+
+def load_recorded_video(video_filename, labels_filename):
+    with open(labels_filename) as f:
+        bboxes_texts = json.load(f)
+    frames = []
+    vid = cv2.VideoCapture(video_filename)
+    if not vid.isOpened():
+        raise RuntimeError('Unable to open video %s' % video_filename)
+    try:
+        while len(frames) < len(bboxes_texts):
+            success, frame = vid.read()
+            if not success:
+                break
+            frames.append(frame)
+    finally:
+        vid.release()
+    return frames, bboxes_texts[:len(frames)]
+
+
+def __iou(rect_a, rect_b):
+    x1 = max(rect_a[0], rect_b[0])
+    y1 = max(rect_a[1], rect_b[1])
+    x2 = min(rect_a[2], rect_b[2])
+    y2 = min(rect_a[3], rect_b[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    area_a = (rect_a[2] - rect_a[0]) * (rect_a[3] - rect_a[1])
+    area_b = (rect_b[2] - rect_b[0]) * (rect_b[3] - rect_b[1])
+    union = area_a + area_b - intersection
+    if union <= 0:
+        return 0.0
+    return intersection / union
+
+
+def __rects_by_label(bboxes_text):
+    rects, labels = bbox_writer.convert_text_to_rects_and_labels(bboxes_text)
+    return dict(zip(labels, rects))
+
+
+def run_tracker(tracker_name, frames, bboxes_texts, scale):
+    tracker_fn = tracker_fns[tracker_name]
+    height, width = frames[0].shape[:2]
+    process = psutil.Process()
+    base_rss = process.memory_info().rss
+    peak_rss = base_rss
+
+    # Create the trackers, one per bbox, the same way cf_tracking does.
+    bboxes, labels = bbox_writer.parse_bboxes_text(bboxes_texts[0], scale)
+    trackers = []
+    for bbox in bboxes:
+        rect = np.array(bbox, dtype=float).astype(int)
+        tracker = tracker_fn()
+        try:
+            success = tracker.init(frames[0], tuple(rect))
+        except:
+            success = False
+        trackers.append(tracker if success else None)
+    peak_rss = max(peak_rss, process.memory_info().rss)
+
+    update_seconds = 0
+    box_frame_count = 0
+    box_frame_failures = 0
+    boxes_that_failed = set()
+    ious_per_frame = []
+    for frame_number in range(1, len(frames)):
+        frame = frames[frame_number]
+        tracked_bboxes = []
+        start = time.perf_counter()
+        for tracker in trackers:
+            if tracker is None:
+                tracked_bboxes.append(None)
+                continue
+            success, tuple_ = tracker.update(frame)
+            tracked_bboxes.append(np.array(tuple_) if success else None)
+        update_seconds += time.perf_counter() - start
+        peak_rss = max(peak_rss, process.memory_info().rss)
+
+        tracked_rects = __rects_by_label(
+            bbox_writer.format_bboxes_text(tracked_bboxes, labels, scale, width, height))
+        expected_rects = __rects_by_label(bboxes_texts[frame_number])
+        frame_ious = []
+        for label in labels:
+            if label not in expected_rects:
+                continue
+            box_frame_count += 1
+            iou = 0.0
+            if label in tracked_rects:
+                iou = __iou(tracked_rects[label], expected_rects[label])
+            if iou < FAILURE_IOU_THRESHOLD:
+                box_frame_failures += 1
+                boxes_that_failed.add(label)
+            frame_ious.append(iou)
+        ious_per_frame.append(frame_ious)
+
+    tracked_frame_count = len(frames) - 1
+    window_size = max(1, math.ceil(len(ious_per_frame) / DRIFT_WINDOW_COUNT))
+    iou_windows = []
+    for i in range(0, len(ious_per_frame), window_size):
+        window = [iou for frame_ious in ious_per_frame[i:i + window_size] for iou in frame_ious]
+        iou_windows.append(round(float(np.mean(window)), 4) if len(window) > 0 else None)
+    all_ious = [iou for frame_ious in ious_per_frame for iou in frame_ious]
+    return {
+        'frames_per_second': round(tracked_frame_count / update_seconds, 2) if update_seconds > 0 else None,
+        'box_failure_rate': round(len(boxes_that_failed) / len(labels), 4) if len(labels) > 0 else None,
+        'box_frame_failure_rate': round(box_frame_failures / box_frame_count, 4) if box_frame_count > 0 else None,
+        'mean_iou': round(float(np.mean(all_ious)), 4) if len(all_ious) > 0 else None,
+        'iou_windows': iou_windows,
+        'iou_drift': (round(iou_windows[0] - iou_windows[-1], 4)
+            if len(iou_windows) > 0 and iou_windows[0] is not None and iou_windows[-1] is not None else None),
+        'init_failures': trackers.count(None),
+        'peak_memory_mb': round((peak_rss - base_rss) / (1024 * 1024), 2),
+    }
+
+
+def __make_corpus(args):
+    corpus = []
+    for resolution in args.resolutions.split(','):
+        if resolution not in RESOLUTIONS:
+            raise ValueError('Unknown resolution %s. Choose from %s.' % (resolution, ', '.join(RESOLUTIONS)))
+        width, height = RESOLUTIONS[resolution]
+        for box_count in [int(b) for b in args.box_counts.split(',')]:
+            for seed in range(args.seeds):
+                frames, bboxes_texts = generate_synthetic_video(width, height, args.frame_count, box_count, seed)
+                corpus.append({
+                    'video': 'synthetic_%s_%dboxes_seed%d' % (resolution, box_count, seed),
+                    'resolution': resolution,
+                    'box_count': box_count,
+                    'frames': frames,
+                    'bboxes_texts': bboxes_texts,
+                })
+    for video_filename, labels_filename in (args.recorded or []):
+        frames, bboxes_texts = load_recorded_video(video_filename, labels_filename)
+        if len(frames) < 2:
+            logging.warning('Skipping %s because it has fewer than 2 labeled frames.' % video_filename)
+            continue
+        height, width = frames[0].shape[:2]
+        corpus.append({
+            'video': video_filename,
+            'resolution': '%dx%d' % (width, height),
+            'box_count': bbox_writer.count_boxes(bboxes_texts[0]),
+            'frames': frames,
+            'bboxes_texts': bboxes_texts,
+        })
+    return corpus
+
+
+def __summarize(results):
+    # Average the per-video results for each tracker, resolution, box count, and scale.
+    groups = {}
+    for result in results:
+        key = (result['tracker_name'], result['resolution'], result['box_count'], result['scale'])
+        groups.setdefault(key, []).append(result)
+    summary = []
+    for (tracker_name, resolution, box_count, scale), group in sorted(groups.items()):
+        item = {
+            'tracker_name': tracker_name,
+            'resolution': resolution,
+            'box_count': box_count,
+            'scale': scale,
+            'video_count': len(group),
+        }
+        for metric in ['frames_per_second', 'box_failure_rate', 'box_frame_failure_rate', 'mean_iou',
+                'iou_drift', 'peak_memory_mb']:
+            values = [r[metric] for r in group if r[metric] is not None]
+            item[metric] = round(float(np.mean(values)), 4) if len(values) > 0 else None
+        summary.append(item)
+    return summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the object trackers used for labeling.')
+    parser.add_argument('--trackers', default=','.join(tracker_fns.keys()),
+        help='Comma separated tracker names. Default: all trackers.')
+    parser.add_argument('--resolutions', default='480p,720p',
+        help='Comma separated resolutions for the generated videos. Choose from %s.' % ', '.join(RESOLUTIONS))
+    parser.add_argument('--box_counts', default='1,3',
+        help='Comma separated numbers of boxes for the generated videos.')
+    parser.add_argument('--scales', default='1,1.3,2',
+        help='Comma separated scale values, as chosen on the label video page.')
+    parser.add_argument('--frame_count', type=int, default=150,
+        help='Number of frames in each generated video.')
+    parser.add_argument('--seeds', type=int, default=2,
+        help='Number of generated videos for each resolution and box count.')
+    parser.add_argument('--recorded', nargs=2, action='append', metavar=('VIDEO', 'LABELS'),
+        help='A recorded video and its JSON labels file. May be given more than once.')
+    parser.add_argument('--output',
+        help='File to write the JSON results to. Default: standard output.')
+    args = parser.parse_args(argv)
+
+    tracker_names = args.trackers.split(',')
+    for tracker_name in tracker_names:
+        if tracker_name not in tracker_fns:
+            parser.error('Unknown tracker %s. Choose from %s.' % (tracker_name, ', '.join(tracker_fns)))
+    scales = [float(s) for s in args.scales.split(',')]
+
+    results = []
+    for video in __make_corpus(args):
+        for tracker_name in tracker_names:
+            for scale in scales:
+                result = run_tracker(tracker_name, video['frames'], video['bboxes_texts'], scale)
+                result.update({
+                    'tracker_name': tracker_name,
+                    'video': video['video'],
+                    'resolution': video['resolution'],
+                    'box_count': video['box_count'],
+                    'scale': scale,
+                    'frame_count': len(video['frames']),
+                })
+                logging.info('%s %s scale=%g: %.1f fps, failure rate %s, mean IoU %s' % (
+                    tracker_name, video['video'], scale, result['frames_per_second'] or 0,
+                    result['box_failure_rate'], result['mean_iou']))
+                results.append(result)
+
+    report = {
+        'opencv_version': cv2.__version__,
+        'python_version': platform.python_version(),
+        'machine': platform.machine(),
+        'failure_iou_threshold': FAILURE_IOU_THRESHOLD,
+        'summary': __summarize(results),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    main(sys.argv[1:])
@@ -401,6 +401,23 @@ resource "google_datastore_index" "adminAction1" {
   depends_on = [google_app_engine_application.fmltc-app]
 }
 
+resource "google_datastore_index" "queuedAction1" {
+  kind = "QueuedAction"
+  properties {
+    name = "priority"
+    direction = "ASCENDING"
+  }
+  properties {
+    name = "team_uuid"
+    direction = "ASCENDING"
+  }
+  properties {
+    name = "sequence"
+    direction = "ASCENDING"
+  }
+  depends_on = [google_app_engine_application.fmltc-app]
+}
+
 resource "google_datastore_index" "endOfSeason1" {
   kind = "EndOfSeason"
   properties {
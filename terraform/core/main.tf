@@ -70,6 +70,7 @@ data "archive_file" "cloud-function-src" {
   output_path = "${path.root}/../../generated/gcf-src.zip"
   excludes = [
     "__pycache__",
+    "action_import_profile.py",
     "app_engine/.app_engine_ignore",
     "app_engine/announcements.py",
     "app_engine/app.yaml",
@@ -79,16 +80,22 @@ data "archive_file" "cloud-function-src" {
     "app_engine/dataset_producer.py",
     "app_engine/dataset_zipper.py",
     "app_engine/env_variables.yaml",
+    "app_engine/gunicorn.conf.py",
     "app_engine/oidc.py",
+    "app_engine/prelabeler.py",
     "app_engine/requirements.txt",
     "app_engine/roles.py",
     "app_engine/team_info.py",
     "app_engine/test_routes.py",
     "app_engine/tracking.py",
     "app_engine/wrappers.py",
+    "local_backend.py",
+    "pipeline_benchmark.py",
     "src",
     "static",
-    "templates"
+    "templates",
+    "tests",
+    "tracker_benchmark.py"
   ]
 }
 
@@ -154,7 +161,7 @@ resource "google_app_engine_standard_app_version" "fmltc-app-v1" {
   version_id = "v1"
 
   entrypoint {
-    shell = "gunicorn -b :$PORT app_engine:app"
+    shell = "gunicorn -c gunicorn.conf.py -b :$PORT app_engine:app"
   }
 
   #
@@ -164,8 +171,12 @@ resource "google_app_engine_standard_app_version" "fmltc-app-v1" {
   #
   # max_idle_instances controls how fast the scheduler will take an instance offline after a load spike.
   #
+  # max_concurrent_requests counts the tracking long polls, which mostly wait on Datastore for up
+  # to tracking.LONG_POLL_SECONDS. The gevent worker (see gunicorn.conf.py) handles many of them
+  # at once, so the limit is well above the default of 10 and below worker_connections.
+  #
   automatic_scaling {
-    max_concurrent_requests = 20
+    max_concurrent_requests = 80
     min_idle_instances = 0
     max_idle_instances = 2
     min_pending_latency = "0.1s"